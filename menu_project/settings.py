@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "treemenu.middleware.MenuTimingMiddleware",  # Server-Timing для меню (при TREEMENU_INSTRUMENTATION)
+    "treemenu.middleware.MenuReplicaMiddleware",  # read-your-writes для реплики (при TREEMENU_REPLICA_DB)
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -79,9 +81,17 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # Реплика для чтения меню (TREEMENU_REPLICA_DB). Локально - тот же файл
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    },
 }
 
+# Чтения treemenu - из реплики, записи - в основную БД (см. treemenu/routers.py)
+DATABASE_ROUTERS = ["treemenu.routers.MenuReplicaRouter"]
+
 # Для production используем PostgreSQL (как требуется в вакансии)
 # DATABASES = {
 #     "default": {
@@ -95,6 +105,27 @@ DATABASES = {
 # }
 
 
+# Кэш меню должен быть общим для всех воркеров: версии меню хранятся в нём.
+# Для разработки - файловый кэш (общий для процессов одной машины)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "django_cache",
+        # По умолчанию 300 записей: у меню N + 1 вариантов HTML на аудиторию,
+        # при переполнении кэш удаляет треть записей, в том числе деревья
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# Для production - Redis (общий для всех серверов)
+# CACHES = {
+#     "default": {
+#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
+#         "LOCATION": "redis://127.0.0.1:6379",
+#     }
+# }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -136,6 +167,27 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Инструментирование меню: заголовок Server-Timing и счётчики /debug/menu-stats/
+TREEMENU_INSTRUMENTATION = DEBUG
+
+# Алиас реплики для чтения меню (None - всё читается из основной БД)
+# и сколько секунд после изменения меню читать его из основной БД
+TREEMENU_REPLICA_DB = None
+TREEMENU_PRIMARY_DB = "default"
+TREEMENU_REPLICA_STICKY_SECONDS = 10
+
+# Меню на сайте и в API by-name - из опубликованных снимков (команда publish_menu),
+# правка пунктов остаётся черновиком до публикации
+TREEMENU_SNAPSHOTS = False
+
+# Меню из файлов команды prerender_menus (без БД и кэша на узле);
+# меню и варианты, которых нет в выпуске, рисуются обычным путём
+TREEMENU_STATIC_MENUS = False
+TREEMENU_STATIC_DIR = BASE_DIR / "menu_static"
+
+# Прогрев кэша всех меню при первом запросе воркера (см. команду warm_menus)
+TREEMENU_WARM_ON_STARTUP = False
+
 # DRF настройки
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
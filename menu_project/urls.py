@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from treemenu.api_views import MenuItemViewSet
+from treemenu.api_views import MenuItemViewSet, menu_by_name_async, menu_detail_async
 
 # DRF Router для API
 router = DefaultRouter()
@@ -10,5 +10,8 @@ router.register(r'menu', MenuItemViewSet, basename='menu')
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),  # DRF API endpoints
+    # Асинхронные варианты для ASGI (uvicorn menu_project.asgi:application)
+    path('api/async/menu/by-name/<str:menu_name>/', menu_by_name_async, name='menu-async-by-name'),
+    path('api/async/menu/<int:id>/', menu_detail_async, name='menu-async-detail'),
     path('', include('treemenu.urls')),
 ]
@@ -1,5 +1,32 @@
-from django.contrib import admin
-from .models import MenuItem
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Exists, OuterRef
+from django.utils.http import urlencode
+
+from .models import MenuItem, MenuSnapshot
+from .snapshots import publish_menus
+
+
+class ParentAutocompleteSelect(AutocompleteSelect):
+    """
+    Автодополнение родителя с ограничением по меню.
+    Параметры добавляются к URL автодополнения и учитываются
+    в MenuItemAdmin.get_search_results.
+    """
+
+    def __init__(self, *args, menu_name=None, exclude_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.menu_name = menu_name
+        self.exclude_id = exclude_id
+
+    def get_url(self):
+        url = super().get_url()
+        params = {}
+        if self.menu_name:
+            params['menu_name'] = self.menu_name
+        if self.exclude_id:
+            params['exclude_id'] = self.exclude_id
+        return f'{url}?{urlencode(params)}' if params else url
 
 
 @admin.register(MenuItem)
@@ -8,11 +35,16 @@ class MenuItemAdmin(admin.ModelAdmin):
     Админка для управления пунктами меню.
     """
     list_display = ('title', 'menu_name', 'parent', 'url', 'named_url', 'order', 'has_children')
-    list_filter = ('menu_name',)
+    # parent - nullable FK, без явного указания select_related его не подтянет
+    list_select_related = ('parent',)
+    list_filter = ('menu_name', 'visibility')
     list_editable = ('order',)
     search_fields = ('title', 'url', 'named_url', 'menu_name')
     ordering = ('menu_name', 'order', 'title')
     readonly_fields = ('id',)
+    # Вместо <select> со всеми пунктами меню - поиск с подгрузкой по 20 штук
+    autocomplete_fields = ('parent',)
+    actions = ('publish_selected_menus',)
     
     fieldsets = (
         (None, {
@@ -23,29 +55,86 @@ class MenuItemAdmin(admin.ModelAdmin):
             'description': 'Укажите либо явный URL, либо named URL (из urls.py). '
                           'Если указаны оба, приоритет у named_url.'
         }),
+        ('Видимость', {
+            'fields': ('visibility', 'groups'),
+            'description': 'Скрытый пункт скрывает и всех своих потомков.'
+        }),
     )
     
+    def get_queryset(self, request):
+        """Наличие детей считается подзапросом EXISTS, а не запросом на строку"""
+        children = MenuItem.objects.filter(parent_id=OuterRef('pk'))
+        return super().get_queryset(request).annotate(_has_children=Exists(children))
+    
     def has_children(self, obj):
         """Показывает есть ли у пункта дети"""
-        return obj.children.exists()
+        return obj._has_children
     has_children.boolean = True
     has_children.short_description = 'Есть дети'
+    has_children.admin_order_field = '_has_children'
+    
+    @admin.action(description='Опубликовать меню выбранных пунктов')
+    def publish_selected_menus(self, request, queryset):
+        """Публикует меню целиком (см. snapshots.py), а не только выбранные пункты"""
+        published = publish_menus(queryset.values_list('menu_name', flat=True).distinct())
+        self.message_user(request, f'Опубликовано меню: {", ".join(published)}', messages.SUCCESS)
+    
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Для автодополнения родителя - только пункты того же меню
+        (кроме самого пункта) в порядке дерева: фильтр и сортировка
+        идут по индексам menu_name и path.
+        """
+        if request.GET.get('field_name') == 'parent' and request.GET.get('model_name') == 'menuitem':
+            menu_name = request.GET.get('menu_name')
+            if menu_name:
+                queryset = queryset.filter(menu_name=menu_name).order_by('path')
+            exclude_id = request.GET.get('exclude_id')
+            if exclude_id and exclude_id.isdigit():
+                queryset = queryset.exclude(pk=exclude_id)
+        return super().get_search_results(request, queryset, search_term)
     
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """
         Фильтруем выбор родителя - показываем только пункты того же меню.
         Это предотвращает ошибки при создании дерева.
+        
+        Варианты не загружаются в форму: виджет автодополнения отрисовывает
+        только выбранного родителя, а queryset нужен для проверки значения.
         """
         if db_field.name == 'parent':
             # При редактировании существующего объекта
-            if request.resolver_match.kwargs.get('object_id'):
-                obj_id = request.resolver_match.kwargs['object_id']
-                try:
-                    obj = MenuItem.objects.get(pk=obj_id)
-                    # Показываем только пункты из того же меню, исключая сам объект
-                    kwargs['queryset'] = MenuItem.objects.filter(
-                        menu_name=obj.menu_name
-                    ).exclude(pk=obj_id)
-                except MenuItem.DoesNotExist:
-                    pass
+            obj_id = request.resolver_match.kwargs.get('object_id')
+            menu_name = None
+            if obj_id:
+                menu_name = MenuItem.objects.filter(pk=obj_id).values_list('menu_name', flat=True).first()
+            if menu_name is not None:
+                # Показываем только пункты из того же меню, исключая сам объект
+                kwargs['queryset'] = MenuItem.objects.filter(menu_name=menu_name).exclude(pk=obj_id)
+            kwargs['widget'] = ParentAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get('using'),
+                menu_name=menu_name, exclude_id=obj_id if menu_name is not None else None,
+            )
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(MenuSnapshot)
+class MenuSnapshotAdmin(admin.ModelAdmin):
+    """
+    Опубликованные меню: только просмотр и повторная публикация.
+    Снимки создаются публикацией, а не редактированием.
+    """
+    list_display = ('menu_name', 'items_count', 'published_at')
+    ordering = ('menu_name',)
+    actions = ('republish',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    @admin.action(description='Опубликовать заново из текущих пунктов')
+    def republish(self, request, queryset):
+        published = publish_menus(queryset.values_list('menu_name', flat=True))
+        self.message_user(request, f'Опубликовано меню: {", ".join(published)}', messages.SUCCESS)
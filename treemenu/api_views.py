@@ -1,9 +1,163 @@
+import hashlib
+from functools import reduce
+from operator import or_
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from django.db.models import Prefetch
-from .models import MenuItem
-from .serializers import MenuItemSerializer
+from django.db.models import Count, Exists, Max, OuterRef, Q, Sum
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from . import snapshots
+from .audience import aget_audience, get_audience
+from .models import PATH_SEGMENT_WIDTH, MenuItem, MenuVersion, path_to_ids
+from .pagination import MenuItemCursorPagination
+from .serializers import MenuItemChildSerializer, MenuItemFlatSerializer, MenuItemSerializer
+from .tree import build_tree
+
+
+def _versions(menu_name):
+    versions = MenuVersion.objects.all()
+    if menu_name is not None:
+        versions = versions.filter(menu_name=menu_name)
+    return versions
+
+
+VERSION_AGGREGATES = {'count': Count('pk'), 'total': Sum('version'), 'updated_at': Max('updated_at')}
+
+
+def _make_validators(info, menu_name, renderer_format, audience):
+    # Состав ответа зависит от правил видимости, поэтому и ETag - от аудитории
+    token = f'{menu_name}:{info["count"]}:{info["total"] or 0}:{renderer_format}:{audience.key()}'
+    etag = quote_etag(hashlib.md5(token.encode()).hexdigest())
+    last_modified = int(info['updated_at'].timestamp()) if info['updated_at'] else None
+    return etag, last_modified
+
+
+def get_menu_validators(request, menu_name=None):
+    """
+    ETag и Last-Modified для одного меню или для всех меню сразу.
+    
+    Считаются по таблице MenuVersion одним агрегирующим запросом, без
+    загрузки пунктов. ETag зависит и от формата ответа (JSON / browsable API),
+    и от аудитории (правила видимости пунктов).
+    Возвращает (etag, last_modified_timestamp или None).
+    """
+    info = _versions(menu_name).aggregate(**VERSION_AGGREGATES)
+    return _make_validators(info, menu_name, request.accepted_renderer.format, get_audience(request))
+
+
+async def aget_menu_validators(audience, menu_name=None, renderer_format='json'):
+    """
+    Асинхронный вариант get_menu_validators() (те же ETag, что у JSON-ответов).
+    Группы аудитории должны быть загружены заранее (Audience.aload_groups).
+    """
+    info = await _versions(menu_name).aaggregate(**VERSION_AGGREGATES)
+    return _make_validators(info, menu_name, renderer_format, audience)
+
+
+def set_validators(response, etag, last_modified):
+    """Проставляет ETag / Last-Modified в ответ."""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+# Сколько поддеревьев выбирается одним запросом: условие - OR из
+# path LIKE на каждое поддерево, а SQLite ограничивает глубину выражения
+SUBTREE_BATCH_SIZE = 100
+
+
+def _subtree_roots(items):
+    """
+    Верхние пункты страницы: пункт, чей предок уже есть на странице,
+    попадает в поддерево предка и отдельного условия не требует.
+    """
+    whole_menus = {item.menu_name for item in items if not item.path}
+    roots = []
+    paths = set()
+    for item in sorted(items, key=lambda item: item.path):
+        if item.menu_name in whole_menus:
+            continue
+        prefixes = (item.path[:end] for end in range(PATH_SEGMENT_WIDTH, len(item.path), PATH_SEGMENT_WIDTH))
+        if not any(prefix in paths for prefix in prefixes):
+            roots.append(item)
+            paths.add(item.path)
+    return whole_menus, roots
+
+
+def _subtrees_conditions(items):
+    """Условия выборки поддеревьев пачками по SUBTREE_BATCH_SIZE."""
+    whole_menus, roots = _subtree_roots(items)
+    conditions = [Q(menu_name=menu_name) for menu_name in sorted(whole_menus)]
+    conditions += [Q(path__startswith=item.path) for item in roots]
+    return [
+        reduce(or_, conditions[start:start + SUBTREE_BATCH_SIZE])
+        for start in range(0, len(conditions), SUBTREE_BATCH_SIZE)
+    ]
+
+
+def _link_subtrees(items, subtree_items):
+    items_dict, _ = build_tree(subtree_items)
+    for item in items:
+        node = items_dict.get(item.id)
+        item.children_list = node.children_list if node is not None else []
+
+
+def attach_subtrees(items, audience):
+    """
+    Подгружает поддеревья пунктов и строит их в памяти, чтобы сериализатор
+    рекурсивно обходил children_list без запросов к БД.
+    
+    Поддеревья выбираются по материализованному пути (path__startswith),
+    только видимые аудитории пункты: один запрос на каждые
+    SUBTREE_BATCH_SIZE верхних пунктов страницы.
+    """
+    if not items:
+        return
+    queryset = MenuItem.objects.visible_to(audience, with_ancestors=False)
+    subtree_items = []
+    for condition in _subtrees_conditions(items):
+        subtree_items.extend(queryset.filter(condition))
+    _link_subtrees(items, subtree_items)
+
+
+async def aattach_subtrees(items, audience):
+    """Асинхронный вариант attach_subtrees()."""
+    if not items:
+        return
+    queryset = MenuItem.objects.visible_to(audience, with_ancestors=False)
+    subtree_items = []
+    for condition in _subtrees_conditions(items):
+        subtree_items.extend([item async for item in queryset.filter(condition)])
+    _link_subtrees(items, subtree_items)
+
+
+def menu_items_rows(audience, menu_name):
+    """
+    Видимые аудитории пункты меню строками values_list(*NODE_FIELDS)
+    в порядке отрисовки: для by-name модели не нужны.
+    """
+    return (
+        MenuItem.objects.visible_to(audience, with_ancestors=False)
+        .filter(menu_name=menu_name).order_by('order', 'title')
+        .values_list(*snapshots.NODE_FIELDS)
+    )
+
+
+def nodes_payload(menu_name, nodes, audience):
+    """
+    Ответ by-name из пунктов снимка (snapshots.make_nodes / load_nodes)
+    или None, если видимых пунктов нет. Формат совпадает с
+    MenuItemSerializer, но без моделей и сериализатора.
+    """
+    roots, total = snapshots.serialize_nodes(menu_name, nodes or [], audience)
+    if not total:
+        return None
+    return {'menu_name': menu_name, 'items': roots, 'total_items': total}
 
 
 class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
@@ -11,21 +165,20 @@ class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
     ViewSet для API меню.
     Демонстрирует знание DRF (важно для CRM вакансии).
     
-    Оптимизация: используем prefetch_related для избежания N+1 запросов.
+    Оптимизация: вложенные children сериализуются из дерева, построенного
+    в памяти (attach_subtrees / build_tree) - число запросов не зависит
+    от размера и глубины меню.
     """
     serializer_class = MenuItemSerializer
     lookup_field = 'id'
     
     def get_queryset(self):
         """
-        Оптимизированный queryset с prefetch для детей.
+        Queryset пунктов меню. Дети подгружаются отдельно (attach_subtrees),
+        parent сериализуется как id - join не нужен.
+        Скрытые от пользователя пункты (правила видимости) не попадают в выдачу.
         """
-        queryset = MenuItem.objects.select_related('parent').prefetch_related(
-            Prefetch(
-                'children',
-                queryset=MenuItem.objects.order_by('order', 'title')
-            )
-        )
+        queryset = MenuItem.objects.visible_to(get_audience(self.request))
         
         # Фильтрация по menu_name если указан
         menu_name = self.request.query_params.get('menu_name', None)
@@ -34,6 +187,65 @@ class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
         
         return queryset.order_by('order', 'title')
     
+    def is_flat(self):
+        """?flat=1 - плоский список с id родителя вместо вложенных children."""
+        return self.request.query_params.get('flat') in ('1', 'true')
+    
+    def get_serializer_class(self):
+        if self.is_flat():
+            return MenuItemFlatSerializer
+        return super().get_serializer_class()
+    
+    @property
+    def paginator(self):
+        """
+        ?pagination=cursor (или переданный cursor) - keyset-пагинация
+        без COUNT/OFFSET; по умолчанию - глобальная PageNumberPagination.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = MenuItemCursorPagination()
+        return super().paginator
+    
+    def not_modified(self, request, menu_name=None):
+        """
+        Проверяет If-None-Match / If-Modified-Since до загрузки пунктов.
+        Возвращает (ответ 304/412 или None, etag, last_modified).
+        """
+        etag, last_modified = get_menu_validators(request, menu_name)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        return response, etag, last_modified
+    
+    def list(self, request, *args, **kwargs):
+        menu_name = request.query_params.get('menu_name') or None
+        conditional, etag, last_modified = self.not_modified(request, menu_name)
+        if conditional is not None:
+            return conditional
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        items = list(page if page is not None else queryset)
+        if not self.is_flat():
+            attach_subtrees(items, get_audience(request))
+        serializer = self.get_serializer(items, many=True)
+        if page is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return set_validators(response, etag, last_modified)
+    
+    def retrieve(self, request, *args, **kwargs):
+        # Меню пункта заранее неизвестно - используем версию всех меню
+        conditional, etag, last_modified = self.not_modified(request)
+        if conditional is not None:
+            return conditional
+        
+        instance = self.get_object()
+        if not self.is_flat():
+            attach_subtrees([instance], get_audience(request))
+        return set_validators(Response(self.get_serializer(instance).data), etag, last_modified)
+    
     @action(detail=False, methods=['get'], url_path='by-name/(?P<menu_name>[^/.]+)')
     def by_name(self, request, menu_name=None):
         """
@@ -42,24 +254,132 @@ class MenuItemViewSet(viewsets.ReadOnlyModelViewSet):
         
         Пример: GET /api/menu/by-name/main_menu/
         """
-        # Получаем все элементы меню одним запросом
-        items = list(MenuItem.objects.filter(menu_name=menu_name).order_by('order', 'title'))
+        # Если у клиента актуальная версия - 304 без загрузки пунктов
+        conditional, etag, last_modified = self.not_modified(request, menu_name)
+        if conditional is not None:
+            return conditional
+        
+        audience = get_audience(request)
+        if snapshots.is_enabled():
+            # Опубликованное меню: одна строка по первичному ключу
+            nodes = snapshots.get_snapshot_nodes(menu_name)
+        else:
+            # Все видимые пользователю пункты одним запросом, строками без моделей
+            nodes = snapshots.make_nodes(menu_items_rows(audience, menu_name))
         
-        if not items:
+        # Дерево строится из строк в памяти, дети - без запросов
+        payload = nodes_payload(menu_name, nodes, audience)
+        if payload is None:
             return Response(
                 {'error': f'Menu "{menu_name}" not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        return set_validators(Response(payload), etag, last_modified)
+
+    
+    @action(detail=False, methods=['get'], url_path='children/(?P<menu_name>[^/.]+)')
+    def children(self, request, menu_name=None):
+        """
+        Один уровень дерева для раскрытия веток по требованию:
+        корневые пункты меню или дети пункта ?parent=<id>.
+        Выборка по индексу (menu_name, parent, order), has_children -
+        подзапрос EXISTS; размер ответа не зависит от размера меню.
         
-        # Строим дерево: находим корневые элементы
-        root_items = [item for item in items if item.parent_id is None]
+        Пример: GET /api/menu/children/catalog/?parent=42
+        """
+        conditional, etag, last_modified = self.not_modified(request, menu_name)
+        if conditional is not None:
+            return conditional
         
-        # Сериализуем корневые элементы (дети подтянутся через get_children)
-        serializer = MenuItemSerializer(root_items, many=True)
+        audience = get_audience(request)
+        items = MenuItem.objects.visible_to(audience, with_ancestors=False).filter(menu_name=menu_name)
+        parent_id = request.query_params.get('parent')
+        if parent_id:
+            if not parent_id.isdigit() or not self.is_visible_branch(audience, menu_name, int(parent_id)):
+                return Response({'detail': 'Parent not found.'}, status=status.HTTP_404_NOT_FOUND)
+            items = items.filter(parent_id=parent_id)
+        else:
+            items = items.filter(parent__isnull=True)
         
-        return Response({
+        visible = MenuItem.objects.visible_to(audience, with_ancestors=False)
+        has_children = Exists(visible.filter(parent_id=OuterRef('pk')))
+        items = items.annotate(has_children=has_children).order_by('order', 'title', 'id')
+        return set_validators(Response({
             'menu_name': menu_name,
-            'items': serializer.data,
-            'total_items': len(items)
-        })
+            'parent': int(parent_id) if parent_id else None,
+            'items': MenuItemChildSerializer(items, many=True).data,
+        }), etag, last_modified)
+    
+    def is_visible_branch(self, audience, menu_name, parent_id):
+        """
+        Пункт есть в меню и виден вместе со всеми предками (иначе через
+        children можно было бы увидеть потомков скрытого пункта).
+        """
+        path = MenuItem.objects.filter(menu_name=menu_name, pk=parent_id).values_list('path', flat=True).first()
+        if path is None:
+            return False
+        ids = path_to_ids(path) if path else [parent_id]
+        return MenuItem.objects.visible_to(audience, with_ancestors=False).filter(pk__in=ids).count() == len(ids)
+
+
+def json_response(data, status=200):
+    """JSON-ответ теми же средствами, что и у DRF (байт в байт как у ViewSet)."""
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+async def menu_by_name_async(request, menu_name):
+    """
+    Асинхронный аналог GET /api/menu/by-name/<menu_name>/ для ASGI:
+    версия, пункты и ответ получаются без блокировки потока
+    (асинхронный ORM), формат и ETag совпадают с JSON-ответом ViewSet.
+    
+    Пример: GET /api/async/menu/by-name/main_menu/
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    
+    audience = await aget_audience(request)
+    await audience.aload_groups()
+    etag, last_modified = await aget_menu_validators(audience, menu_name)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return conditional
+    
+    if snapshots.is_enabled():
+        nodes = await snapshots.aget_snapshot_nodes(menu_name)
+    else:
+        nodes = snapshots.make_nodes([row async for row in menu_items_rows(audience, menu_name)])
+    
+    payload = nodes_payload(menu_name, nodes, audience)
+    if payload is None:
+        return json_response({'error': f'Menu "{menu_name}" not found'}, status=status.HTTP_404_NOT_FOUND)
+    return set_validators(json_response(payload), etag, last_modified)
+
+
+async def menu_detail_async(request, id):
+    """
+    Асинхронный аналог GET /api/menu/<id>/ (поддерживает ?flat=1).
+    
+    Пример: GET /api/async/menu/1/
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    
+    audience = await aget_audience(request)
+    await audience.aload_groups()
+    etag, last_modified = await aget_menu_validators(audience)
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        return conditional
+    
+    instance = await MenuItem.objects.visible_to(audience).filter(id=id).afirst()
+    if instance is None:
+        return json_response({'detail': 'No MenuItem matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if request.GET.get('flat') in ('1', 'true'):
+        data = MenuItemFlatSerializer(instance).data
+    else:
+        await aattach_subtrees([instance], audience)
+        data = MenuItemSerializer(instance, context={'request': request}).data
+    return set_validators(json_response(data), etag, last_modified)
 
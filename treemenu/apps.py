@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class TreemenuConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "treemenu"
+
+    def ready(self):
+        # Подключаем сигналы инвалидации кэша меню
+        from . import signals
+        
+        # Прогрев кэша всех меню (см. signals.warm_on_first_request)
+        if getattr(settings, 'TREEMENU_WARM_ON_STARTUP', False):
+            request_started.connect(signals.warm_on_first_request, dispatch_uid='treemenu_warm_menus')
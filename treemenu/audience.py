@@ -0,0 +1,118 @@
+"""
+Аудитория запроса для правил видимости пунктов меню.
+
+Аудитория - уровень доступа (anonymous / authenticated / staff) и группы
+пользователя. Скомпилированное меню фильтруется по ней в памяти, и для
+каждого ключа аудитории хранится свой вариант (CompiledMenu.for_audience).
+"""
+from treemenu.models import Visibility
+
+ANONYMOUS = 'anonymous'
+AUTHENTICATED = 'authenticated'
+STAFF = 'staff'
+
+# Какие значения MenuItem.visibility видит каждый уровень
+ALLOWED_VISIBILITY = {
+    ANONYMOUS: frozenset({Visibility.ALL, Visibility.ANONYMOUS}),
+    AUTHENTICATED: frozenset({Visibility.ALL, Visibility.AUTHENTICATED}),
+    STAFF: frozenset({Visibility.ALL, Visibility.AUTHENTICATED, Visibility.STAFF}),
+}
+
+
+class Audience:
+    """
+    Аудитория пользователя. Группы загружаются лениво (один запрос на
+    запрос пользователя) и только если меню действительно ссылается на группы.
+    Суперпользователь видит пункты любых групп.
+    """
+    __slots__ = ('level', 'all_groups', '_user', '_groups')
+
+    def __init__(self, level, user=None, all_groups=False, groups=None):
+        self.level = level
+        self.all_groups = all_groups
+        self._user = user
+        # groups задаются явно для аудиторий без пользователя (prerender_menus)
+        if groups is None and level == ANONYMOUS:
+            groups = frozenset()
+        self._groups = groups
+
+    @classmethod
+    def from_user(cls, user):
+        if user is None or not user.is_authenticated:
+            return cls(ANONYMOUS)
+        level = STAFF if user.is_staff or user.is_superuser else AUTHENTICATED
+        return cls(level, user, all_groups=user.is_superuser)
+
+    @property
+    def allowed_visibility(self):
+        return ALLOWED_VISIBILITY[self.level]
+
+    @property
+    def groups(self):
+        """Имена групп пользователя (frozenset)."""
+        if self._groups is None:
+            self._groups = frozenset(self._user.groups.values_list('name', flat=True))
+        return self._groups
+
+    async def aload_groups(self):
+        """Загружает группы асинхронным ORM (для ASGI до рендера шаблона)."""
+        if self._groups is None:  # У анонимного пользователя групп нет
+            self._groups = frozenset([name async for name in self._user.groups.values_list('name', flat=True)])
+
+    def groups_for(self, rule_groups):
+        """Группы пользователя среди упомянутых в правилах меню."""
+        if not rule_groups:
+            return frozenset()
+        if self.all_groups:
+            return rule_groups
+        return self.groups & rule_groups
+
+    def key(self, rule_groups=None):
+        """
+        Ключ варианта: уровень + значимые группы, например 'staff+editors'.
+        rule_groups - группы из правил меню (только они влияют на результат,
+        поэтому вариантов не больше, чем реально различающихся аудиторий).
+        None - все группы пользователя (ключ для ETag API).
+        """
+        if rule_groups is None:
+            groups = '*' if self.all_groups else ','.join(sorted(self.groups))
+        else:
+            groups = ','.join(sorted(self.groups_for(rule_groups)))
+        return f'{self.level}+{groups}' if groups else self.level
+
+    def can_see(self, visibility, groups, visible_groups):
+        """Виден ли пункт с правилами (visibility, groups) при группах visible_groups."""
+        return visibility in self.allowed_visibility and (not groups or not groups.isdisjoint(visible_groups))
+
+
+ANONYMOUS_AUDIENCE = Audience(ANONYMOUS)
+
+# Типовые аудитории для заранее отрисованных вариантов меню (прогрев,
+# prerender_menus): уровни доступа без групп и суперпользователь
+STANDARD_AUDIENCES = (
+    ANONYMOUS_AUDIENCE,
+    Audience(AUTHENTICATED, groups=frozenset()),
+    Audience(STAFF, groups=frozenset()),
+    Audience(STAFF, all_groups=True, groups=frozenset()),
+)
+
+
+def get_audience(request):
+    """Аудитория запроса (кэшируется на объекте request)."""
+    if request is None:
+        return ANONYMOUS_AUDIENCE
+    audience = getattr(request, '_treemenu_audience', None)
+    if audience is None:
+        audience = Audience.from_user(getattr(request, 'user', None))
+        request._treemenu_audience = audience
+    return audience
+
+
+async def aget_audience(request):
+    """Асинхронный вариант get_audience(): пользователь через request.auser()."""
+    audience = getattr(request, '_treemenu_audience', None)
+    if audience is None:
+        user = await request.auser() if hasattr(request, 'auser') else None
+        audience = Audience.from_user(user)
+        request._treemenu_audience = audience
+    return audience
@@ -0,0 +1,259 @@
+"""
+Генерация синтетических меню и микро-бенчмарки отрисовки и API.
+
+Используется командой benchmark_menu; все данные создаются внутри
+транзакции, которая откатывается по окончании замеров.
+
+Нагрузочный прогон под ASGI (команда benchmark_asgi) сравнивает
+синхронные и асинхронные представления по пропускной способности.
+"""
+import asyncio
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+import django
+from django.db import connection, router
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from treemenu.bulk import bulk_insert_tree, split_levels
+from treemenu.cache import bump_menu_version, clear_local_cache, get_menu_html
+from treemenu.models import MenuItem, Visibility
+from treemenu.rendering import render_menu
+from treemenu.signals import menu_changed
+from treemenu.tree import CompiledMenu, MenuNode, build_tree, compile_menu
+
+
+def generate_records(menu_name, size, depth, fanout):
+    """
+    Записи для bulk_insert_tree: дерево обходится в ширину, у каждого
+    пункта до fanout детей, не глубже depth уровней, всего size пунктов.
+    """
+    records = {}
+    queue = [(None, 0)]
+    while queue and len(records) < size:
+        next_queue = []
+        for parent, level in queue:
+            count = fanout if parent is not None else min(fanout, size)
+            for order in range(count):
+                if len(records) >= size:
+                    break
+                key = f'{parent}.{order}' if parent is not None else str(order)
+                records[key] = (parent, menu_name, f'Item {key}', f'/{menu_name}/{key}/', '', order, Visibility.ALL, '')
+                if level + 1 < depth:
+                    next_queue.append((key, level + 1))
+        queue = next_queue
+    return records
+
+
+def create_menu(menu_name, size, depth, fanout):
+    """Создаёт меню в БД; возвращает URL пунктов в порядке генерации."""
+    records = generate_records(menu_name, size, depth, fanout)
+    bulk_insert_tree(records, split_levels(records), router.db_for_write(MenuItem))
+    menu_changed(menu_name)
+    return [record[3] for record in records.values()]
+
+
+def measure(func, repeat):
+    """
+    Запускает func repeat раз и возвращает статистику:
+    медиана и p95 времени (мс), пиковая память одного запуска (КиБ),
+    число запросов к БД одного запуска.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Память и запросы - отдельным прогоном: tracemalloc замедляет код
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    p95 = timings[-1] if len(timings) < 20 else statistics.quantiles(timings, n=20)[18]
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(p95, 3),
+        'peak_kib': round(peak / 1024, 1),
+        'queries': len(queries),
+    }
+
+
+def run_benchmarks(size, depth, fanout, repeat, seed=0):
+    """Генерирует меню и замеряет все этапы; возвращает {этап: статистика}."""
+    menu_name = f'bench_{size}'
+    urls = create_menu(menu_name, size, depth, fanout)
+    rng = random.Random(seed)
+    sample_urls = [rng.choice(urls) for _ in range(100)]
+    deepest_url = urls[-1]
+
+    compiled = compile_menu(menu_name)
+    rows = [(node.id, node.parent_id, node.title, node.url) for node in compiled.items_dict.values()]
+    deepest_id = compiled.url_index[deepest_url]
+
+    factory = APIRequestFactory()
+    from treemenu.api_views import MenuItemViewSet
+    by_name_view = MenuItemViewSet.as_view({'get': 'by_name'})
+    template = Template('{% load menu_tags %}{% draw_menu menu_name %}')
+    request = factory.get(deepest_url)
+
+    def draw_menu_cold():
+        # Сбрасываем только кэш (без записи версии в БД), чтобы считать лишь запросы чтения
+        bump_menu_version(menu_name)
+        clear_local_cache()
+        template.render(Context({'request': factory.get(deepest_url), 'menu_name': menu_name}))
+
+    def draw_menu_warm():
+        template.render(Context({'request': factory.get(deepest_url), 'menu_name': menu_name}))
+
+    def get_active_path():
+        for url in sample_urls:
+            compiled.get_active_path(url)
+
+    def render_uncached():
+        compiled.fragments.clear()
+        get_menu_html(compiled, deepest_id)
+
+    return {
+        'load_and_compile': measure(lambda: compile_menu(menu_name), repeat),
+        'build_tree': measure(lambda: build_tree([MenuNode(*row) for row in rows]), repeat),
+        'compile_from_rows': measure(lambda: CompiledMenu(menu_name, [MenuNode(*row) for row in rows]), repeat),
+        'get_active_path_x100': measure(get_active_path, repeat),
+        'render_menu_items': measure(lambda: render_menu(compiled, deepest_id), repeat),
+        'render_fragment_cached': measure(lambda: get_menu_html(compiled, deepest_id), repeat),
+        'render_fragment_uncached': measure(render_uncached, repeat),
+        'draw_menu_cold': measure(draw_menu_cold, repeat),
+        'draw_menu_warm': measure(draw_menu_warm, repeat),
+        'api_by_name': measure(lambda: by_name_view(request, menu_name=menu_name), repeat),
+    }
+
+
+def environment():
+    """Параметры окружения для сравнения прогонов между релизами."""
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+    }
+
+
+# Пары "синхронный / асинхронный" путь для benchmark_asgi; {menu} и {id} -
+# имя синтетического меню и id его первого корневого пункта
+ASGI_SCENARIOS = {
+    'page': ('/', '/async/'),
+    'api_by_name': ('/api/menu/by-name/{menu}/', '/api/async/menu/by-name/{menu}/'),
+    'api_detail': ('/api/menu/{id}/', '/api/async/menu/{id}/'),
+}
+
+
+def asgi_client(application):
+    """
+    GET-запрос напрямую к ASGI-приложению - тот же вызов, что делает
+    сервер (uvicorn и т.п.), но без сети. Возвращает код ответа.
+    """
+    async def fetch(path):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        disconnected = asyncio.Event()
+        request_sent = False
+        status = None
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                disconnected.set()
+
+        await application(scope, receive, send)
+        return status
+    return fetch
+
+
+def http_client(base_url):
+    """
+    GET-запрос к запущенному ASGI-серверу по HTTP/1.1 (без сторонних
+    библиотек, соединение на запрос). Возвращает код ответа.
+    """
+    parts = urlsplit(base_url)
+    host, port = parts.hostname, parts.port or 80
+
+    async def fetch(path):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return int(response.split(b' ', 2)[1])
+    return fetch
+
+
+async def run_load(fetch, path, requests, concurrency):
+    """
+    Отправляет requests запросов, не больше concurrency одновременно.
+    Возвращает пропускную способность (запросов в секунду), медиану и
+    p95 задержки (мс) и число ответов с кодом, отличным от 200.
+    """
+    timings = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            status = await fetch(path)
+            timings.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'rps': round(requests / elapsed, 1),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(statistics.quantiles(timings, n=20)[18] if len(timings) >= 20 else timings[-1], 3),
+        'errors': errors,
+    }
+
+
+async def run_asgi_benchmarks(fetch, menu_name, root_id, requests, concurrency):
+    """Прогоняет все сценарии ASGI_SCENARIOS: {сценарий: {'sync': ..., 'async': ...}}."""
+    results = {}
+    for scenario, paths in ASGI_SCENARIOS.items():
+        results[scenario] = {}
+        for mode, path in zip(('sync', 'async'), paths):
+            path = path.format(menu=menu_name, id=root_id)
+            # Прогрев: кэши меню и URL, соединения с БД в потоках
+            await run_load(fetch, path, concurrency, concurrency)
+            results[scenario][mode] = await run_load(fetch, path, requests, concurrency)
+    return results
+
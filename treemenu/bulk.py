@@ -0,0 +1,114 @@
+"""
+Массовая вставка деревьев меню в обход save() (импорт, генерация данных).
+
+Записи: {key: (parent_key, menu_name, title, url, named_url, order, visibility, groups)},
+где key / parent_key - внешние ключи (parent_key = None у корней).
+"""
+from django.db import connections
+
+from treemenu.models import MenuItem, make_path_segment
+
+# Колонки файла импорта/экспорта: key - внешний ключ пункта,
+# parent - внешний ключ родителя (пусто для корневых пунктов)
+FIELDS = ('key', 'parent', 'menu_name', 'title', 'url', 'named_url', 'order', 'visibility', 'groups')
+
+
+def split_levels(records):
+    """
+    Раскладывает ключи по уровням вложенности (корни - уровень 0).
+    Записи, не достижимые от корней, образуют цикл.
+    """
+    children = {}
+    for key, record in records.items():
+        children.setdefault(record[0], []).append(key)
+
+    levels = []
+    level = children.get(None, [])
+    while level:
+        levels.append(level)
+        level = [child for key in level for child in children.get(key, [])]
+
+    placed = sum(len(level) for level in levels)
+    if placed != len(records):
+        raise ValueError(f'Циклические ссылки на родителя: {len(records) - placed} пунктов')
+    return levels
+
+
+def bulk_insert_tree(records, levels, using, batch_size=1000):
+    """
+    Вставляет уровни по очереди: id родителей известны после bulk_create.
+    Возвращает {key: id}. Сигналы и save() не вызываются - после вставки
+    нужно вызвать signals.menu_changed() для затронутых меню.
+    """
+    ids = {}
+    paths = {}
+    for depth, level in enumerate(levels):
+        items = []
+        for key in level:
+            parent, menu_name, title, url, named_url, order, visibility, groups = records[key]
+            items.append(MenuItem(
+                menu_name=menu_name,
+                title=title,
+                parent_id=ids[parent] if parent is not None else None,
+                url=url,
+                named_url=named_url,
+                order=order,
+                visibility=visibility,
+                groups=groups,
+                depth=depth,
+            ))
+        MenuItem.objects.using(using).bulk_create(items, batch_size=batch_size)
+
+        # Материализованный путь требует id, поэтому заполняется после вставки
+        updates = []
+        for key, item in zip(level, items):
+            parent = records[key][0]
+            ids[key] = item.pk
+            paths[key] = paths.get(parent, '') + make_path_segment(item.order, item.pk)
+            updates.append((paths[key], item.pk))
+        update_paths(updates, using)
+
+    return ids
+
+
+def update_paths(updates, using):
+    """
+    Массовое обновление path одним подготовленным UPDATE (executemany).
+    bulk_update строит CASE WHEN на каждую строку и на десятках тысяч
+    пунктов работает на порядок медленнее.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} = %s WHERE {} = %s'.format(
+        quote(MenuItem._meta.db_table), quote('path'), quote('id')
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, updates)
+
+
+def delete_menus(menu_names, using):
+    """
+    Удаляет все пункты меню одним DELETE в обход QuerySet.delete():
+    без выборки объектов, каскада Django и сигналов на каждый пункт.
+    Возвращает число удалённых пунктов; после удаления нужно вызвать
+    signals.menu_changed() для этих меню.
+    
+    Каскад не нужен, только если все дети удаляемых пунктов лежат в этих
+    же меню - это проверяется заранее (ValueError), иначе остались бы
+    пункты с битым parent_id.
+    """
+    menu_names = sorted(set(menu_names))
+    if not menu_names:
+        return 0
+    orphans = MenuItem.objects.using(using).filter(parent__menu_name__in=menu_names).exclude(menu_name__in=menu_names)
+    if orphans.exists():
+        raise ValueError('У пунктов удаляемых меню есть дети в других меню')
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql = 'DELETE FROM {} WHERE {} IN ({})'.format(
+        quote(MenuItem._meta.db_table), quote('menu_name'), ', '.join(['%s'] * len(menu_names))
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, menu_names)
+        return cursor.rowcount
@@ -0,0 +1,497 @@
+"""
+Кэш скомпилированных меню.
+
+Двухуровневая схема:
+- LRU в памяти процесса (без сериализации, самый быстрый путь);
+- общий кэш Django (между воркерами).
+
+Ключ дерева = имя меню + версия + URLconf (URL разрешаются при компиляции).
+Готовый HTML кэшируется по тому же ключу + id активного пункта. Версия хранится в кэше Django и
+увеличивается сигналами post_save/post_delete у MenuItem, поэтому
+старые записи просто перестают запрашиваться - явно удалять их не нужно.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+
+from treemenu import instrumentation, routers, snapshots
+from treemenu.rendering import render_menu
+from treemenu.resolver import urlconf_key
+from treemenu.tree import acompile_menus, compile_menus, standard_variants
+
+VERSION_KEY = 'treemenu:version:{}'
+TREE_KEY = 'treemenu:tree:{}'
+FRAGMENT_KEY = 'treemenu:html:{}:{}'
+# Меню недавно изменилось: реплика может отставать (см. routers.py)
+FRESH_KEY = 'treemenu:fresh:{}'
+
+_local_cache = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _get_cache():
+    return caches[getattr(settings, 'TREEMENU_CACHE_ALIAS', 'default')]
+
+
+def _local_cache_size():
+    return getattr(settings, 'TREEMENU_LOCAL_CACHE_SIZE', 128)
+
+
+def _cache_timeout():
+    return getattr(settings, 'TREEMENU_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _source_key():
+    """
+    Третья часть ключа дерева: URLconf, в котором разрешены URL, или
+    'published' для опубликованных меню (URL разрешены при публикации).
+    """
+    return 'published' if snapshots.is_enabled() else urlconf_key()
+
+
+def _make_cache_key(menu_name, version, url_key):
+    return f'{menu_name}:{version}:{url_key}'
+
+
+def get_menu_version(menu_name):
+    """
+    Возвращает текущую версию меню или None, если кэш не хранит данные
+    (например, DummyCache) - тогда кэширование отключается.
+    """
+    return get_menu_versions([menu_name])[menu_name]
+
+
+def bump_menu_version(menu_name):
+    """Увеличивает версию меню и выбрасывает его из локального LRU."""
+    cache = _get_cache()
+    key = VERSION_KEY.format(menu_name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа нет (ещё не создан или вытеснен)
+        cache.add(key, time.time_ns(), timeout=None)
+
+    with _local_lock:
+        for local_key in [k for k in _local_cache if k[0] == menu_name]:
+            del _local_cache[local_key]
+
+
+def invalidate_menu(menu_name):
+    """
+    Сбрасывает кэш меню.
+
+    Версия увеличивается сразу (чтобы изменения были видны внутри текущей
+    транзакции) и ещё раз после коммита - иначе конкурентный запрос мог бы
+    закэшировать старые данные под новой версией.
+    """
+    bump_menu_version(menu_name)
+    _mark_fresh(menu_name)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: (bump_menu_version(menu_name), _mark_fresh(menu_name)))
+
+
+def _mark_fresh(menu_name):
+    """
+    При чтении из реплики: следующие TREEMENU_REPLICA_STICKY_SECONDS секунд
+    меню собирается из основной БД. Иначе запрос, попавший на отстающую
+    реплику, закэшировал бы старое дерево под новой версией для всех.
+    """
+    if routers.get_replica_alias():
+        _get_cache().set(FRESH_KEY.format(menu_name), 1, routers.sticky_seconds())
+
+
+def _compile_using(menu_names):
+    """Алиас БД для сборки меню: основная, если какое-то из них недавно менялось."""
+    if not routers.get_replica_alias():
+        return None
+    fresh = _get_cache().get_many([FRESH_KEY.format(menu_name) for menu_name in menu_names])
+    return routers.get_primary_alias() if fresh else None
+
+
+async def _acompile_using(menu_names):
+    if not routers.get_replica_alias():
+        return None
+    fresh = await _get_cache().aget_many([FRESH_KEY.format(menu_name) for menu_name in menu_names])
+    return routers.get_primary_alias() if fresh else None
+
+
+def _version_keys(menu_names):
+    return {VERSION_KEY.format(menu_name): menu_name for menu_name in menu_names}
+
+
+def get_menu_versions(menu_names):
+    """
+    Версии нескольких меню за один round-trip к кэшу.
+    Для кэшей, которые не хранят данные, версия будет None.
+    
+    Если кэш в памяти процесса (LocMemCache), версия дополнительно
+    читается из MenuVersion (+1 запрос): иначе правка меню в одном воркере
+    не была бы видна остальным. В production нужен общий кэш (Redis и т.п.).
+    """
+    cache = _get_cache()
+    keys = _version_keys(menu_names)
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # Начальная версия берётся от времени: если ключ вытеснят из кэша,
+        # новая версия не совпадёт со старыми закэшированными деревьями
+        initial = time.time_ns()
+        for key in missing:
+            cache.add(key, initial, timeout=None)
+        found.update(cache.get_many(missing))
+    versions = {menu_name: found.get(key) for key, menu_name in keys.items()}
+    if _is_process_local(cache):
+        from treemenu.models import MenuVersion
+        
+        queryset = MenuVersion.objects.filter(menu_name__in=menu_names).values_list('menu_name', 'version')
+        versions = _with_db_versions(versions, dict(queryset))
+    return versions
+
+
+def _is_process_local(cache):
+    """Кэш в памяти процесса: версии в нём не видны другим воркерам."""
+    return isinstance(cache, LocMemCache)
+
+
+def _with_db_versions(versions, db_versions):
+    """
+    Для кэша в памяти процесса к версии из кэша добавляется версия из
+    MenuVersion: изменение меню в другом воркере меняет её у всех.
+    """
+    return {
+        menu_name: f'{db_versions.get(menu_name, 0)}.{version}' if version is not None else None
+        for menu_name, version in versions.items()
+    }
+
+
+async def aget_menu_versions(menu_names):
+    """Асинхронный вариант get_menu_versions()."""
+    cache = _get_cache()
+    keys = _version_keys(menu_names)
+    found = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        initial = time.time_ns()
+        for key in missing:
+            await cache.aadd(key, initial, timeout=None)
+        found.update(await cache.aget_many(missing))
+    versions = {menu_name: found.get(key) for key, menu_name in keys.items()}
+    if _is_process_local(cache):
+        from treemenu.models import MenuVersion
+        
+        queryset = MenuVersion.objects.filter(menu_name__in=menu_names).values_list('menu_name', 'version')
+        versions = _with_db_versions(versions, {menu_name: version async for menu_name, version in queryset})
+    return versions
+
+
+def _local_get(local_key):
+    with _local_lock:
+        compiled = _local_cache.get(local_key)
+        if compiled is not None:
+            _local_cache.move_to_end(local_key)
+        return compiled
+
+
+def _local_set(local_key, compiled):
+    with _local_lock:
+        _local_cache[local_key] = compiled
+        _local_cache.move_to_end(local_key)
+        while len(_local_cache) > _local_cache_size():
+            _local_cache.popitem(last=False)
+
+
+def _from_local(menu_names, versions, url_key, result):
+    """Шаг 1: LRU процесса. Возвращает меню, которых там нет."""
+    pending = []
+    for menu_name in menu_names:
+        version = versions[menu_name]
+        compiled = None
+        if version is not None:
+            compiled = _local_get((menu_name, version, url_key))
+        if compiled is None:
+            pending.append(menu_name)
+        else:
+            result[menu_name] = compiled
+            instrumentation.count(menu_name, 'cache_local_hit')
+    return pending
+
+
+def _tree_keys(pending, versions, url_key):
+    return {
+        TREE_KEY.format(_make_cache_key(menu_name, versions[menu_name], url_key)): menu_name
+        for menu_name in pending
+        if versions[menu_name] is not None
+    }
+
+
+def _from_shared(found, tree_keys, pending, versions, url_key, result):
+    """Шаг 2: ответ get_many общего кэша. Возвращает оставшиеся меню."""
+    for tree_key, compiled in found.items():
+        menu_name = tree_keys[tree_key]
+        result[menu_name] = compiled
+        instrumentation.count(menu_name, 'cache_shared_hit')
+        _local_set((menu_name, versions[menu_name], url_key), compiled)
+    return [menu_name for menu_name in pending if menu_name not in result]
+
+
+def _from_compiled(compiled_menus, versions, url_key, result, prerender=False):
+    """Шаг 3: меню, собранные из БД. Возвращает записи для set_many."""
+    to_cache = {}
+    for menu_name, compiled in compiled_menus.items():
+        result[menu_name] = compiled
+        instrumentation.count(menu_name, 'cache_miss')
+        version = versions[menu_name]
+        if version is not None:
+            compiled.cache_key = _make_cache_key(menu_name, version, url_key)
+            if prerender or getattr(settings, 'TREEMENU_PRERENDER_FRAGMENTS', False):
+                # Жадный режим: все варианты HTML едут в кэш вместе с деревом
+                to_cache.update(prerender_fragments(compiled, default_max_depth()))
+            to_cache[TREE_KEY.format(compiled.cache_key)] = compiled
+            _local_set((menu_name, version, url_key), compiled)
+    return to_cache
+
+
+def get_compiled_menus(menu_names, prerender=False):
+    """
+    Возвращает {menu_name: CompiledMenu} для нескольких меню.
+    
+    Порядок поиска: LRU процесса -> кэш Django (один get_many) ->
+    БД (один запрос menu_name__in на все оставшиеся меню).
+    prerender=True - собранные из БД меню сразу рендерятся во всех
+    вариантах (как при TREEMENU_PRERENDER_FRAGMENTS).
+    """
+    menu_names = list(dict.fromkeys(menu_names))
+    url_key = _source_key()
+    versions = get_menu_versions(menu_names)
+    result = {}
+    
+    # 1. LRU процесса
+    pending = _from_local(menu_names, versions, url_key, result)
+    if not pending:
+        return result
+
+    # 2. Общий кэш Django
+    cache = _get_cache()
+    tree_keys = _tree_keys(pending, versions, url_key)
+    pending = _from_shared(cache.get_many(tree_keys), tree_keys, pending, versions, url_key, result)
+    if not pending:
+        return result
+
+    # 3. БД: один запрос на все меню, которых нет в кэше
+    compile = snapshots.compile_snapshots if snapshots.is_enabled() else compile_menus
+    to_cache = _from_compiled(compile(pending, _compile_using(pending)), versions, url_key, result, prerender)
+    if to_cache:
+        cache.set_many(to_cache, _cache_timeout())
+    return result
+
+
+async def aget_compiled_menus(menu_names):
+    """
+    Асинхронный вариант get_compiled_menus() для ASGI: те же три уровня,
+    но обращения к кэшу - через aget_many/aset_many, а к БД - через
+    асинхронный ORM (acompile_menus).
+    """
+    menu_names = list(dict.fromkeys(menu_names))
+    url_key = _source_key()
+    versions = await aget_menu_versions(menu_names)
+    result = {}
+    
+    pending = _from_local(menu_names, versions, url_key, result)
+    if not pending:
+        return result
+
+    cache = _get_cache()
+    tree_keys = _tree_keys(pending, versions, url_key)
+    pending = _from_shared(await cache.aget_many(tree_keys), tree_keys, pending, versions, url_key, result)
+    if not pending:
+        return result
+
+    compile = snapshots.acompile_snapshots if snapshots.is_enabled() else acompile_menus
+    to_cache = _from_compiled(await compile(pending, await _acompile_using(pending)), versions, url_key, result)
+    if to_cache:
+        await cache.aset_many(to_cache, _cache_timeout())
+    return result
+
+
+def get_compiled_menu(menu_name):
+    """
+    Возвращает скомпилированное меню.
+    В установившемся режиме с общим кэшем не делает ни одного запроса
+    к БД (с LocMemCache - один запрос версий, см. get_menu_versions()).
+    """
+    return get_compiled_menus([menu_name])[menu_name]
+
+
+def _fragment_key(active_id, max_depth):
+    """Ключ фрагмента в дереве: id активного пункта (+ глубина, если задана)."""
+    return active_id if max_depth is None else (active_id, max_depth)
+
+
+def _shared_fragment_key(compiled, active_id, max_depth):
+    suffix = active_id if max_depth is None else f'{active_id}:d{max_depth}'
+    return FRAGMENT_KEY.format(compiled.cache_key, suffix)
+
+
+def _render_fragment(compiled, active_id, max_depth):
+    instrumentation.count(compiled.menu_name, 'fragment_miss')
+    with instrumentation.timer(compiled.menu_name, 'render'):
+        return render_menu(compiled, active_id, max_depth)
+
+
+def get_menu_html(compiled, active_id, max_depth=None):
+    """
+    Готовый HTML меню для активного пункта (SafeString).
+    
+    Поиск: фрагменты в самом дереве (память процесса) -> кэш Django ->
+    рендер. Меню из N пунктов имеет не больше N + 1 вариантов HTML
+    на каждое значение max_depth.
+    """
+    key = _fragment_key(active_id, max_depth)
+    html = compiled.fragments.get(key)
+    if html is not None:
+        instrumentation.count(compiled.menu_name, 'fragment_hit')
+        return html
+
+    cache = _get_cache() if compiled.cache_key else None
+    if cache is not None:
+        fragment_key = _shared_fragment_key(compiled, active_id, max_depth)
+        html = cache.get(fragment_key)
+    if html is None:
+        html = _render_fragment(compiled, active_id, max_depth)
+        if cache is not None:
+            cache.set(fragment_key, html, _cache_timeout())
+
+    compiled.fragments[key] = html
+    return html
+
+
+async def aget_menu_html(compiled, active_id, max_depth=None):
+    """Асинхронный вариант get_menu_html()."""
+    key = _fragment_key(active_id, max_depth)
+    html = compiled.fragments.get(key)
+    if html is not None:
+        instrumentation.count(compiled.menu_name, 'fragment_hit')
+        return html
+
+    cache = _get_cache() if compiled.cache_key else None
+    if cache is not None:
+        fragment_key = _shared_fragment_key(compiled, active_id, max_depth)
+        html = await cache.aget(fragment_key)
+    if html is None:
+        html = _render_fragment(compiled, active_id, max_depth)
+        if cache is not None:
+            await cache.aset(fragment_key, html, _cache_timeout())
+
+    compiled.fragments[key] = html
+    return html
+
+
+def parse_max_depth(max_depth):
+    """Глубина отрисовки: целое число >= 1 (или строка с ним), иначе ValueError."""
+    try:
+        value = int(max_depth)
+    except (TypeError, ValueError):
+        raise ValueError(f'max_depth должен быть целым числом, получено {max_depth!r}')
+    if value < 1:
+        raise ValueError(f'max_depth должен быть не меньше 1, получено {value}')
+    return value
+
+
+def default_max_depth():
+    """Глубина отрисовки по умолчанию (TREEMENU_MAX_DEPTH, None - без ограничения)."""
+    max_depth = getattr(settings, 'TREEMENU_MAX_DEPTH', None)
+    if max_depth is None:
+        return None
+    try:
+        return parse_max_depth(max_depth)
+    except ValueError as exc:
+        raise ImproperlyConfigured(f'TREEMENU_MAX_DEPTH: {exc}')
+
+
+def prerender_fragments(compiled, max_depth=None):
+    """
+    Рендерит все варианты HTML меню для глубины max_depth: без активного
+    пункта и для каждого пункта, который может стать активным (т.е. есть
+    в индексе URL).
+    
+    Меню с правилами видимости всегда отрисовываются через вариант для
+    аудитории, поэтому рендерятся варианты типовых аудиторий
+    (tree.standard_variants). Их фрагменты не входят в pickle дерева и
+    возвращаются записями для общего кэша.
+    """
+    if not compiled.has_rules:
+        _prerender_tree(compiled, max_depth)
+        return {}
+    
+    to_cache = {}
+    for variant in standard_variants(compiled).values():
+        for active_id, html in _prerender_tree(variant, max_depth).items():
+            if variant.cache_key:
+                to_cache[_shared_fragment_key(variant, active_id, max_depth)] = html
+    return to_cache
+
+
+def _prerender_tree(compiled, max_depth):
+    rendered = {None: render_menu(compiled, None, max_depth)}
+    for item_id in set(compiled.url_index.values()):
+        rendered[item_id] = render_menu(compiled, item_id, max_depth)
+    for active_id, html in rendered.items():
+        compiled.fragments[_fragment_key(active_id, max_depth)] = html
+    return rendered
+
+
+def warm_menus(menu_names=None, refresh=False):
+    """
+    Прогрев кэша: все меню (или перечисленные) компилируются одним
+    запросом к пунктам, URL разрешаются, все варианты HTML рендерятся
+    заранее, и результат кладётся в общий кэш и LRU процесса.
+    
+    Перечисленные меню, уже лежащие в общем кэше, берутся оттуда.
+    refresh=True сначала увеличивает версии (например, после изменения
+    urls.py, когда закэшированные URL устарели) и собирает меню заново.
+    
+    Без menu_names пункты всех меню читаются одним запросом без фильтра
+    по имени: в прогрев попадают и меню, залитые массовой вставкой мимо
+    MenuVersion.
+    Возвращает {menu_name: CompiledMenu}.
+    """
+    if menu_names is not None:
+        menu_names = list(menu_names)
+        if refresh:
+            for menu_name in menu_names:
+                bump_menu_version(menu_name)
+        return get_compiled_menus(menu_names, prerender=True)
+    return get_all_compiled_menus(prerender=True, refresh=refresh)
+
+
+def get_all_compiled_menus(prerender=False, refresh=False):
+    """
+    Все меню, у которых есть пункты (или снимки при TREEMENU_SNAPSHOTS):
+    один запрос без фильтра по имени, поэтому сюда попадают и меню,
+    залитые массовой вставкой мимо MenuVersion. Собранные меню кладутся
+    в общий кэш и LRU процесса, как в get_compiled_menus().
+    Возвращает {menu_name: CompiledMenu} в порядке имён.
+    """
+    compile = snapshots.compile_snapshots if snapshots.is_enabled() else compile_menus
+    compiled_menus = dict(sorted(compile(None).items()))
+    if refresh:
+        for menu_name in compiled_menus:
+            bump_menu_version(menu_name)
+    versions = get_menu_versions(list(compiled_menus))
+    result = {}
+    to_cache = _from_compiled(compiled_menus, versions, _source_key(), result, prerender)
+    if to_cache:
+        _get_cache().set_many(to_cache, _cache_timeout())
+    return result
+
+
+def clear_local_cache():
+    """Очищает LRU текущего процесса (используется в тестах)."""
+    with _local_lock:
+        _local_cache.clear()
@@ -0,0 +1,134 @@
+"""
+Инструментирование меню: время этапов, число запросов и попадания в кэш
+для каждого меню, отрисованного в рамках запроса.
+
+Включается настройкой TREEMENU_INSTRUMENTATION = True (вместе с
+MenuTimingMiddleware). Когда выключено, каждая точка замера стоит одного
+ContextVar.get() - данные не собираются.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from django.db import connections
+
+_current = ContextVar('treemenu_recorder', default=None)
+_null = nullcontext()
+
+_totals = defaultdict(lambda: [0, 0.0])
+_totals_lock = threading.Lock()
+
+
+class Recorder:
+    """Метрики меню одного запроса."""
+
+    def __init__(self):
+        # (menu_name, phase) -> [число замеров, суммарное время в мс]
+        self.timings = defaultdict(lambda: [0, 0.0])
+        # (menu_name, counter) -> значение (попадания в кэш, запросы к БД)
+        self.counters = defaultdict(int)
+
+    def add_timing(self, menu_name, phase, duration_ms):
+        timing = self.timings[menu_name, phase]
+        timing[0] += 1
+        timing[1] += duration_ms
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing."""
+        metrics = []
+        for (menu_name, phase), (count, duration) in self.timings.items():
+            metrics.append(f'{_token(menu_name)}.{phase};dur={duration:.3f}')
+        for (menu_name, counter), value in self.counters.items():
+            metrics.append(f'{_token(menu_name)}.{counter};desc="{value}"')
+        return ', '.join(metrics)
+
+
+class Timer:
+    __slots__ = ('recorder', 'menu_name', 'phase', 'start')
+
+    def __init__(self, recorder, menu_name, phase):
+        self.recorder = recorder
+        self.menu_name = menu_name
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_timing(self.menu_name, self.phase, (time.perf_counter() - self.start) * 1000)
+
+
+def _token(menu_name):
+    # Имя метрики в Server-Timing должно быть HTTP-токеном
+    return 'menu.' + re.sub(r'[^A-Za-z0-9_.+-]', '_', menu_name)
+
+
+def start():
+    """Начинает сбор метрик для текущего запроса; возвращает токен для finish()."""
+    return _current.set(Recorder())
+
+
+def finish(token):
+    """Завершает сбор, добавляет метрики в общие счётчики процесса и возвращает Recorder."""
+    recorder = _current.get()
+    _current.reset(token)
+    with _totals_lock:
+        for (menu_name, phase), (count, duration) in recorder.timings.items():
+            total = _totals[menu_name, phase]
+            total[0] += count
+            total[1] += duration
+        for key, value in recorder.counters.items():
+            _totals[key][0] += value
+    return recorder
+
+
+def timer(menu_name, phase):
+    """Контекстный менеджер замера времени этапа (no-op, если сбор выключен)."""
+    recorder = _current.get()
+    if recorder is None:
+        return _null
+    return Timer(recorder, menu_name, phase)
+
+
+def count(menu_name, counter, value=1):
+    """Увеличивает счётчик меню (no-op, если сбор выключен)."""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.counters[menu_name, counter] += value
+
+
+def count_queries(menu_name, using):
+    """Считает запросы к БД внутри блока (no-op, если сбор выключен)."""
+    recorder = _current.get()
+    if recorder is None:
+        return _null
+
+    def wrapper(execute, sql, params, many, context):
+        recorder.counters[menu_name, 'queries'] += 1
+        return execute(sql, params, many, context)
+
+    return connections[using].execute_wrapper(wrapper)
+
+
+def get_stats():
+    """
+    Накопленные счётчики процесса:
+    {menu_name: {phase: {'count': n, 'total_ms': t}, counter: n}}.
+    """
+    stats = defaultdict(dict)
+    with _totals_lock:
+        for (menu_name, name), (value, duration) in _totals.items():
+            if duration:
+                stats[menu_name][name] = {'count': value, 'total_ms': round(duration, 3)}
+            else:
+                stats[menu_name][name] = value
+    return dict(stats)
+
+
+def reset_stats():
+    with _totals_lock:
+        _totals.clear()
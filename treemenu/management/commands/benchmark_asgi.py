@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import router
+
+from treemenu.benchmark import asgi_client, create_menu, environment, http_client, run_asgi_benchmarks
+from treemenu.bulk import delete_menus
+from treemenu.models import MenuItem
+from treemenu.signals import menu_changed
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность синхронных и асинхронных представлений '
+        'меню под ASGI: демо-страница, API by-name и детальный API. По умолчанию '
+        'запросы идут напрямую в ASGI-приложение; с --url - в запущенный сервер '
+        '(например, uvicorn menu_project.asgi:application). Синтетическое меню '
+        'сохраняется на время прогона (сервер должен его видеть) и затем удаляется'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help='Размер синтетического меню')
+        parser.add_argument('--depth', type=int, default=4, help='Максимальная глубина')
+        parser.add_argument('--fanout', type=int, default=10, help='Детей у каждого пункта')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов')
+        parser.add_argument('--url', help='Адрес запущенного ASGI-сервера (http://127.0.0.1:8000)')
+        parser.add_argument('--output', help='Файл для JSON (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        menu_name = f'bench_asgi_{options["size"]}'
+        fetch = http_client(options['url']) if options['url'] else asgi_client(get_asgi_application())
+
+        create_menu(menu_name, options['size'], options['depth'], options['fanout'])
+        try:
+            root_id = MenuItem.objects.filter(menu_name=menu_name, parent=None).values_list('id', flat=True).first()
+            results = asyncio.run(run_asgi_benchmarks(
+                fetch, menu_name, root_id, options['requests'], options['concurrency']
+            ))
+        finally:
+            delete_menus([menu_name], router.db_for_write(MenuItem))
+            menu_changed(menu_name)
+
+        report = {
+            'environment': environment(),
+            'server': options['url'] or 'in-process',
+            'params': {key: options[key] for key in ('size', 'depth', 'fanout', 'requests', 'concurrency')},
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {options["output"]}'))
+        else:
+            self.stdout.write(output)
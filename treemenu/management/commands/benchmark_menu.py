@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from treemenu.benchmark import environment, run_benchmarks
+from treemenu.models import MenuItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует синтетические меню заданного размера и замеряет построение '
+        'дерева, поиск активного пункта, отрисовку, draw_menu и API by_name. '
+        'Результат - JSON (медиана, p95, пиковая память, число запросов). '
+        'Сгенерированные данные удаляются (транзакция откатывается)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000], help='Размеры меню')
+        parser.add_argument('--depth', type=int, default=5, help='Максимальная глубина')
+        parser.add_argument('--fanout', type=int, default=10, help='Детей у каждого пункта')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого замера')
+        parser.add_argument('--output', help='Файл для JSON (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        report = {
+            'environment': environment(),
+            'params': {key: options[key] for key in ('depth', 'fanout', 'repeat')},
+            'results': [],
+        }
+
+        with transaction.atomic(using=router.db_for_write(MenuItem)):
+            for size in options['sizes']:
+                report['results'].append({
+                    'size': size,
+                    'benchmarks': run_benchmarks(size, options['depth'], options['fanout'], options['repeat']),
+                })
+            transaction.set_rollback(True, using=router.db_for_write(MenuItem))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {options["output"]}'))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,50 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+
+from treemenu.bulk import FIELDS
+from treemenu.models import MenuItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Экспортирует пункты меню в JSON Lines или CSV (формат import_menu). '
+        'Строки читаются курсором через iterator(), память не зависит от размера меню'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('menu_names', nargs='*', help='Имена меню (по умолчанию - все)')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+        parser.add_argument('--output', help='Файл для записи (по умолчанию stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = MenuItem.objects.all()
+        if options['menu_names']:
+            queryset = queryset.filter(menu_name__in=options['menu_names'])
+        # Сортировка по path: родитель всегда раньше своих детей
+        rows = queryset.order_by('menu_name', 'path', 'id').values_list(
+            'id', 'parent_id', 'menu_name', 'title', 'url', 'named_url', 'order', 'visibility', 'groups'
+        ).iterator(chunk_size=options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                count = self.write(stream, rows, options['format'])
+            self.stdout.write(self.style.SUCCESS(f'Экспортировано пунктов: {count}'))
+        else:
+            self.write(self.stdout, rows, options['format'])
+
+    def write(self, stream, rows, file_format):
+        writer = csv.writer(stream) if file_format == 'csv' else None
+        if writer:
+            writer.writerow(FIELDS)
+
+        count = 0
+        for row in rows:
+            if writer:
+                writer.writerow(['' if value is None else value for value in row])
+            else:
+                stream.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n')
+            count += 1
+        return count
@@ -0,0 +1,141 @@
+import csv
+import json
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from treemenu.bulk import bulk_insert_tree, delete_menus, split_levels
+from treemenu.models import MenuItem, Visibility, parse_groups
+from treemenu.signals import menu_changed
+
+
+def read_records(stream, file_format):
+    """
+    Построчно читает записи из JSON Lines или CSV.
+    Вместо строки JSON, которая не разбирается, возвращается ошибка
+    (ValueError) - её номер строки попадает в общий список ошибок.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield exc
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует пункты меню из JSON Lines или CSV. Родители указываются '
+        'внешним ключом; вставка идёт по уровням через bulk_create в одной транзакции'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для импорта (- для stdin)')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help='Формат (по умолчанию по расширению)')
+        parser.add_argument('--replace', action='store_true', help='Удалить существующие пункты импортируемых меню')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+
+        if path == '-':
+            records = self.load(sys.stdin, file_format)
+        else:
+            with open(path, newline='', encoding='utf-8') as stream:
+                records = self.load(stream, file_format)
+
+        try:
+            levels = split_levels(records)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        menu_names = {record[1] for record in records.values()}
+
+        using = router.db_for_write(MenuItem)
+        with transaction.atomic(using=using):
+            if options['replace']:
+                # Один DELETE без выборки объектов и сигналов на каждый пункт
+                try:
+                    delete_menus(menu_names, using)
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+            created = len(bulk_insert_tree(records, levels, using, options['batch_size']))
+            # save()/full_clean() не вызывались: проверяем итоговые меню целиком
+            # одним запросом (без --replace там могли быть и старые пункты)
+            try:
+                MenuItem.validate_tree(menu_names, using=using)
+            except ValidationError as exc:
+                raise CommandError(' '.join(exc.messages))
+
+        for menu_name in menu_names:
+            menu_changed(menu_name, using=using)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано пунктов: {created} (меню: {", ".join(sorted(menu_names))})'
+        ))
+
+    def load(self, stream, file_format):
+        """
+        Читает и проверяет записи одним проходом.
+        Возвращает {key: (parent_key, menu_name, title, url, named_url, order, visibility, groups)}.
+        """
+        limits = {
+            name: MenuItem._meta.get_field(name).max_length
+            for name in ('menu_name', 'title', 'url', 'named_url', 'groups')
+        }
+        records = {}
+        errors = []
+
+        for line_number, raw in enumerate(read_records(stream, file_format), start=1):
+            if isinstance(raw, ValueError):
+                errors.append(f'{line_number}: некорректный JSON ({raw})')
+                continue
+            if not isinstance(raw, dict):
+                errors.append(f'{line_number}: запись должна быть JSON-объектом')
+                continue
+            key = str(raw.get('key') or '').strip()
+            parent = str(raw.get('parent') or '').strip() or None
+            values = {name: str(raw.get(name) or '').strip() for name in limits}
+            values['groups'] = ','.join(sorted(parse_groups(values['groups'])))
+            visibility = str(raw.get('visibility') or '').strip() or Visibility.ALL
+            try:
+                order = int(raw.get('order') or 0)
+            except (TypeError, ValueError):
+                order = -1
+
+            if not key:
+                errors.append(f'{line_number}: не указан key')
+            elif key in records:
+                errors.append(f'{line_number}: повторяющийся key "{key}"')
+            if not values['menu_name'] or not values['title']:
+                errors.append(f'{line_number}: menu_name и title обязательны')
+            for name, limit in limits.items():
+                if len(values[name]) > limit:
+                    errors.append(f'{line_number}: {name} длиннее {limit} символов')
+            if order < 0:
+                errors.append(f'{line_number}: order должен быть неотрицательным целым')
+            if visibility not in Visibility.values:
+                errors.append(f'{line_number}: неизвестное значение visibility "{visibility}"')
+
+            records[key] = (
+                parent, values['menu_name'], values['title'], values['url'], values['named_url'], order,
+                visibility, values['groups'],
+            )
+
+        for key, (parent, menu_name, *_) in records.items():
+            if parent is None:
+                continue
+            if parent not in records:
+                errors.append(f'key "{key}": родитель "{parent}" не найден')
+            elif records[parent][1] != menu_name:
+                errors.append(f'key "{key}": родитель "{parent}" из другого меню')
+
+        if errors:
+            raise CommandError('Ошибки в данных:\n' + '\n'.join(errors[:50]))
+        return records
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from treemenu.cache import default_max_depth, get_all_compiled_menus, get_compiled_menus, parse_max_depth
+from treemenu.prerender import get_static_dir, prerender_menus
+
+
+class Command(BaseCommand):
+    help = (
+        'Рендерит HTML меню для каждого активного пункта в файлы с манифестом URL -> вариант '
+        'и атомарно подменяет текущий выпуск. При TREEMENU_STATIC_MENUS = True draw_menu '
+        'отдаёт меню из этих файлов без обращений к БД и кэшу'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('menu_names', nargs='*', help='Меню для отрисовки (по умолчанию все)')
+        parser.add_argument('--output', help='Каталог выпусков (по умолчанию TREEMENU_STATIC_DIR)')
+        parser.add_argument(
+            '--max-depth', type=int, help='Глубина отрисовки, целое >= 1 (по умолчанию TREEMENU_MAX_DEPTH)',
+        )
+        parser.add_argument('--keep', type=int, default=2, help='Сколько последних выпусков хранить')
+
+    def handle(self, *args, **options):
+        directory = options['output'] or get_static_dir()
+        if not directory:
+            raise CommandError('Не задан каталог: укажите --output или TREEMENU_STATIC_DIR')
+
+        # Та же проверка, что у draw_menu: выпуск с другой глубиной он не найдёт
+        if options['max_depth'] is None:
+            max_depth = default_max_depth()
+        else:
+            try:
+                max_depth = parse_max_depth(options['max_depth'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+
+        if options['menu_names']:
+            compiled_menus = get_compiled_menus(options['menu_names'])
+        else:
+            # Все меню - по самим пунктам, как warm_menus
+            compiled_menus = get_all_compiled_menus()
+        release = prerender_menus(compiled_menus, directory, max_depth, options['keep'])
+        for menu_name, compiled in compiled_menus.items():
+            self.stdout.write(f'{menu_name}: пунктов {len(compiled)}')
+        self.stdout.write(self.style.SUCCESS(f'Выпуск {release.name}: меню {len(compiled_menus)}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from treemenu.snapshots import publish_menus
+
+
+class Command(BaseCommand):
+    help = (
+        'Публикует меню: сохраняет скомпилированное дерево одной строкой в MenuSnapshot. '
+        'При TREEMENU_SNAPSHOTS = True сайт и API показывают только опубликованные меню'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('menu_names', nargs='*', help='Меню для публикации (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        published = publish_menus(options['menu_names'] or None)
+        for menu_name, count in published.items():
+            self.stdout.write(f'{menu_name}: пунктов {count}')
+        self.stdout.write(self.style.SUCCESS(f'Опубликовано меню: {len(published)}'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from treemenu.cache import warm_menus
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает кэш меню: компилирует меню одним запросом, разрешает URL и '
+        'рендерит все варианты HTML в общий кэш. Запускается после деплоя, '
+        'чтобы воркеры стартовали с тёплым кэшем'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('menu_names', nargs='*', help='Меню для прогрева (по умолчанию все)')
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help='Собрать заново, даже если меню уже в кэше (например, после изменения urls.py)',
+        )
+
+    def handle(self, *args, **options):
+        warmed = warm_menus(options['menu_names'] or None, refresh=options['refresh'])
+        for menu_name, compiled in warmed.items():
+            self.stdout.write(f'{menu_name}: пунктов {len(compiled)}, вариантов HTML {len(compiled.fragments)}')
+        self.stdout.write(self.style.SUCCESS(f'Прогрето меню: {len(warmed)}'))
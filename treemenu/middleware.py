@@ -0,0 +1,104 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from treemenu import instrumentation, routers
+
+
+class MenuTimingMiddleware:
+    """
+    Собирает метрики меню за запрос и отдаёт их в заголовке Server-Timing.
+    Работает только при TREEMENU_INSTRUMENTATION = True.
+    
+    Поддерживает и WSGI, и ASGI: под ASGI цепочка не переключается
+    в синхронный режим ради этого middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'TREEMENU_INSTRUMENTATION', False):
+            return self.get_response(request)
+
+        token = instrumentation.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            recorder = instrumentation.finish(token)
+        return self.add_header(response, recorder)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'TREEMENU_INSTRUMENTATION', False):
+            return await self.get_response(request)
+
+        token = instrumentation.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            recorder = instrumentation.finish(token)
+        return self.add_header(response, recorder)
+
+    def add_header(self, response, recorder):
+        header = recorder.server_timing()
+        if header:
+            existing = response.get('Server-Timing')
+            response['Server-Timing'] = f'{existing}, {header}' if existing else header
+        return response
+
+
+class MenuReplicaMiddleware:
+    """
+    Read-your-writes для реплики (см. treemenu.routers): запрос с cookie
+    treemenu_primary или с изменяющим методом читает меню из основной БД,
+    а ответ на запрос, в котором меню изменилось (например, сохранение
+    в админке), ставит эту cookie на TREEMENU_REPLICA_STICKY_SECONDS секунд.
+    Без TREEMENU_REPLICA_DB ничего не делает.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not routers.get_replica_alias():
+            return self.get_response(request)
+
+        token = routers.start_request(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.finish_request(token)
+        return self.set_cookie(response, wrote)
+
+    async def __acall__(self, request):
+        if not routers.get_replica_alias():
+            return await self.get_response(request)
+
+        token = routers.start_request(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = routers.finish_request(token)
+        return self.set_cookie(response, wrote)
+
+    def pinned(self, request):
+        return request.method not in routers.SAFE_METHODS or routers.STICKY_COOKIE in request.COOKIES
+
+    def set_cookie(self, response, wrote):
+        if wrote:
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1', max_age=routers.sticky_seconds(), httponly=True, samesite='Lax'
+            )
+        return response
+
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:19
+
+from django.db import migrations, models
+
+
+# Формат сегмента зафиксирован на момент миграции (копия models.make_path_segment):
+# order (6 знаков) и id (8 знаков) в base36 + "/"
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number, width):
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36[remainder])
+    return "".join(reversed(digits)).rjust(width, "0")
+
+
+def make_path_segment(order, pk):
+    return to_base36(order, 6) + to_base36(pk, 8) + "/"
+
+
+def fill_paths(apps, schema_editor):
+    """Заполняет path/depth для существующих пунктов (обход от корней вниз)."""
+    MenuItem = apps.get_model("treemenu", "MenuItem")
+    db_alias = schema_editor.connection.alias
+    rows = list(MenuItem.objects.using(db_alias).values_list("id", "parent_id", "order"))
+
+    children = {}
+    for item_id, parent_id, order in rows:
+        children.setdefault(parent_id, []).append((item_id, order))
+
+    updated = []
+    stack = [(item_id, order, "", 0) for item_id, order in children.get(None, [])]
+    while stack:
+        item_id, order, parent_path, depth = stack.pop()
+        path = parent_path + make_path_segment(order, item_id)
+        updated.append(MenuItem(id=item_id, path=path, depth=depth))
+        stack.extend((child_id, child_order, path, depth + 1) for child_id, child_order in children.get(item_id, []))
+
+    MenuItem.objects.using(db_alias).bulk_update(updated, ["path", "depth"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treemenu", "0002_menuitem_treemenu_me_menu_na_59b795_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="menuitem",
+            name="depth",
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Уровень вложенности"),
+        ),
+        migrations.AddField(
+            model_name="menuitem",
+            name="path",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=1005, verbose_name="Путь в дереве"),
+        ),
+        migrations.AddIndex(
+            model_name="menuitem",
+            index=models.Index(fields=["menu_name", "depth", "path"], name="treemenu_me_menu_na_31d13f_idx"),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:22
+
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    """Создаёт версии для уже существующих меню."""
+    MenuItem = apps.get_model("treemenu", "MenuItem")
+    MenuVersion = apps.get_model("treemenu", "MenuVersion")
+    db_alias = schema_editor.connection.alias
+    menu_names = MenuItem.objects.using(db_alias).values_list("menu_name", flat=True).order_by().distinct()
+    MenuVersion.objects.using(db_alias).bulk_create(
+        [MenuVersion(menu_name=menu_name) for menu_name in menu_names]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treemenu", "0003_menuitem_path_depth"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MenuVersion",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("menu_name", models.CharField(max_length=50, unique=True, verbose_name="Имя меню")),
+                ("version", models.PositiveBigIntegerField(default=1, verbose_name="Версия")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Изменено")),
+            ],
+            options={
+                "verbose_name": "Версия меню",
+                "verbose_name_plural": "Версии меню",
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
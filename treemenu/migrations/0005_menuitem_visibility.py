@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treemenu", "0004_menuversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="menuitem",
+            name="groups",
+            field=models.CharField(blank=True, help_text="Показывать только участникам групп (имена через запятую, пусто - без ограничения)", max_length=200, verbose_name="Группы"),
+        ),
+        migrations.AddField(
+            model_name="menuitem",
+            name="visibility",
+            field=models.CharField(choices=[("all", "Всем"), ("anonymous", "Только анонимным"), ("authenticated", "Только авторизованным"), ("staff", "Только сотрудникам")], default="all", max_length=20, verbose_name="Видимость"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treemenu", "0005_menuitem_visibility"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="menuitem",
+            index=models.Index(fields=["menu_name", "parent", "order"], name="treemenu_me_menu_na_81d275_idx"),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treemenu", "0006_menuitem_children_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MenuSnapshot",
+            fields=[
+                ("menu_name", models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name="Имя меню")),
+                ("data", models.TextField(verbose_name="Дерево (JSON)")),
+                ("items_count", models.PositiveIntegerField(default=0, verbose_name="Пунктов")),
+                ("published_at", models.DateTimeField(auto_now=True, verbose_name="Опубликовано")),
+            ],
+            options={
+                "verbose_name": "Опубликованное меню",
+                "verbose_name_plural": "Опубликованные меню",
+            },
+        ),
+    ]
@@ -1,13 +1,249 @@
-from django.db import models
-from django.urls import reverse, NoReverseMatch
+from django.db import connections, models, router, transaction
+from django.db.models import Exists, ExpressionWrapper, F, OuterRef, Q, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.query import RawQuerySet
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from treemenu.resolver import resolve_item_url
+
+# Сегмент материализованного пути: order и id в base36 фиксированной ширины + '/'.
+# Фиксированная ширина нужна, чтобы сортировка по path давала порядок обхода
+# дерева (родитель, затем его дети по order) прямо в БД. При равном order
+# братья упорядочиваются по id, а не по title, как в Meta.ordering, поэтому
+# порядок path - это не порядок отрисовки (его даёт subtree_ordered()).
+PATH_ORDER_WIDTH = 6   # 36**6 > максимального PositiveIntegerField
+PATH_ID_WIDTH = 8      # 36**8 ~ 2.8 * 10**12 пунктов
+PATH_SEGMENT_WIDTH = PATH_ORDER_WIDTH + PATH_ID_WIDTH + 1
+PATH_MAX_LENGTH = 1005  # 67 уровней вложенности
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(number, width):
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(_BASE36[remainder])
+    return ''.join(reversed(digits)).rjust(width, '0')
+
+
+def make_path_segment(order, pk):
+    """Сегмент пути пункта: '<order><id>/'."""
+    return _to_base36(order, PATH_ORDER_WIDTH) + _to_base36(pk, PATH_ID_WIDTH) + '/'
+
+
+def path_to_ids(path):
+    """Список id от корня до пункта по его материализованному пути."""
+    return [
+        int(path[start + PATH_ORDER_WIDTH:start + PATH_SEGMENT_WIDTH - 1], 36)
+        for start in range(0, len(path), PATH_SEGMENT_WIDTH)
+    ]
+
+
+# Проверка нового родителя одним запросом: рекурсивный CTE поднимается от
+# родителя к корню, и если среди предков встретился сам пункт - получится цикл.
+# UNION (а не UNION ALL) отбрасывает повторы, поэтому обход завершается
+# даже на уже испорченных данных. Заодно возвращается меню родителя.
+PARENT_CHECK_SQL = """
+WITH RECURSIVE ancestors(id, parent_id) AS (
+    SELECT id, parent_id FROM {table} WHERE id = %s
+    UNION
+    SELECT t.id, t.parent_id FROM {table} t INNER JOIN ancestors a ON t.id = a.parent_id
+)
+SELECT menu_name, EXISTS(SELECT 1 FROM ancestors WHERE id = %s) FROM {table} WHERE id = %s
+"""
+
+# Проверка целых меню одним запросом (для массовых операций): пункт корректен,
+# если достижим от корня своего меню и родитель из того же меню
+TREE_CHECK_SQL = """
+WITH RECURSIVE reachable(id) AS (
+    SELECT id FROM {table} WHERE parent_id IS NULL AND menu_name IN ({menus})
+    UNION
+    SELECT t.id FROM {table} t INNER JOIN reachable r ON t.parent_id = r.id
+)
+SELECT c.id, p.menu_name IS NOT NULL AND p.menu_name <> c.menu_name
+FROM {table} c LEFT OUTER JOIN {table} p ON p.id = c.parent_id
+WHERE c.menu_name IN ({menus})
+  AND ((p.menu_name IS NOT NULL AND p.menu_name <> c.menu_name)
+       OR c.id NOT IN (SELECT id FROM reachable))
+ORDER BY c.id
+"""
+
+
+class Visibility(models.TextChoices):
+    """Кому показывается пункт меню (скрытый пункт скрывает и своих потомков)."""
+    ALL = 'all', 'Всем'
+    ANONYMOUS = 'anonymous', 'Только анонимным'
+    AUTHENTICATED = 'authenticated', 'Только авторизованным'
+    STAFF = 'staff', 'Только сотрудникам'
+
+
+def parse_groups(value):
+    """Имена групп из строки через запятую: 'a, b' -> frozenset({'a', 'b'})."""
+    return frozenset(name.strip() for name in value.split(',') if name.strip())
+
+
+# Защита рекурсивных запросов от бесконечного обхода на испорченных данных
+MAX_TREE_DEPTH = PATH_MAX_LENGTH // PATH_SEGMENT_WIDTH
+
+ANCESTORS_SQL = """
+WITH RECURSIVE ancestors(id, parent_id, tree_depth) AS (
+    SELECT id, parent_id, 0 FROM {table} WHERE id = %s
+    UNION ALL
+    SELECT t.id, t.parent_id, a.tree_depth - 1
+    FROM {table} t INNER JOIN ancestors a ON t.id = a.parent_id
+    WHERE a.tree_depth > %s
+)
+SELECT {columns}, a.tree_depth FROM {table} m INNER JOIN ancestors a ON m.id = a.id
+WHERE a.tree_depth <= %s
+ORDER BY a.tree_depth
+"""
+
+DESCENDANTS_SQL = """
+WITH RECURSIVE {nodes_cte}subtree(id, tree_depth, tree_path) AS (
+    SELECT r.id, 0, {root_segment} FROM {nodes} r WHERE r.id = %s
+    UNION ALL
+    SELECT t.id, s.tree_depth + 1, s.tree_path || {child_segment}
+    FROM {nodes} t INNER JOIN subtree s ON t.parent_id = s.id
+    WHERE s.tree_depth < %s
+)
+SELECT {columns}, s.tree_depth, s.tree_path FROM {table} m INNER JOIN subtree s ON m.id = s.id
+WHERE s.tree_depth >= %s
+ORDER BY {ordering}
+"""
+
+
+# Пункты меню узла с номером среди братьев в порядке отрисовки
+# (order, title, как Meta.ordering; id - для однозначности)
+SIBLINGS_CTE = """siblings(id, parent_id, sibling_rank) AS (
+    SELECT id, parent_id, ROW_NUMBER() OVER (PARTITION BY parent_id ORDER BY {order}, title, id)
+    FROM {table} WHERE menu_name = (SELECT menu_name FROM {table} WHERE id = %s)
+),
+"""
+
+
+def _sort_segment_sql(connection, alias, names=('order', 'id')):
+    """
+    SQL-выражение сегмента ключа сортировки: колонки names (по умолчанию
+    order и id) с нулями слева + '/' (как path, но в десятичной записи -
+    её умеют все СУБД).
+    """
+    columns = [f'{alias}.{connection.ops.quote_name(name)}' for name in names]
+    if connection.vendor == 'sqlite':
+        padded = [f"printf('%%010d', {column})" for column in columns]
+    else:
+        padded = [f"LPAD(CAST({column} AS VARCHAR(20)), 10, '0')" for column in columns]
+    return ' || '.join(padded) + " || '/'"
+
+
+class MenuItemQuerySet(models.QuerySet):
+    """
+    Навигация по дереву рекурсивными запросами (WITH RECURSIVE, SQLite и
+    PostgreSQL): каждый вызов - один запрос, независимо от глубины, и
+    результат не зависит от заполненности path (пункты из bulk_create).
+    
+    Методы возвращают RawQuerySet с экземплярами MenuItem и
+    дополнительными колонками:
+    - tree_depth - уровень относительно узла (0 - сам узел, у потомков
+      1, 2, ..., у предков -1, -2, ...);
+    - tree_path (кроме ancestors_of) - ключ сортировки в порядке обхода
+      дерева: у descendants_of братья по order и id, как у path, у
+      subtree_ordered - по order и title, как при отрисовке.
+    """
+
+    def visible_to(self, audience, with_ancestors=True):
+        """
+        Пункты, видимые аудитории (audience.Audience): скрытый пункт
+        скрывает и всё своё поддерево. Потомки скрытых пунктов отсекаются
+        подзапросом NOT EXISTS по path (пункты с пустым path проверяются
+        только по своим правилам).
+        
+        with_ancestors=False - только собственные правила пункта: для
+        выборок, из которых дерево строится в памяти (build_tree сам
+        отбрасывает пункты без видимого родителя), подзапрос не нужен.
+        """
+        condition = Q(visibility__in=audience.allowed_visibility)
+        if not audience.all_groups:
+            # groups хранится как 'a,b,c' (см. MenuItem.clean)
+            groups = Q(groups='')
+            for name in audience.groups:
+                groups |= (
+                    Q(groups=name) | Q(groups__startswith=f'{name},')
+                    | Q(groups__endswith=f',{name}') | Q(groups__contains=f',{name},')
+                )
+            condition &= groups
+        queryset = self.filter(condition)
+        if with_ancestors:
+            hidden_ancestors = self.model.objects.exclude(condition).exclude(path='').annotate(
+                descendant_path=ExpressionWrapper(OuterRef('path'), output_field=models.CharField()),
+            ).filter(menu_name=OuterRef('menu_name'), descendant_path__startswith=F('path'))
+            queryset = queryset.exclude(Exists(hidden_ancestors))
+        return queryset
+
+    def _tree_query(self, template, params, **parts):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        sql = template.format(
+            table=quote(self.model._meta.db_table),
+            columns=', '.join(f'm.{quote(field.column)}' for field in self.model._meta.concrete_fields),
+            **parts,
+        )
+        return RawQuerySet(sql, model=self.model, params=params, using=self.db)
+
+    def ancestors_of(self, node, include_self=False):
+        """Предки узла от корня вниз (ORDER BY tree_depth)."""
+        return self._tree_query(
+            ANCESTORS_SQL, [getattr(node, 'pk', node), -MAX_TREE_DEPTH, 0 if include_self else -1],
+        )
+
+    def descendants_of(self, node, max_depth=None, include_self=False):
+        """
+        Потомки узла по уровням (в ширину), внутри уровня - по order и id.
+        max_depth ограничивает глубину относительно узла (1 - только дети).
+        """
+        quote = connections[self.db].ops.quote_name
+        return self._descendants(node, max_depth, include_self, f's.tree_depth, m.{quote("order")}, m.id')
+
+    def subtree_ordered(self, node, max_depth=None):
+        """
+        Поддерево вместе с узлом в порядке отрисовки: родитель, затем его
+        дети по order и title (как в tree.py). tree_path здесь составлен из
+        номеров пунктов среди братьев, а не из order и id.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        node_id = getattr(node, 'pk', node)
+        return self._tree_query(
+            DESCENDANTS_SQL,
+            [node_id, node_id, MAX_TREE_DEPTH if max_depth is None else max_depth, 0],
+            nodes_cte=SIBLINGS_CTE.format(order=quote('order'), table=quote(self.model._meta.db_table)),
+            nodes='siblings',
+            root_segment=_sort_segment_sql(connection, 'r', ['sibling_rank']),
+            child_segment=_sort_segment_sql(connection, 't', ['sibling_rank']),
+            ordering='s.tree_path',
+        )
+
+    def _descendants(self, node, max_depth, include_self, ordering):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        return self._tree_query(
+            DESCENDANTS_SQL,
+            [getattr(node, 'pk', node), MAX_TREE_DEPTH if max_depth is None else max_depth, 0 if include_self else 1],
+            nodes_cte='',
+            nodes=table,
+            root_segment=_sort_segment_sql(connection, 'r'),
+            child_segment=_sort_segment_sql(connection, 't'),
+            ordering=ordering,
+        )
+
 
 class MenuItem(models.Model):
     """
     Модель пункта меню с древовидной структурой.
     Использует self-referencing FK для хранения иерархии.
     """
+    objects = MenuItemQuerySet.as_manager()
+
     menu_name = models.CharField(
         max_length=50,
         verbose_name='Имя меню',
@@ -43,6 +279,35 @@ class MenuItem(models.Model):
         verbose_name='Порядок',
         help_text='Порядок сортировки (меньше = выше)'
     )
+    # Правила видимости хранятся прямо в строке пункта, чтобы меню по-прежнему
+    # загружалось одним запросом; фильтрация - в памяти (CompiledMenu.for_audience)
+    visibility = models.CharField(
+        max_length=20,
+        choices=Visibility.choices,
+        default=Visibility.ALL,
+        verbose_name='Видимость'
+    )
+    groups = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name='Группы',
+        help_text='Показывать только участникам групп (имена через запятую, пусто - без ограничения)'
+    )
+    # Материализованный путь от корня (см. make_path_segment).
+    # Поддерживается в save(): поддерево = path__startswith, предки = path_to_ids(path),
+    # order_by('path') = порядок обхода дерева (братья по order и id, не по title).
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH,
+        blank=True,
+        editable=False,
+        db_index=True,  # Префиксный поиск поддерева
+        verbose_name='Путь в дереве'
+    )
+    depth = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Уровень вложенности'
+    )
 
     class Meta:
         verbose_name = 'Пункт меню'
@@ -50,10 +315,20 @@ class MenuItem(models.Model):
         ordering = ['order', 'title']
         indexes = [
             models.Index(fields=['menu_name', 'order']),  # Составной индекс для сортировки
+            models.Index(fields=['menu_name', 'depth', 'path']),  # Выборка верхних уровней меню
+            models.Index(fields=['menu_name', 'parent', 'order']),  # Дети пункта по одному уровню (API children)
         ]
 
     def __str__(self):
         return f'{self.menu_name}: {self.title}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем исходное имя меню: при переносе пункта в другое меню
+        # нужно сбросить кэш обоих меню (см. signals.py)
+        instance._loaded_menu_name = instance.__dict__.get('menu_name')
+        return instance
     
     def clean(self):
         """Валидация модели перед сохранением"""
@@ -61,32 +336,217 @@ class MenuItem(models.Model):
         if self.parent_id and self.parent_id == self.pk:
             raise ValidationError({'parent': 'Пункт не может быть родителем самого себя'})
         
+        if self.parent_id:
+            self.validate_parent()
+        
+        # Храним группы в едином виде: 'editors,managers'
+        self.groups = ','.join(sorted(parse_groups(self.groups)))
+        
+        # URL не обязателен - если не указан, будет '#'
+        # (валидация не нужна, это нормальное поведение)
+    
+    def validate_parent(self, using=None):
+        """
+        Проверяет родителя одним запросом (рекурсивный CTE): родитель
+        существует, он из того же меню и не является потомком пункта
+        (цикл любой длины, A -> B -> A).
+        """
+        connection = connections[using or router.db_for_write(MenuItem, instance=self)]
+        sql = PARENT_CHECK_SQL.format(table=connection.ops.quote_name(MenuItem._meta.db_table))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.parent_id, self.pk, self.parent_id])
+            row = cursor.fetchone()
+        
+        if row is None:
+            raise ValidationError({'parent': 'Родительский пункт не найден'})
+        parent_menu_name, is_descendant = row
         # Родитель должен быть из того же меню
-        if self.parent and self.parent.menu_name != self.menu_name:
+        if parent_menu_name != self.menu_name:
             raise ValidationError({
                 'parent': 'Родительский пункт должен быть из того же меню'
             })
+        if self.pk and is_descendant:
+            raise ValidationError({'parent': 'Нельзя переместить пункт внутрь его же потомка'})
+    
+    @classmethod
+    def validate_tree(cls, menu_names, using=None):
+        """
+        Проверяет целые меню одним запросом - замена full_clean() на каждый
+        пункт для массовых операций (импорт, bulk_create, save(validate=False)).
+        Находит пункты с родителем из другого меню и пункты, недостижимые
+        от корней (циклы и их потомки). Вызывается внутри той же транзакции,
+        чтобы ошибка откатила изменения.
+        """
+        menu_names = list(menu_names)
+        if not menu_names:
+            return
+        connection = connections[using or router.db_for_write(cls)]
+        sql = TREE_CHECK_SQL.format(
+            table=connection.ops.quote_name(cls._meta.db_table),
+            menus=', '.join(['%s'] * len(menu_names)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, menu_names * 2)
+            rows = cursor.fetchall()
         
-        # URL не обязателен - если не указан, будет '#'
-        # (валидация не нужна, это нормальное поведение)
+        if rows:
+            errors = [
+                f'{item_id}: ' + ('родитель из другого меню' if wrong_menu else 'циклическая ссылка на родителя')
+                for item_id, wrong_menu in rows[:50]
+            ]
+            raise ValidationError(f'Некорректные пункты меню ({len(rows)}): ' + '; '.join(errors))
     
-    def save(self, *args, **kwargs):
-        """Переопределяем save для валидации"""
-        self.full_clean()
-        super().save(*args, **kwargs)
+    def save(self, *args, validate=True, **kwargs):
+        """
+        Переопределяем save для валидации и поддержки материализованного пути.
+        
+        При перемещении пункта (смена parent или order) пути и уровни
+        всего поддерева обновляются одним UPDATE.
+        
+        validate=False пропускает full_clean(): для серии сохранений, после
+        которой вызывается MenuItem.validate_tree().
+        
+        С update_fields без parent и order путь не пересчитывается, иначе
+        path и depth добавляются к сохраняемым полям.
+        """
+        if validate:
+            # Существование родителя проверяет validate_parent() тем же запросом,
+            # что и циклы, поэтому отдельная проверка FK не нужна
+            self.full_clean(exclude=['parent'])
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if not update_fields & {'parent', 'parent_id', 'order'}:
+                return super().save(*args, **kwargs)
+            kwargs['update_fields'] = update_fields | {'path', 'depth'}
+        using = kwargs.get('using') or router.db_for_write(MenuItem, instance=self)
+        items = MenuItem.objects.using(using)
+        
+        with transaction.atomic(using=using):
+            # Текущие значения читаем из БД: объект в памяти мог устареть,
+            # если с тех пор переместили кого-то из его предков
+            old_path, old_depth = '', 0
+            if self.pk:
+                old_path, old_depth = items.filter(pk=self.pk).values_list('path', 'depth').first() or ('', 0)
+            
+            parent_path, self.depth = '', 0
+            if self.parent_id:
+                parent_path, parent_depth = items.filter(pk=self.parent_id).values_list('path', 'depth').get()
+                self.depth = parent_depth + 1
+                if old_path and parent_path.startswith(old_path):
+                    raise ValidationError({'parent': 'Нельзя переместить пункт внутрь его же потомка'})
+            
+            if self.pk:
+                self.path = parent_path + make_path_segment(self.order, self.pk)
+            super().save(*args, **kwargs)
+            
+            if not old_path:
+                # Новый пункт: id известен только после вставки
+                self.path = parent_path + make_path_segment(self.order, self.pk)
+                items.filter(pk=self.pk).update(path=self.path)
+            elif old_path != self.path:
+                items.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
+    
+    def get_ancestors(self, include_self=False):
+        """Предки пункта от корня вниз - один запрос по первичному ключу."""
+        ids = path_to_ids(self.path)
+        if not include_self:
+            ids = ids[:-1]
+        return MenuItem.objects.filter(pk__in=ids).order_by('depth')
+    
+    def get_descendants(self, include_self=False):
+        """
+        Все потомки пункта в порядке path (обход дерева, братья по order и id) -
+        один индексный запрос.
+        """
+        queryset = MenuItem.objects.filter(path__startswith=self.path).order_by('path')
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
 
     def get_url(self):
         """
         Возвращает URL пункта меню.
         Приоритет: named_url > url > '#'
+        (reverse() мемоизирован для текущего URLconf)
         """
-        if self.named_url:
-            try:
-                return reverse(self.named_url)
-            except NoReverseMatch:
-                # Если named_url не найден, возвращаем '#'
-                # В production можно добавить логирование
-                return '#'
-        if self.url:
-            return self.url
-        return '#'
+        return resolve_item_url(self.url, self.named_url)
+
+
+class MenuVersion(models.Model):
+    """
+    Версия меню: увеличивается при каждом изменении его пунктов
+    (сигналы post_save/post_delete у MenuItem).
+    
+    Позволяет отвечать на условные запросы API (ETag / Last-Modified)
+    одним запросом по индексу, не загружая сами пункты.
+    """
+    menu_name = models.CharField(
+        max_length=50,
+        unique=True,
+        verbose_name='Имя меню'
+    )
+    version = models.PositiveBigIntegerField(
+        default=1,
+        verbose_name='Версия'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Изменено'
+    )
+
+    class Meta:
+        verbose_name = 'Версия меню'
+        verbose_name_plural = 'Версии меню'
+
+    def __str__(self):
+        return f'{self.menu_name}: v{self.version}'
+
+    @classmethod
+    def bump(cls, menu_name, using=None):
+        """Увеличивает версию меню (создаёт запись, если её ещё нет)."""
+        manager = cls.objects.db_manager(using or router.db_for_write(cls))
+        updated = manager.filter(menu_name=menu_name).update(
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            manager.get_or_create(menu_name=menu_name)
+
+
+class MenuSnapshot(models.Model):
+    """
+    Опубликованная версия меню (см. snapshots.py): всё дерево одной строкой
+    компактного JSON - пункты в порядке отрисовки с уже разрешёнными URL.
+    
+    При TREEMENU_SNAPSHOTS = True draw_menu и API by-name читают меню
+    отсюда (одна строка по первичному ключу), а изменения пунктов остаются
+    черновиком до следующей публикации.
+    """
+    menu_name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name='Имя меню'
+    )
+    data = models.TextField(
+        verbose_name='Дерево (JSON)'
+    )
+    items_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Пунктов'
+    )
+    published_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Опубликовано'
+    )
+
+    class Meta:
+        verbose_name = 'Опубликованное меню'
+        verbose_name_plural = 'Опубликованные меню'
+
+    def __str__(self):
+        return f'{self.menu_name} ({self.published_at:%Y-%m-%d %H:%M})'
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class MenuItemCursorPagination(BasePagination):
+    """
+    Keyset-пагинация по (menu_name, order, id).
+    
+    В отличие от PageNumberPagination нет COUNT и OFFSET: каждая страница -
+    это индексный диапазон "после последней строки предыдущей страницы",
+    поэтому полный обход занимает время, пропорциональное объёму данных.
+    Порядок совпадает с индексом (menu_name, order); id - для уникальности.
+    
+    Пример: GET /api/menu/?pagination=cursor&flat=1&page_size=500
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('menu_name', 'order', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            menu_name, order, pk = position
+            queryset = queryset.filter(
+                Q(menu_name__gt=menu_name)
+                | Q(menu_name=menu_name, order__gt=order)
+                | Q(menu_name=menu_name, order=order, pk__gt=pk)
+            )
+
+        # Лишняя строка показывает, есть ли следующая страница
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE or self.max_page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            menu_name, order, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            return str(menu_name), int(order), int(pk)
+        except (TypeError, ValueError, binascii.Error, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, item):
+        position = json.dumps([item.menu_name, item.order, item.pk])
+        return base64.urlsafe_b64encode(position.encode()).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
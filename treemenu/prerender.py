@@ -0,0 +1,211 @@
+"""
+Статическая отрисовка меню в файлы (для узлов без общего кэша).
+
+Команда prerender_menus рендерит HTML каждого меню для каждого активного
+пункта и типовых аудиторий и пишет его в каталог выпуска:
+
+    <TREEMENU_STATIC_DIR>/
+        current -> releases/<выпуск>    # симлинк, переключается атомарно
+        releases/<выпуск>/
+            manifest.json               # URL -> (смещение, длина) варианта
+            0.html, 1.html, ...         # варианты меню подряд, UTF-8
+
+В режиме TREEMENU_STATIC_MENUS draw_menu берёт HTML из отображённых
+в память (mmap) файлов по манифесту: без БД, кэша и рендера. Новый
+выпуск пишется рядом и подменяет старый одной заменой симлинка, поэтому
+воркеры никогда не видят наполовину записанный каталог.
+"""
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.safestring import mark_safe
+
+from treemenu.rendering import render_menu
+from treemenu.tree import TRIE_ITEM, build_url_trie, split_url_path, standard_variants
+
+MANIFEST_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+CURRENT_LINK = 'current'
+RELEASES_DIR = 'releases'
+# Вариант меню без правил видимости (одинаков для всех)
+ALL_AUDIENCES = '*'
+
+
+def get_static_dir():
+    return getattr(settings, 'TREEMENU_STATIC_DIR', None)
+
+
+def _reload_interval():
+    return getattr(settings, 'TREEMENU_STATIC_RELOAD_INTERVAL', 1)
+
+
+def _variants(compiled):
+    """Пары (ключ аудитории, дерево) для рендера."""
+    if not compiled.has_rules:
+        return [(ALL_AUDIENCES, compiled)]
+    return list(standard_variants(compiled).items())
+
+
+def _write_menu(path, compiled, max_depth):
+    """
+    Пишет все варианты меню в файл, возвращает запись манифеста меню.
+    HTML для пункта рендерится один раз, даже если на него ведут
+    несколько URL.
+    """
+    variants = {}
+    offset = 0
+    with open(path, 'wb') as output:
+        def write(html):
+            nonlocal offset
+            data = html.encode()
+            output.write(data)
+            offset += len(data)
+            return [offset - len(data), len(data)]
+
+        for key, variant in _variants(compiled):
+            ranges = {None: write(render_menu(variant, None, max_depth))}
+            urls = {}
+            for url, item_id in variant.url_index.items():
+                if item_id not in ranges:
+                    ranges[item_id] = write(render_menu(variant, item_id, max_depth))
+                urls[url] = ranges[item_id]
+            variants[key] = {'none': ranges[None], 'urls': urls}
+
+    return {
+        'file': path.name,
+        'rule_groups': sorted(compiled.rule_groups),
+        'variants': variants,
+    }
+
+
+def prerender_menus(compiled_menus, directory, max_depth=None, keep=2):
+    """
+    Рендерит меню ({menu_name: CompiledMenu}) в новый выпуск каталога
+    directory и атомарно делает его текущим. Старые выпуски, кроме keep
+    последних, удаляются (уже открытые mmap при этом остаются валидны).
+    Возвращает путь нового выпуска.
+    """
+    root = Path(directory)
+    releases = root / RELEASES_DIR
+    releases.mkdir(parents=True, exist_ok=True)
+    # Имена выпусков сортируются по времени создания (до наносекунд)
+    prefix = f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10 ** 9:09d}-'
+    release = Path(tempfile.mkdtemp(prefix=prefix, dir=releases))
+    # mkdtemp создаёт каталог с правами 0700, а читают его воркеры сайта
+    release.chmod(0o755)
+
+    menus = {}
+    for index, (menu_name, compiled) in enumerate(sorted(compiled_menus.items())):
+        menus[menu_name] = _write_menu(release / f'{index}.html', compiled, max_depth)
+    manifest = {'format': MANIFEST_FORMAT, 'max_depth': max_depth, 'menus': menus}
+    with open(release / MANIFEST_NAME, 'w', encoding='utf-8') as output:
+        json.dump(manifest, output, ensure_ascii=False, separators=(',', ':'))
+
+    # Симлинк создаётся под временным именем и переименовывается поверх
+    # текущего: rename атомарен, читатель видит либо старый выпуск, либо новый
+    link = root / f'.{CURRENT_LINK}-{release.name}'
+    os.symlink(Path(RELEASES_DIR) / release.name, link)
+    os.replace(link, root / CURRENT_LINK)
+
+    for old in sorted(releases.iterdir(), key=lambda path: path.name)[:-keep or None]:
+        if old != release:
+            shutil.rmtree(old, ignore_errors=True)
+    return release
+
+
+class StaticMenu:
+    """Варианты одного меню из выпуска: диапазоны байт в отображённом файле."""
+    __slots__ = ('data', 'rule_groups', 'variants', '_tries')
+
+    def __init__(self, path, entry):
+        self.data = b''
+        if path.stat().st_size:
+            with open(path, 'rb') as source:
+                self.data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        self.rule_groups = frozenset(entry['rule_groups'])
+        self.variants = entry['variants']
+        self._tries = {}
+
+    @property
+    def has_rules(self):
+        return ALL_AUDIENCES not in self.variants
+
+    def get_html(self, audience_key, current_url, prefix_match=False):
+        """
+        HTML для URL или None, если вариант для аудитории не рендерился.
+        Поиск активного пункта такой же, как CompiledMenu.find_active_id().
+        """
+        variant = self.variants.get(audience_key)
+        if variant is None:
+            return None
+        urls = variant['urls']
+        found = urls.get(current_url)
+        if found is None and prefix_match:
+            trie = self._tries.get(audience_key)
+            if trie is None:
+                trie = self._tries[audience_key] = build_url_trie(urls)
+            node = trie
+            for segment in split_url_path(current_url) or ():
+                node = node.get(segment)
+                if node is None:
+                    break
+                found = node.get(TRIE_ITEM, found)
+        offset, length = found or variant['none']
+        return mark_safe(self.data[offset:offset + length].decode())
+
+
+class StaticRelease:
+    """Загруженный выпуск: манифест + отображённые в память файлы меню."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path / MANIFEST_NAME, encoding='utf-8') as source:
+            manifest = json.load(source)
+        if manifest.get('format') != MANIFEST_FORMAT:
+            raise ValueError(f'Неизвестный формат манифеста меню: {manifest.get("format")}')
+        self.max_depth = manifest['max_depth']
+        self.menus = {
+            menu_name: StaticMenu(path / entry['file'], entry)
+            for menu_name, entry in manifest['menus'].items()
+        }
+
+
+_release = None
+_checked_at = None
+_release_lock = threading.Lock()
+
+
+def get_release():
+    """
+    Текущий выпуск (или None, если каталога ещё нет). Симлинк current
+    перепроверяется не чаще раза в TREEMENU_STATIC_RELOAD_INTERVAL секунд:
+    после нового prerender_menus воркеры подхватывают выпуск сами.
+    """
+    global _release, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < _reload_interval():
+        return _release
+    with _release_lock:
+        directory = get_static_dir()
+        path = Path(os.path.realpath(Path(directory) / CURRENT_LINK)) if directory else None
+        if path is None or not (path / MANIFEST_NAME).exists():
+            _release = None
+        elif _release is None or _release.path != path:
+            _release = StaticRelease(path)
+        _checked_at = now
+    return _release
+
+
+def reset_release():
+    """Забывает загруженный выпуск (используется в тестах)."""
+    global _release, _checked_at
+    with _release_lock:
+        _release = None
+        _checked_at = None
@@ -0,0 +1,86 @@
+"""
+Отрисовка скомпилированного меню в HTML.
+"""
+from django.utils.safestring import mark_safe
+
+
+def escape_title(title):
+    """
+    Экранирует название пункта для вставки в HTML.
+    Вызывается один раз при компиляции меню, а не при каждой отрисовке.
+    """
+    # Экранируем HTML вручную, т.к. используем mark_safe
+    return str(title).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def render_menu_items(items, active_id, active_path, items_dict=None, max_depth=None):
+    """
+    Рендерит список пунктов меню в HTML.
+    
+    Логика раскрытия:
+    - Пункт раскрыт если он в active_path (сам активный или его предок)
+    - Также раскрыт первый уровень под активным пунктом
+    - max_depth ограничивает число выводимых уровней (1 - только корневые
+      пункты); у пунктов последнего уровня остаётся класс has-children
+    
+    Обход итеративный (стек итераторов вместо рекурсии): глубина меню
+    не ограничена лимитом рекурсии, весь HTML пишется в один буфер
+    и склеивается одним join в конце. items_dict оставлен для совместимости.
+    """
+    if not items:
+        return ''
+    
+    html = ['<ul class="tree-menu">']
+    stack = [iter(items)]
+    
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            # Уровень закончился: закрываем список и пункт-родитель
+            stack.pop()
+            html.append('</ul></li>' if stack else '</ul>')
+            continue
+        
+        is_active = item.id == active_id
+        is_in_path = item.id in active_path
+        
+        # Определяем, нужно ли раскрыть детей
+        # 1) Если пункт в пути к активному - раскрываем
+        # 2) Если родитель этого пункта активный - раскрываем (первый уровень под активным)
+        parent_is_active = item.parent_id and item.parent_id == active_id
+        should_expand = is_in_path or parent_is_active
+        # Глубже max_depth не спускаемся (len(stack) - число уже открытых уровней)
+        if max_depth is not None and len(stack) >= max_depth:
+            should_expand = False
+        
+        # CSS классы
+        classes = []
+        if is_active:
+            classes.append('active')
+        if is_in_path:
+            classes.append('in-path')
+        if item.children_list:
+            classes.append('has-children')
+            if should_expand:
+                classes.append('expanded')
+        
+        class_str = f' class="{" ".join(classes)}"' if classes else ''
+        
+        html.append(f'<li{class_str}><a href="{item.url}">{item.title_html}</a>')
+        
+        # Спускаемся к детям, если нужно раскрыть; иначе пункт закрыт
+        if item.children_list and should_expand:
+            html.append('<ul class="tree-menu">')
+            stack.append(iter(item.children_list))
+        else:
+            html.append('</li>')
+    
+    return ''.join(html)
+
+
+def render_menu(compiled, active_id, max_depth=None):
+    """
+    Рендерит всё меню для заданного активного пункта (None - без активного).
+    """
+    active_path = compiled.get_path(active_id)
+    return mark_safe(render_menu_items(compiled.root_items, active_id, active_path, max_depth=max_depth))
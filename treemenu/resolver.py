@@ -0,0 +1,87 @@
+"""
+Мемоизация reverse() для named_url пунктов меню.
+
+Результат reverse() зависит только от URLconf и префикса скрипта,
+поэтому кэшируется отдельно для каждой такой пары. Ненайденные имена
+тоже кэшируются (как None), чтобы не бросать и не ловить NoReverseMatch
+на каждом запросе, а вместо этого учитываются в счётчике.
+"""
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse
+
+logger = logging.getLogger(__name__)
+
+_resolved = {}
+_unresolved = Counter()
+_lock = threading.Lock()
+
+
+def urlconf_key():
+    """
+    Строка, однозначно определяющая текущие правила reverse():
+    активный URLconf (с учётом set_urlconf) и префикс скрипта.
+    """
+    urlconf = get_urlconf() or settings.ROOT_URLCONF
+    return f'{getattr(urlconf, "__name__", urlconf)}|{get_script_prefix()}'
+
+
+def resolve_named_url(named_url):
+    """
+    Возвращает URL по имени или None, если имя не найдено.
+    reverse() вызывается не больше одного раза на имя для каждого URLconf.
+    """
+    key = urlconf_key()
+    resolved = _resolved.get(key)
+    if resolved is not None and named_url in resolved:
+        return resolved[named_url]
+
+    try:
+        url = reverse(named_url)
+    except NoReverseMatch:
+        url = None
+        logger.warning('Menu named_url "%s" cannot be resolved (%s)', named_url, key)
+
+    with _lock:
+        _resolved.setdefault(key, {})[named_url] = url
+        if url is None:
+            _unresolved[named_url] += 1
+    return url
+
+
+def resolve_item_url(url, named_url):
+    """
+    URL пункта меню по его полям.
+    Приоритет: named_url > url > '#'
+    """
+    if named_url:
+        # Если named_url не найден, возвращаем '#'
+        return resolve_named_url(named_url) or '#'
+    return url or '#'
+
+
+def get_unresolved_named_urls():
+    """
+    Счётчик ненайденных named_url: имя -> сколько раз его не удалось
+    разрешить (по одному разу на URLconf, а не на каждый запрос).
+    """
+    with _lock:
+        return dict(_unresolved)
+
+
+def clear_resolved_urls():
+    """Сбрасывает мемоизацию и счётчик ненайденных имён."""
+    with _lock:
+        _resolved.clear()
+        _unresolved.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_urlconf_change(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        clear_resolved_urls()
@@ -0,0 +1,102 @@
+"""
+Маршрутизация запросов меню между основной БД и репликой.
+
+Чтения treemenu (draw_menu, API) идут в реплику (TREEMENU_REPLICA_DB),
+записи - в основную БД (TREEMENU_PRIMARY_DB). Из основной БД читают:
+- запросы с изменяющими методами (POST, PUT, DELETE...) целиком;
+- запрос, в котором меню изменилось, - с момента изменения;
+- автор изменения ещё TREEMENU_REPLICA_STICKY_SECONDS секунд (cookie, см.
+  MenuReplicaMiddleware) - read-your-writes после сохранения в админке,
+  пока реплика догоняет;
+- сборка недавно изменённого меню для кэша (см. cache._compile_using).
+Без TREEMENU_REPLICA_DB роутер ничего не меняет.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+
+STICKY_COOKIE = 'treemenu_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('treemenu_db_state', default=None)
+
+
+class _DbState:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def get_replica_alias():
+    return getattr(settings, 'TREEMENU_REPLICA_DB', None)
+
+
+def get_primary_alias():
+    return getattr(settings, 'TREEMENU_PRIMARY_DB', 'default')
+
+
+def sticky_seconds():
+    return getattr(settings, 'TREEMENU_REPLICA_STICKY_SECONDS', 10)
+
+
+def start_request(pinned):
+    """Начинает состояние запроса; возвращает токен для finish_request()."""
+    return _state.set(_DbState(pinned))
+
+
+def finish_request(token):
+    """Завершает состояние запроса; возвращает True, если в нём были записи."""
+    state = _state.get()
+    _state.reset(token)
+    return state.wrote
+
+
+def pin_to_primary():
+    """
+    Закрепляет чтения текущего запроса за основной БД (вызывается при
+    изменении меню). Вне запроса ничего не делает: management-командам
+    достаточно того, что недавно изменённые меню собираются из основной БД.
+    """
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+        state.wrote = True
+
+
+def is_pinned():
+    state = _state.get()
+    return state is not None and state.pinned
+
+
+class MenuReplicaRouter:
+    """
+    Роутер для DATABASE_ROUTERS: модели treemenu читаются из реплики,
+    пишутся в основную БД. Остальные приложения не затрагиваются.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'treemenu':
+            return None
+        replica = get_replica_alias()
+        if not replica:
+            return None
+        if is_pinned():
+            return get_primary_alias()
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Связанные объекты читаем из той же БД, что и сам объект
+            return instance._state.db
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'treemenu' or not get_replica_alias():
+            return None
+        return get_primary_alias()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия основной БД, связи между ними допустимы
+        if obj1._meta.app_label == 'treemenu' and obj2._meta.app_label == 'treemenu':
+            return True
+        return None
@@ -16,15 +16,52 @@ class MenuItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_children(self, obj):
-        """Рекурсивно сериализуем детей"""
-        children = obj.children.all().order_by('order', 'title')
-        return MenuItemSerializer(children, many=True).data
+        """
+        Рекурсивно сериализуем детей.
+        
+        Если дерево уже построено в памяти (children_list из build_tree),
+        запросов к БД нет. Иначе - fallback на related manager
+        (сортировка из Meta.ordering, по запросу на узел).
+        """
+        children = getattr(obj, 'children_list', None)
+        if children is None:
+            children = obj.children.all()
+        return MenuItemSerializer(children, many=True, context=self.context).data
     
     def get_url(self, obj):
         """Возвращаем вычисленный URL"""
         return obj.get_url()
 
 
+class MenuItemFlatSerializer(serializers.ModelSerializer):
+    """
+    Плоский serializer для MenuItem: вместо вложенных children - id родителя.
+    Каждый пункт передаётся ровно один раз (?flat=1 в API).
+    """
+    url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = MenuItem
+        fields = ['id', 'title', 'menu_name', 'parent', 'url', 'named_url', 'order', 'depth']
+        read_only_fields = fields
+    
+    def get_url(self, obj):
+        """Возвращаем вычисленный URL"""
+        return obj.get_url()
+
+
+class MenuItemChildSerializer(MenuItemFlatSerializer):
+    """
+    Пункт одного уровня для ленивой загрузки дерева (API children):
+    has_children подсказывает клиенту, можно ли раскрыть ветку.
+    """
+    has_children = serializers.BooleanField(read_only=True)
+    
+    class Meta(MenuItemFlatSerializer.Meta):
+        fields = MenuItemFlatSerializer.Meta.fields + ['has_children']
+        read_only_fields = fields
+
+
 class MenuListSerializer(serializers.Serializer):
     """
     Serializer для списка меню по имени.
@@ -0,0 +1,66 @@
+import logging
+import threading
+
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from treemenu import routers
+from treemenu.cache import invalidate_menu, warm_menus
+from treemenu.models import MenuItem, MenuVersion
+
+
+def menu_changed(menu_name, using=None):
+    """
+    Увеличивает версию меню и сбрасывает его кэш.
+    Вызывается сигналами, а также массовыми операциями, которые сигналы
+    обходят (bulk_create, QuerySet.update/delete).
+    Дальнейшие чтения меню в этом запросе идут в основную БД.
+    """
+    MenuVersion.bump(menu_name, using=using)
+    invalidate_menu(menu_name)
+    routers.pin_to_primary()
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def invalidate_menu_cache(sender, instance, **kwargs):
+    """
+    Сбрасывает кэш и увеличивает версию меню при изменении пункта.
+    При переносе пункта в другое меню это делается для обоих меню.
+    """
+    menu_names = {instance.menu_name}
+    loaded_menu_name = getattr(instance, '_loaded_menu_name', None)
+    if loaded_menu_name:
+        menu_names.add(loaded_menu_name)
+
+    for menu_name in menu_names:
+        menu_changed(menu_name, using=kwargs.get('using'))
+
+    instance._loaded_menu_name = instance.menu_name
+
+
+logger = logging.getLogger(__name__)
+_warm_lock = threading.Lock()
+
+
+def warm_on_first_request(sender, **kwargs):
+    """
+    Прогрев кэша меню в начале первого запроса воркера
+    (TREEMENU_WARM_ON_STARTUP, подключается в TreemenuConfig.ready()).
+    
+    Прямо в ready() запросы к БД не делаются: Django предупреждает об
+    обращениях к БД до инициализации приложений, а при migrate на чистой
+    базе таблиц ещё нет. Ошибка прогрева не ломает запрос - меню
+    соберутся обычным путём.
+    """
+    with _warm_lock:
+        if not request_started.disconnect(dispatch_uid='treemenu_warm_menus'):
+            return  # Уже прогрето в другом потоке
+        try:
+            warmed = warm_menus()
+        except Exception:
+            logger.exception('Не удалось прогреть кэш меню')
+        else:
+            logger.info('Кэш меню прогрет: %s', ', '.join(warmed) or '-')
+
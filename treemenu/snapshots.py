@@ -0,0 +1,188 @@
+"""
+Публикация меню: снимки скомпилированных деревьев в MenuSnapshot.
+
+Публикация собирает меню из пунктов (черновика) и сохраняет его одной
+строкой JSON: {"format": 1, "nodes": [[id, parent_id, title, url,
+named_url, order, visibility, [groups]], ...]}. Пункты идут в порядке
+отрисовки (order, title), URL уже разрешены.
+
+При TREEMENU_SNAPSHOTS = True меню читаются только из снимков: одна строка
+по первичному ключу вместо выборки пунктов, без разрешения URL. Правка
+пунктов в админке не видна посетителям до publish_menus().
+"""
+import json
+
+from django.conf import settings
+from django.db import router, transaction
+
+from treemenu import instrumentation
+from treemenu.models import MenuItem, MenuSnapshot, parse_groups
+from treemenu.resolver import resolve_item_url
+from treemenu.tree import ALL_MENUS, CompiledMenu, MenuNode
+
+SNAPSHOT_FORMAT = 1
+# Поля пункта в снимке (и в ответе by-name без моделей)
+NODE_FIELDS = ('id', 'parent_id', 'title', 'url', 'named_url', 'order', 'visibility', 'groups')
+
+
+def is_enabled():
+    return getattr(settings, 'TREEMENU_SNAPSHOTS', False)
+
+
+def make_nodes(rows):
+    """
+    Строки values_list(*NODE_FIELDS) -> пункты снимка: URL разрешены,
+    группы - отсортированный список.
+    """
+    return [
+        [item_id, parent_id, title, resolve_item_url(url, named_url), named_url, order, visibility,
+         sorted(parse_groups(groups))]
+        for item_id, parent_id, title, url, named_url, order, visibility, groups in rows
+    ]
+
+
+def dump_nodes(rows):
+    """Строки values_list(*NODE_FIELDS) -> JSON снимка."""
+    nodes = make_nodes(rows)
+    return json.dumps({'format': SNAPSHOT_FORMAT, 'nodes': nodes}, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_nodes(data):
+    """JSON снимка -> список пунктов."""
+    snapshot = json.loads(data)
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f'Неизвестный формат снимка меню: {snapshot.get("format")}')
+    return snapshot['nodes']
+
+
+def publish_menus(menu_names=None):
+    """
+    Публикует меню (по умолчанию все: с пунктами или уже опубликованные).
+    Пункты читаются одним запросом из основной БД, снимки записываются
+    одним INSERT ... ON CONFLICT UPDATE. Меню без пунктов публикуется
+    пустым - так публикуется и удаление.
+    Возвращает {menu_name: число пунктов}.
+    """
+    from treemenu.signals import menu_changed
+
+    using = router.db_for_write(MenuSnapshot)
+    items = MenuItem.objects.using(using)
+    if menu_names is None:
+        menu_names = set(items.values_list('menu_name', flat=True).distinct())
+        menu_names.update(MenuSnapshot.objects.using(using).values_list('menu_name', flat=True))
+    menu_names = sorted(set(menu_names))
+
+    rows = {menu_name: [] for menu_name in menu_names}
+    queryset = items.filter(menu_name__in=menu_names).values_list('menu_name', *NODE_FIELDS)
+    for menu_name, *row in queryset:
+        rows[menu_name].append(row)
+
+    snapshots = [
+        MenuSnapshot(menu_name=menu_name, data=dump_nodes(menu_rows), items_count=len(menu_rows))
+        for menu_name, menu_rows in rows.items()
+    ]
+    with transaction.atomic(using=using):
+        MenuSnapshot.objects.using(using).bulk_create(
+            snapshots, update_conflicts=True, unique_fields=['menu_name'],
+            update_fields=['data', 'items_count', 'published_at'],
+        )
+        for menu_name in menu_names:
+            menu_changed(menu_name, using=using)
+    return {menu_name: len(menu_rows) for menu_name, menu_rows in rows.items()}
+
+
+def _snapshots_queryset(menu_names, using=None):
+    queryset = MenuSnapshot.objects.all()
+    if menu_names is not None:
+        queryset = queryset.filter(menu_name__in=menu_names)
+    if using:
+        queryset = queryset.using(using)
+    return queryset.values_list('menu_name', 'data')
+
+
+def _compile_snapshot_rows(menu_names, rows, batch_name):
+    compiled = {}
+    with instrumentation.timer(batch_name, 'build'):
+        for menu_name, data in rows:
+            compiled[menu_name] = CompiledMenu(menu_name, [
+                MenuNode(item_id, parent_id, title, url, visibility, frozenset(groups))
+                for item_id, parent_id, title, url, _, _, visibility, groups in load_nodes(data)
+            ])
+        # Неопубликованное меню пусто, как и меню без пунктов
+        for menu_name in menu_names:
+            if menu_name not in compiled:
+                compiled[menu_name] = CompiledMenu(menu_name, [])
+    return compiled
+
+
+def compile_snapshots(menu_names, using=None):
+    """
+    Аналог tree.compile_menus() для опубликованных меню: один запрос по
+    первичным ключам, URL не разрешаются - они уже в снимке.
+    menu_names=None - все опубликованные меню.
+    """
+    if menu_names is not None:
+        menu_names = list(dict.fromkeys(menu_names))
+    batch_name = '+'.join(menu_names) if menu_names is not None else ALL_MENUS
+    queryset = _snapshots_queryset(menu_names, using)
+    with instrumentation.timer(batch_name, 'query'), instrumentation.count_queries(batch_name, queryset.db):
+        rows = list(queryset)
+    if menu_names is None:
+        menu_names = [menu_name for menu_name, _ in rows]
+    return _compile_snapshot_rows(menu_names, rows, batch_name)
+
+
+async def acompile_snapshots(menu_names, using=None):
+    """Асинхронный вариант compile_snapshots()."""
+    menu_names = list(dict.fromkeys(menu_names))
+    batch_name = '+'.join(menu_names)
+    with instrumentation.timer(batch_name, 'query'):
+        rows = [row async for row in _snapshots_queryset(menu_names, using)]
+    return _compile_snapshot_rows(menu_names, rows, batch_name)
+
+
+def get_snapshot_nodes(menu_name):
+    """Пункты опубликованного меню или None, если меню не опубликовано."""
+    data = _snapshots_queryset([menu_name]).values_list('data', flat=True).first()
+    return load_nodes(data) if data is not None else None
+
+
+async def aget_snapshot_nodes(menu_name):
+    """Асинхронный вариант get_snapshot_nodes()."""
+    data = await _snapshots_queryset([menu_name]).values_list('data', flat=True).afirst()
+    return load_nodes(data) if data is not None else None
+
+
+def serialize_nodes(menu_name, nodes, audience):
+    """
+    Дерево видимых аудитории пунктов в формате MenuItemSerializer
+    (ответ API by-name) без моделей и запросов.
+    Возвращает (корневые пункты, число пунктов в дереве).
+    """
+    rule_groups = frozenset(group for node in nodes for group in node[7])
+    visible_groups = audience.groups_for(rule_groups)
+    items = {}
+    for item_id, parent_id, title, url, named_url, order, visibility, groups in nodes:
+        if audience.can_see(visibility, frozenset(groups), visible_groups):
+            items[item_id] = {
+                'id': item_id, 'title': title, 'menu_name': menu_name, 'parent': parent_id,
+                'url': url, 'named_url': named_url, 'order': order, 'children': [],
+            }
+
+    # Как build_tree(): пункты со скрытым родителем в дерево не попадают
+    roots = []
+    for item in items.values():
+        if item['parent'] is None:
+            roots.append(item)
+        elif item['parent'] in items:
+            items[item['parent']]['children'].append(item)
+    
+    # Считаются только пункты, достижимые от корней (видимый пункт под
+    # скрытым предком в дерево не попал)
+    total = 0
+    stack = list(roots)
+    while stack:
+        item = stack.pop()
+        total += 1
+        stack.extend(item['children'])
+    return roots, total
@@ -1,144 +1,174 @@
 from django import template
-from django.utils.safestring import mark_safe
-from treemenu.models import MenuItem
+from django.conf import settings
+from treemenu import instrumentation, prerender
+from treemenu.audience import aget_audience, get_audience
+from treemenu.cache import (
+    aget_compiled_menus, aget_menu_html, default_max_depth, get_compiled_menus, get_menu_html, parse_max_depth,
+)
+from treemenu.rendering import render_menu_items  # noqa: F401
+from treemenu.tree import build_tree, get_active_path  # noqa: F401
 
 register = template.Library()
 
 
-def build_tree(items):
+def _get_registry(context):
     """
-    Строит дерево из плоского списка элементов.
-    Возвращает (items_dict, root_items).
-    
-    Ключевая оптимизация: вместо N+1 запросов к БД строим дерево в памяти.
+    Реестр меню текущего запроса: {menu_name: CompiledMenu}.
+    Хранится на объекте request, чтобы его видели все шаблоны запроса
+    (включая extends/include); без request - в контексте рендера.
     """
-    items_dict = {}
-    root_items = []
-    
-    # Первый проход: создаём индекс id -> item
-    for item in items:
-        item.children_list = []  # Добавляем список для детей
-        items_dict[item.id] = item
-    
-    # Второй проход: связываем родителей с детьми
-    for item in items:
-        if item.parent_id:
-            parent = items_dict.get(item.parent_id)
-            if parent:
-                parent.children_list.append(item)
-        else:
-            # Если нет родителя - это корневой элемент
-            root_items.append(item)
-    
-    return items_dict, root_items
+    request = context.get('request')
+    if request is not None:
+        if not hasattr(request, '_treemenu_registry'):
+            request._treemenu_registry = {}
+        return request._treemenu_registry
+    return context.render_context.dicts[0].setdefault('_treemenu_registry', {})
 
 
-def get_active_path(items_dict, current_url):
+def get_menus(context, menu_names):
     """
-    Находит активный элемент и строит путь от него к корню.
-    Возвращает (active_id, path_set).
+    Возвращает скомпилированные меню, догружая недостающие в реестре
+    запроса одним обращением к кэшу/БД.
     """
-    active_id = None
-    path = set()
-    
-    # Ищем элемент с совпадающим URL
-    for item_id, item in items_dict.items():
-        item_url = item.get_url()
-        if item_url and item_url != '#' and current_url == item_url:
-            active_id = item_id
-            # Строим путь вверх до корня
-            node = item
-            while node:
-                path.add(node.id)
-                node = items_dict.get(node.parent_id)
-            break
-    
-    return active_id, path
+    registry = _get_registry(context)
+    missing = [menu_name for menu_name in menu_names if menu_name not in registry]
+    if missing:
+        registry.update(get_compiled_menus(missing))
+    return {menu_name: registry[menu_name] for menu_name in menu_names}
 
 
-def render_menu_items(items, active_id, active_path, items_dict):
+async def apreload_menus(request, menu_names, prefix_match=None, max_depth=None):
     """
-    Рендерит список пунктов меню в HTML.
+    Асинхронная предзагрузка меню для ASGI-представлений.
     
-    Логика раскрытия:
-    - Пункт раскрыт если он в active_path (сам активный или его предок)
-    - Также раскрыт первый уровень под активным пунктом
+    Шаблонные теги синхронные, поэтому всё, что требует ввода-вывода,
+    делается заранее: меню загружаются через асинхронный кэш/ORM в реестр
+    запроса, а HTML для текущего URL кладётся во фрагменты дерева.
+    После этого {% draw_menu %} этих меню работает только с памятью.
     """
-    if not items:
-        return ''
+    if not hasattr(request, '_treemenu_registry'):
+        request._treemenu_registry = {}
+    registry = request._treemenu_registry
+    missing = [menu_name for menu_name in menu_names if menu_name not in registry]
+    if missing:
+        registry.update(await aget_compiled_menus(missing))
+    
+    # Пользователь и его группы - тоже заранее, асинхронно
+    audience = None
+    if any(registry[menu_name].has_rules for menu_name in menu_names):
+        audience = await aget_audience(request)
+        if any(registry[menu_name].rule_groups for menu_name in menu_names):
+            await audience.aload_groups()
+    
+    if prefix_match is None:
+        prefix_match = getattr(settings, 'TREEMENU_PREFIX_MATCH', False)
+    max_depth = default_max_depth() if max_depth is None else _parse_max_depth(max_depth)
+    for menu_name in menu_names:
+        compiled = registry[menu_name]
+        if audience is not None:
+            compiled = compiled.for_audience(audience)
+        if compiled.items_dict:
+            await aget_menu_html(compiled, compiled.find_active_id(request.path, prefix_match), max_depth)
+    return {menu_name: registry[menu_name] for menu_name in menu_names}
+
+
+@register.simple_tag(takes_context=True)
+def load_menus(context, *menu_names):
+    """
+    Предзагружает несколько меню одним запросом к БД.
+    Последующие {% draw_menu %} этих меню берут их из реестра запроса.
     
-    html = ['<ul class="tree-menu">']
-    
-    for item in items:
-        is_active = item.id == active_id
-        is_in_path = item.id in active_path
-        
-        # Определяем, нужно ли раскрыть детей
-        # 1) Если пункт в пути к активному - раскрываем
-        # 2) Если родитель этого пункта активный - раскрываем (первый уровень под активным)
-        parent_is_active = item.parent_id and item.parent_id == active_id
-        should_expand = is_in_path or parent_is_active
-        
-        # CSS классы
-        classes = []
-        if is_active:
-            classes.append('active')
-        if is_in_path:
-            classes.append('in-path')
-        if item.children_list:
-            classes.append('has-children')
-            if should_expand:
-                classes.append('expanded')
-        
-        class_str = f' class="{" ".join(classes)}"' if classes else ''
-        
-        html.append(f'<li{class_str}>')
-        # Экранируем HTML вручную, т.к. используем mark_safe
-        # TODO: возможно стоит использовать escape() из django.utils.html
-        title_escaped = str(item.title).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-        url = item.get_url()
-        html.append(f'<a href="{url}">{title_escaped}</a>')
-        
-        # Рекурсивно рендерим детей если нужно раскрыть
-        if item.children_list and should_expand:
-            html.append(render_menu_items(
-                item.children_list, active_id, active_path, items_dict
-            ))
-        
-        html.append('</li>')
-    
-    html.append('</ul>')
-    return ''.join(html)
+    Использование: {% load_menus 'main_menu' 'footer_menu' %}
+    
+    В статическом режиме меню из текущего выпуска prerender_menus не
+    загружаются: draw_menu возьмёт их HTML из файлов.
+    """
+    if getattr(settings, 'TREEMENU_STATIC_MENUS', False):
+        release = prerender.get_release()
+        if release is not None and release.max_depth == default_max_depth():
+            menu_names = [menu_name for menu_name in menu_names if menu_name not in release.menus]
+    if menu_names:
+        get_menus(context, menu_names)
+    return ''
 
 
 @register.simple_tag(takes_context=True)
-def draw_menu(context, menu_name):
+def draw_menu(context, menu_name, prefix_match=None, max_depth=None):
     """
     Template tag для отрисовки меню.
     
     Использование: {% draw_menu 'main_menu' %}
     
-    ГАРАНТИЯ: Ровно 1 запрос к БД на одно меню.
+    С prefix_match=True активным становится самый глубокий пункт, URL
+    которого - префикс текущего пути (например, для детальных страниц):
+    {% draw_menu 'main_menu' prefix_match=True %}
+    По умолчанию берётся из настройки TREEMENU_PREFIX_MATCH (False).
+    
+    max_depth ограничивает число выводимых уровней для больших меню
+    (по умолчанию TREEMENU_MAX_DEPTH, None - без ограничения):
+    {% draw_menu 'catalog' max_depth=2 %}
+    Значение - целое число не меньше 1, иначе TemplateSyntaxError.
+    
+    ГАРАНТИЯ: не больше 1 запроса к БД на одно меню
+    (0 запросов, если скомпилированное дерево уже в кэше и кэш общий;
+    с LocMemCache каждая отрисовка добавляет запрос версии из MenuVersion,
+    см. cache.get_menu_versions()).
     """
+    with instrumentation.timer(menu_name, 'total'):
+        return _draw_menu(context, menu_name, prefix_match, max_depth)
+
+
+def _parse_max_depth(max_depth):
+    """max_depth из аргумента тега: целое число >= 1 (или строка с ним)."""
+    try:
+        return parse_max_depth(max_depth)
+    except ValueError as exc:
+        raise template.TemplateSyntaxError(str(exc))
+
+
+def _draw_menu(context, menu_name, prefix_match, max_depth):
     request = context.get('request')
     current_url = request.path if request else ''
     
-    # Единственный запрос к БД - получаем все элементы меню сразу
-    items = list(MenuItem.objects.filter(menu_name=menu_name))
+    if prefix_match is None:
+        prefix_match = getattr(settings, 'TREEMENU_PREFIX_MATCH', False)
+    max_depth = default_max_depth() if max_depth is None else _parse_max_depth(max_depth)
     
-    if not items:
-        return ''
+    # Статический режим: готовый HTML из файлов prerender_menus.
+    # Если меню или варианта там нет - обычный путь ниже
+    if getattr(settings, 'TREEMENU_STATIC_MENUS', False):
+        html = _draw_static(request, menu_name, current_url, prefix_match, max_depth)
+        if html is not None:
+            return html
     
-    # Строим дерево в памяти (без дополнительных запросов)
-    items_dict, root_items = build_tree(items)
+    # Дерево берётся из реестра запроса или кэша;
+    # при промахе - единственный запрос к БД
+    compiled = get_menus(context, [menu_name])[menu_name]
     
-    # Находим активный путь
-    active_id, active_path = get_active_path(items_dict, current_url)
+    # Правила видимости: вариант для аудитории строится в памяти
+    # из того же дерева (один раз на ключ аудитории)
+    if compiled.has_rules:
+        compiled = compiled.for_audience(get_audience(request))
     
-    # Рендерим HTML
-    html = render_menu_items(root_items, active_id, active_path, items_dict)
+    if not compiled.items_dict:
+        return ''
     
-    return mark_safe(html)
-
+    # Находим активный пункт (поиск по индексу URL, без перебора пунктов)
+    active_id = compiled.find_active_id(current_url, prefix_match)
+    
+    # HTML зависит только от версии меню, активного пункта и глубины,
+    # поэтому берётся из кэша фрагментов
+    return get_menu_html(compiled, active_id, max_depth)
 
 
+def _draw_static(request, menu_name, current_url, prefix_match, max_depth):
+    """HTML меню из текущего выпуска prerender_menus или None."""
+    release = prerender.get_release()
+    menu = release.menus.get(menu_name) if release is not None else None
+    if menu is None or release.max_depth != max_depth:
+        return None
+    audience_key = get_audience(request).key(menu.rule_groups) if menu.has_rules else prerender.ALL_AUDIENCES
+    html = menu.get_html(audience_key, current_url, prefix_match)
+    if html is not None:
+        instrumentation.count(menu_name, 'static_hit')
+    return html
@@ -1,10 +1,47 @@
-from django.test import TestCase, Client
+import shutil
+import tempfile
+
+from django.core.cache import caches
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.core.exceptions import ValidationError
+from django.urls import path
 from treemenu.models import MenuItem
+from treemenu.views import DemoPageView
+
+
+class MenuTestCase(TestCase):
+    """
+    TestCase с отдельным кэшем Django: файловый кэш во временном каталоге
+    класса (не общий django_cache сервера разработки), очищаемый перед
+    каждым тестом - версии и отметки меню не переходят между тестами.
+    """
+    
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory, True)
+        caches_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }})
+        caches_override.enable()
+        cls.addClassCleanup(caches_override.disable)
+        super().setUpClass()
+    
+    def run(self, result=None):
+        caches['default'].clear()
+        return super().run(result)
+
 
+# URLconf для тестов смены ROOT_URLCONF (override_settings(ROOT_URLCONF='treemenu.tests'))
+urlpatterns = [
+    path('moved/about/', DemoPageView.as_view(), name='about'),
+]
 
-class MenuItemModelTest(TestCase):
+
+class MenuItemModelTest(MenuTestCase):
     """Тесты модели MenuItem"""
     
     def setUp(self):
@@ -92,7 +129,7 @@ class MenuItemModelTest(TestCase):
         self.assertFalse(MenuItem.objects.filter(id=child_id).exists())
 
 
-class MenuTemplateTagTest(TestCase):
+class MenuTemplateTagTest(MenuTestCase):
     """Тесты template tag draw_menu"""
     
     def setUp(self):
@@ -141,7 +178,7 @@ class MenuTemplateTagTest(TestCase):
         self.assertIn('tree-menu', result)
 
 
-class MenuAPITest(TestCase):
+class MenuAPITest(MenuTestCase):
     """Тесты DRF API"""
     
     def setUp(self):
@@ -172,7 +209,172 @@ class MenuAPITest(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class MenuOptimizationTest(TestCase):
+
+class MenuAPIConditionalTest(MenuTestCase):
+    """Тесты условных запросов (ETag / Last-Modified) к API"""
+    
+    def setUp(self):
+        self.root = MenuItem.objects.create(menu_name='etag_menu', title='Root', order=0)
+        MenuItem.objects.create(menu_name='other_menu', title='Other', order=0)
+    
+    def test_by_name_not_modified(self):
+        """Тест ответа 304 по If-None-Match без загрузки пунктов"""
+        response = self.client.get('/api/menu/by-name/etag_menu/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/menu/by-name/etag_menu/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_by_name_if_modified_since(self):
+        """Тест ответа 304 по If-Modified-Since"""
+        response = self.client.get('/api/menu/by-name/etag_menu/')
+        response = self.client.get(
+            '/api/menu/by-name/etag_menu/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+    
+    def test_etag_changes_after_edit(self):
+        """Тест что ETag меняется после изменения только своего меню"""
+        etag = self.client.get('/api/menu/by-name/etag_menu/')['ETag']
+        list_etag = self.client.get('/api/menu/')['ETag']
+        
+        MenuItem.objects.create(menu_name='other_menu', title='Another', order=1)
+        response = self.client.get('/api/menu/by-name/etag_menu/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.root.title = 'Renamed'
+        self.root.save()
+        response = self.client.get('/api/menu/by-name/etag_menu/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        
+        response = self.client.get('/api/menu/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_list_not_modified(self):
+        """Тест ответа 304 для списка пунктов"""
+        etag = self.client.get('/api/menu/?menu_name=etag_menu')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/menu/?menu_name=etag_menu', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class MenuAPIQueryCountTest(MenuTestCase):
+    """Тесты числа запросов API на большом меню"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        # 1000 пунктов: 10 корней x 9 детей x 10 внуков (+ 10 корней + 90 детей)
+        roots = MenuItem.objects.bulk_create(
+            MenuItem(menu_name='big_menu', title=f'Root {i}', order=i) for i in range(10)
+        )
+        children = MenuItem.objects.bulk_create(
+            MenuItem(menu_name='big_menu', title=f'Child {i}', parent=root, order=i)
+            for root in roots for i in range(9)
+        )
+        MenuItem.objects.bulk_create(
+            MenuItem(menu_name='big_menu', title=f'Leaf {i}', parent=child, order=i)
+            for child in children for i in range(10)
+        )
+    
+    def count_nodes(self, nodes):
+        return sum(1 + self.count_nodes(node['children']) for node in nodes)
+    
+    def test_by_name_single_query(self):
+        """Тест что меню из 1000 пунктов сериализуется одним запросом (+ версия меню)"""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/menu/by-name/big_menu/')
+        
+        data = response.json()
+        self.assertEqual(data['total_items'], 1000)
+        self.assertEqual(self.count_nodes(data['items']), 1000)
+        self.assertEqual([item['title'] for item in data['items'][0]['children'][:2]], ['Child 0', 'Child 1'])
+    
+    def test_by_name_without_models(self):
+        """Тест что by-name собирается из строк без моделей, в формате MenuItemSerializer"""
+        from unittest import mock
+        from treemenu.serializers import MenuItemSerializer
+        from treemenu.tree import build_tree
+        
+        MenuItem.objects.create(menu_name='named_menu', title='Home', named_url='home', order=0)
+        MenuItem.objects.create(menu_name='named_menu', title='Docs', url='/docs/', order=1)
+        _, roots = build_tree(list(MenuItem.objects.filter(menu_name='named_menu').order_by('order', 'title')))
+        expected = MenuItemSerializer(roots, many=True).data
+        
+        with mock.patch.object(MenuItem, '__init__', side_effect=AssertionError('MenuItem создан')):
+            response = self.client.get('/api/menu/by-name/named_menu/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['items'], expected)
+    
+    def test_list_constant_queries(self):
+        """Тест что список с вложенными детьми не делает запрос на каждый узел"""
+        # версия меню + COUNT + страница + поддеревья страницы
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/menu/?menu_name=big_menu')
+        # Первая страница (order=0): 10 "Child 0" по 10 листьев + 10 "Leaf 0"
+        self.assertEqual(self.count_nodes(response.json()['results']), 10 * 11 + 10)
+    
+    def test_cursor_flat_walk(self):
+        """Тест полного обхода плоским списком с cursor-пагинацией"""
+        seen = []
+        url = '/api/menu/?pagination=cursor&flat=1&page_size=300'
+        while url:
+            # версия меню + страница, без COUNT
+            with self.assertNumQueries(2):
+                data = self.client.get(url).json()
+            for item in data['results']:
+                self.assertNotIn('children', item)
+                self.assertIn('parent', item)
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+        
+        self.assertEqual(len(seen), 1000)
+        self.assertEqual(
+            seen, list(MenuItem.objects.order_by('menu_name', 'order', 'id').values_list('id', flat=True))
+        )
+    
+    def test_cursor_nested_max_page_size(self):
+        """Тест вложенной cursor-страницы максимального размера (поддеревья пачками)"""
+        from treemenu.bulk import bulk_insert_tree, split_levels
+        from treemenu.models import Visibility
+        
+        # 1200 пунктов с заполненным path: 200 корней по 5 детей
+        records = {}
+        for i in range(200):
+            records[f'r{i}'] = (None, 'wide_menu', f'Root {i}', f'/r{i}/', '', i, Visibility.ALL, '')
+            for j in range(5):
+                records[f'r{i}c{j}'] = (f'r{i}', 'wide_menu', f'Child {j}', '', '', j, Visibility.ALL, '')
+        bulk_insert_tree(records, split_levels(records), 'default')
+        
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from treemenu.api_views import SUBTREE_BATCH_SIZE
+        
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/menu/?menu_name=wide_menu&pagination=cursor&page_size=1000')
+        self.assertEqual(response.status_code, 200)
+        # версия меню + страница + поддеревья пачками
+        self.assertLessEqual(len(ctx.captured_queries), 2 + 1000 // SUBTREE_BATCH_SIZE)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1000)
+        root = next(item for item in results if item['title'] == 'Root 0')
+        self.assertEqual(len(root['children']), 5)
+    
+    def test_invalid_cursor(self):
+        """Тест некорректного cursor"""
+        response = self.client.get('/api/menu/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+    
+    def test_retrieve_constant_queries(self):
+        """Тест что пункт сериализуется со всем поддеревом за 2 запроса (+ версия)"""
+        root = MenuItem.objects.get(menu_name='big_menu', title='Root 0')
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/menu/{root.id}/')
+        self.assertEqual(self.count_nodes([response.json()]), 1 + 9 + 90)
+
+
+class MenuOptimizationTest(MenuTestCase):
     """Тесты оптимизации - проверка количества запросов"""
     
     def setUp(self):
@@ -224,3 +426,1629 @@ class MenuOptimizationTest(TestCase):
             result = template.render(context)
             self.assertIsNotNone(result)
             self.assertIn('Root', result)
+    
+    def test_warm_cache_zero_queries(self):
+        """Тест что повторная отрисовка меню берётся из кэша без запросов к БД"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        factory = RequestFactory()
+        template = Template('{% load menu_tags %}{% draw_menu "perf_test" %}')
+        
+        with self.assertNumQueries(1):
+            cold = template.render(Context({'request': factory.get('/')}))
+        
+        with self.assertNumQueries(0):
+            warm = template.render(Context({'request': factory.get('/')}))
+        
+        self.assertEqual(cold, warm)
+    
+    def test_cache_invalidated_after_edit(self):
+        """Тест что после изменения пункта меню делается ровно 1 запрос"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        factory = RequestFactory()
+        template = Template('{% load menu_tags %}{% draw_menu "perf_test" %}')
+        template.render(Context({'request': factory.get('/')}))
+        
+        item = MenuItem.objects.get(menu_name=self.menu_name, title='Root')
+        item.title = 'Renamed'
+        item.save()
+        
+        # Каждый рендер - новый запрос (реестр меню живёт в пределах запроса)
+        with self.assertNumQueries(1):
+            result = template.render(Context({'request': factory.get('/')}))
+        self.assertIn('Renamed', result)
+        
+        with self.assertNumQueries(0):
+            template.render(Context({'request': factory.get('/')}))
+    
+    def test_process_local_cache_sees_other_workers(self):
+        """Тест что с LocMemCache изменение в другом воркере (только в БД) видно сразу"""
+        from django.template import Context, Template
+        from django.test import override_settings
+        from treemenu.cache import clear_local_cache
+        from treemenu.models import MenuVersion
+        
+        template = Template('{% load menu_tags %}{% draw_menu "perf_test" %}')
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker'}}
+        with override_settings(CACHES=locmem):
+            clear_local_cache()
+            template.render(Context({'request': None}))
+            # + версия из MenuVersion
+            with self.assertNumQueries(1):
+                template.render(Context({'request': None}))
+            
+            # Другой воркер: строка изменена и версия увеличена в БД, кэш этого процесса не тронут
+            MenuItem.objects.filter(menu_name=self.menu_name, title='Root').update(title='Renamed')
+            MenuVersion.bump(self.menu_name)
+            self.assertIn('Renamed', template.render(Context({'request': None})))
+        clear_local_cache()
+    
+    def test_cache_invalidated_after_delete(self):
+        """Тест что удалённые пункты пропадают из меню"""
+        from django.template import Context, Template
+        
+        template = Template('{% load menu_tags %}{% draw_menu "perf_test" %}')
+        self.assertIn('Root', template.render(Context({'request': None})))
+        
+        # Каскадно удаляет всё меню
+        MenuItem.objects.get(menu_name=self.menu_name, title='Root').delete()
+        
+        with self.assertNumQueries(1):
+            result = template.render(Context({'request': None}))
+        self.assertEqual(result, '')
+
+
+class CompiledMenuTest(MenuTestCase):
+    """Тесты скомпилированного дерева и его индексов"""
+    
+    def setUp(self):
+        self.root = MenuItem.objects.create(menu_name='idx_menu', title='Root', url='/root/', order=0)
+        self.child = MenuItem.objects.create(
+            menu_name='idx_menu', title='Child', parent=self.root, url='/root/child/', order=0
+        )
+        self.leaf = MenuItem.objects.create(
+            menu_name='idx_menu', title='Leaf', parent=self.child, url='/root/child/leaf/', order=0
+        )
+        self.other = MenuItem.objects.create(menu_name='idx_menu', title='Other', order=1)
+    
+    def test_active_path_matches_linear_scan(self):
+        """Тест что поиск по индексу совпадает с линейным перебором"""
+        from treemenu.tree import compile_menu, get_active_path
+        
+        compiled = compile_menu('idx_menu')
+        for url in ['/root/', '/root/child/', '/root/child/leaf/', '/missing/', '#', '']:
+            self.assertEqual(
+                compiled.get_active_path(url),
+                get_active_path(compiled.items_dict, url),
+            )
+    
+    def test_compiled_nodes_are_compact(self):
+        """Тест что в скомпилированном дереве нет экземпляров модели"""
+        from treemenu.tree import MenuNode, compile_menu
+        
+        compiled = compile_menu('idx_menu')
+        for node in compiled.items_dict.values():
+            self.assertIsInstance(node, MenuNode)
+            self.assertFalse(hasattr(node, '__dict__'))
+        self.assertEqual(compiled.items_dict[self.root.id].children_list, (compiled.items_dict[self.child.id],))
+        self.assertEqual(compiled.items_dict[self.other.id].url, '#')
+    
+    def test_active_path_to_root(self):
+        """Тест что путь к активному пункту содержит всех предков"""
+        from treemenu.tree import compile_menu
+        
+        active_id, path = compile_menu('idx_menu').get_active_path('/root/child/leaf/')
+        self.assertEqual(active_id, self.leaf.id)
+        self.assertEqual(path, {self.root.id, self.child.id, self.leaf.id})
+
+
+class NamedUrlResolverTest(MenuTestCase):
+    """Тесты мемоизации reverse() для named_url"""
+    
+    def setUp(self):
+        from treemenu.resolver import clear_resolved_urls
+        clear_resolved_urls()
+    
+    def test_unresolved_name_counted_once(self):
+        """Тест что ненайденный named_url не разрешается повторно"""
+        from unittest import mock
+        from treemenu import resolver
+        from treemenu.resolver import get_unresolved_named_urls
+        
+        item = MenuItem.objects.create(menu_name='url_menu', title='Broken', named_url='no_such_url')
+        
+        with self.assertLogs('treemenu.resolver', 'WARNING'):
+            self.assertEqual(item.get_url(), '#')
+        with mock.patch.object(resolver, 'reverse') as reverse_mock:
+            self.assertEqual(item.get_url(), '#')
+            reverse_mock.assert_not_called()
+        
+        self.assertEqual(get_unresolved_named_urls(), {'no_such_url': 1})
+    
+    def test_memo_reset_on_urlconf_change(self):
+        """Тест что смена ROOT_URLCONF сбрасывает мемоизацию"""
+        from django.test import override_settings
+        from treemenu.resolver import get_unresolved_named_urls
+        
+        item = MenuItem.objects.create(menu_name='url_menu', title='About', named_url='about')
+        self.assertEqual(item.get_url(), '/about/')
+        
+        with override_settings(ROOT_URLCONF='treemenu.tests'):
+            self.assertEqual(item.get_url(), '/moved/about/')
+        
+        self.assertEqual(item.get_url(), '/about/')
+        self.assertEqual(get_unresolved_named_urls(), {})
+    
+    def test_compiled_menu_per_urlconf(self):
+        """Тест что закэшированное меню не переиспользуется в другом URLconf"""
+        from django.template import Context, Template
+        from django.test import override_settings
+        
+        MenuItem.objects.create(menu_name='url_menu', title='About', named_url='about')
+        template = Template('{% load menu_tags %}{% draw_menu "url_menu" %}')
+        
+        self.assertIn('href="/about/"', template.render(Context({'request': None})))
+        with override_settings(ROOT_URLCONF='treemenu.tests'):
+            self.assertIn('href="/moved/about/"', template.render(Context({'request': None})))
+
+
+class LoadMenusTagTest(MenuTestCase):
+    """Тесты пакетной загрузки меню тегом load_menus"""
+    
+    def setUp(self):
+        for menu_name in ('batch_a', 'batch_b', 'batch_c'):
+            root = MenuItem.objects.create(menu_name=menu_name, title=f'{menu_name} root', order=0)
+            MenuItem.objects.create(menu_name=menu_name, title=f'{menu_name} child', parent=root, order=0)
+    
+    def test_single_query_for_several_menus(self):
+        """Тест что несколько меню загружаются одним запросом"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template(
+            '{% load menu_tags %}'
+            '{% load_menus "batch_a" "batch_b" "batch_c" %}'
+            '{% draw_menu "batch_a" %}{% draw_menu "batch_b" %}{% draw_menu "batch_c" %}'
+        )
+        with self.assertNumQueries(1):
+            result = template.render(Context({'request': RequestFactory().get('/')}))
+        
+        for menu_name in ('batch_a', 'batch_b', 'batch_c'):
+            self.assertIn(f'{menu_name} root', result)
+    
+    def test_registry_reused_within_request(self):
+        """Тест что меню из реестра запроса не запрашиваются повторно"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        from treemenu.cache import clear_local_cache
+        
+        request = RequestFactory().get('/')
+        Template('{% load menu_tags %}{% load_menus "batch_a" "batch_b" %}').render(
+            Context({'request': request})
+        )
+        clear_local_cache()
+        
+        with self.assertNumQueries(0):
+            Template('{% load menu_tags %}{% draw_menu "batch_a" %}{% draw_menu "batch_b" %}').render(
+                Context({'request': request})
+            )
+
+
+class MenuFragmentCacheTest(MenuTestCase):
+    """Тесты кэша готового HTML меню"""
+    
+    def setUp(self):
+        self.root = MenuItem.objects.create(menu_name='frag_menu', title='Root', url='/root/', order=0)
+        self.child = MenuItem.objects.create(
+            menu_name='frag_menu', title='Child', parent=self.root, url='/root/child/', order=0
+        )
+        MenuItem.objects.create(menu_name='frag_menu', title='No URL', order=1)
+    
+    def render(self, path):
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template('{% load menu_tags %}{% draw_menu "frag_menu" %}')
+        return template.render(Context({'request': RequestFactory().get(path)}))
+    
+    def test_fragment_rendered_once_per_active_item(self):
+        """Тест что HTML для одного и того же активного пункта не рендерится повторно"""
+        from unittest import mock
+        from treemenu import cache
+        
+        with mock.patch.object(cache, 'render_menu', wraps=cache.render_menu) as render_mock:
+            first = self.render('/root/child/')
+            second = self.render('/root/child/')
+            # Другой URL без пункта меню -> тот же вариант "без активного"
+            self.render('/missing/')
+            self.render('/other/')
+        
+        self.assertEqual(first, second)
+        self.assertIn('class="active in-path"', first)
+        self.assertEqual(render_mock.call_count, 2)
+    
+    def test_fragment_invalidated_after_edit(self):
+        """Тест что после изменения меню HTML рендерится заново"""
+        self.render('/root/')
+        self.root.title = 'Renamed'
+        self.root.save()
+        self.assertIn('Renamed', self.render('/root/'))
+    
+    def test_prerender_all_variants(self):
+        """Тест жадного режима: все варианты HTML готовы сразу после компиляции"""
+        from django.test import override_settings
+        from treemenu.cache import get_compiled_menu
+        
+        with override_settings(TREEMENU_PRERENDER_FRAGMENTS=True):
+            compiled = get_compiled_menu('frag_menu')
+        
+        self.assertEqual(set(compiled.fragments), {None, self.root.id, self.child.id})
+        self.assertEqual(compiled.fragments[self.child.id], self.render('/root/child/'))
+    
+    def test_prerender_uses_max_depth(self):
+        """Тест что жадный режим рендерит HTML с глубиной TREEMENU_MAX_DEPTH"""
+        from unittest import mock
+        from django.test import override_settings
+        from treemenu import cache
+        
+        with override_settings(TREEMENU_PRERENDER_FRAGMENTS=True, TREEMENU_MAX_DEPTH=1):
+            cache.warm_menus(['frag_menu'], refresh=True)
+            with mock.patch.object(cache, 'render_menu', wraps=cache.render_menu) as render_mock:
+                html = self.render('/root/')
+        
+        self.assertEqual(render_mock.call_count, 0)
+        self.assertNotIn('Child', html)
+    
+    def test_prerender_audience_variants(self):
+        """Тест что для меню с правилами видимости готовы варианты типовых аудиторий"""
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.template import Context, Template
+        from django.test import RequestFactory, override_settings
+        from treemenu import cache
+        
+        MenuItem.objects.create(menu_name='frag_menu', title='Admin', url='/admin/', order=2, visibility='staff')
+        staff = User.objects.create(username='staff', is_staff=True)
+        template = Template('{% load menu_tags %}{% draw_menu "frag_menu" %}')
+        
+        with override_settings(TREEMENU_PRERENDER_FRAGMENTS=True):
+            cache.warm_menus(['frag_menu'], refresh=True)
+            cache.clear_local_cache()
+            with mock.patch.object(cache, 'render_menu', wraps=cache.render_menu) as render_mock:
+                anonymous = self.render('/root/')
+                request = RequestFactory().get('/root/')
+                request.user = staff
+                staff_html = template.render(Context({'request': request}))
+        
+        self.assertEqual(render_mock.call_count, 0)
+        self.assertNotIn('Admin', anonymous)
+        self.assertIn('Admin', staff_html)
+
+
+class MenuRendererTest(MenuTestCase):
+    """Тесты итеративного рендерера (без обращений к БД)"""
+    
+    def make_chain(self, depth):
+        """Меню-цепочка заданной глубины: 1 -> 2 -> ... -> depth"""
+        from treemenu.tree import CompiledMenu, MenuNode
+        
+        nodes = [
+            MenuNode(i, i - 1 if i > 1 else None, f'Level {i}', f'/level/{i}/')
+            for i in range(1, depth + 1)
+        ]
+        return CompiledMenu('chain', nodes)
+    
+    def test_markup(self):
+        """Тест точной разметки: классы, экранирование, раскрытие под активным"""
+        from treemenu.rendering import render_menu
+        from treemenu.tree import CompiledMenu, MenuNode
+        
+        compiled = CompiledMenu('markup', [
+            MenuNode(1, None, 'A & <B>', '/a/'),
+            MenuNode(2, 1, 'Child', '/a/child/'),
+            MenuNode(3, 2, 'Grandchild', '#'),
+            MenuNode(4, 3, 'Deep', '#'),
+            MenuNode(5, None, 'Leaf', '#'),
+        ])
+        
+        self.assertEqual(
+            render_menu(compiled, 2),
+            '<ul class="tree-menu">'
+            '<li class="in-path has-children expanded"><a href="/a/">A &amp; &lt;B&gt;</a>'
+            '<ul class="tree-menu">'
+            '<li class="active in-path has-children expanded"><a href="/a/child/">Child</a>'
+            '<ul class="tree-menu">'
+            '<li class="has-children expanded"><a href="#">Grandchild</a>'
+            '<ul class="tree-menu"><li><a href="#">Deep</a></li></ul></li>'
+            '</ul></li>'
+            '</ul></li>'
+            '<li><a href="#">Leaf</a></li>'
+            '</ul>'
+        )
+        self.assertEqual(
+            render_menu(compiled, None),
+            '<ul class="tree-menu">'
+            '<li class="has-children"><a href="/a/">A &amp; &lt;B&gt;</a></li>'
+            '<li><a href="#">Leaf</a></li>'
+            '</ul>'
+        )
+    
+    def test_deep_menu_has_no_recursion_limit(self):
+        """Тест что очень глубокое меню рендерится и кэшируется без RecursionError"""
+        import pickle
+        import sys
+        from treemenu.rendering import render_menu
+        
+        depth = sys.getrecursionlimit() * 2
+        compiled = self.make_chain(depth)
+        
+        html = render_menu(compiled, depth)
+        self.assertEqual(html.count('<li'), depth)
+        self.assertTrue(html.endswith('</ul></li>' * (depth - 1) + '</ul>'))
+        
+        restored = pickle.loads(pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(render_menu(restored, depth), html)
+
+
+class MenuItemPathTest(MenuTestCase):
+    """Тесты материализованного пути (path/depth)"""
+    
+    def setUp(self):
+        self.root = MenuItem.objects.create(menu_name='path_menu', title='Root', order=0)
+        self.a = MenuItem.objects.create(menu_name='path_menu', title='A', parent=self.root, order=1)
+        self.b = MenuItem.objects.create(menu_name='path_menu', title='B', parent=self.root, order=0)
+        self.a1 = MenuItem.objects.create(menu_name='path_menu', title='A1', parent=self.a, order=0)
+        self.a1x = MenuItem.objects.create(menu_name='path_menu', title='A1x', parent=self.a1, order=0)
+    
+    def test_depth(self):
+        """Тест уровней вложенности"""
+        self.assertEqual(
+            list(MenuItem.objects.filter(menu_name='path_menu', depth__lte=1).order_by('path')),
+            [self.root, self.b, self.a],
+        )
+        self.a1x.refresh_from_db()
+        self.assertEqual(self.a1x.depth, 3)
+    
+    def test_save_update_fields(self):
+        """Тест что save(update_fields=...) сохраняет path вместе с поддеревом"""
+        from treemenu.models import make_path_segment
+        
+        self.root.refresh_from_db()
+        self.root.order = 5
+        self.root.save(update_fields=['order'])
+        self.root.refresh_from_db()
+        self.a.refresh_from_db()
+        self.assertEqual(self.root.path, make_path_segment(5, self.root.pk))
+        self.assertTrue(self.a.path.startswith(self.root.path))
+        
+        # Без parent и order путь не пересчитывается (и лишних запросов нет)
+        self.a.title = 'Renamed'
+        with self.assertNumQueries(3):  # validate_parent + UPDATE + версия меню
+            self.a.save(update_fields=['title'])
+    
+    def test_descendants_in_render_order(self):
+        """Тест что потомки возвращаются одним запросом в порядке обхода"""
+        self.root.refresh_from_db()
+        with self.assertNumQueries(1):
+            descendants = list(self.root.get_descendants())
+        self.assertEqual(descendants, [self.b, self.a, self.a1, self.a1x])
+    
+    def test_ancestors(self):
+        """Тест что предки возвращаются одним запросом от корня вниз"""
+        self.a1x.refresh_from_db()
+        with self.assertNumQueries(1):
+            ancestors = list(self.a1x.get_ancestors())
+        self.assertEqual(ancestors, [self.root, self.a, self.a1])
+    
+    def test_move_subtree(self):
+        """Тест что при перемещении обновляется всё поддерево"""
+        self.a.parent = self.b
+        self.a.save()
+        
+        self.a1x.refresh_from_db()
+        self.assertEqual(self.a1x.depth, 4)
+        self.assertEqual(list(self.a1x.get_ancestors()), [self.root, self.b, self.a, self.a1])
+        self.b.refresh_from_db()
+        self.assertEqual(list(self.b.get_descendants()), [self.a, self.a1, self.a1x])
+    
+    def test_move_into_own_descendant_rejected(self):
+        """Тест что нельзя переместить пункт внутрь его же потомка"""
+        self.a.parent = self.a1x
+        with self.assertRaises(ValidationError):
+            self.a.save()
+    
+    def test_cycle_detected_without_paths(self):
+        """Тест что цикл находится по parent_id, даже если path не заполнен"""
+        MenuItem.objects.filter(menu_name='path_menu').update(path='')
+        self.root.parent = self.a1x
+        
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError) as ctx:
+                self.root.full_clean(exclude=['parent'])
+        self.assertIn('parent', ctx.exception.message_dict)
+    
+    def test_parent_validated_in_one_query(self):
+        """Тест что проверка родителя (меню, существование, цикл) - один запрос"""
+        self.b.parent = self.a1
+        with self.assertNumQueries(1):
+            self.b.full_clean(exclude=['parent'])
+        
+        self.b.parent_id = 10 ** 6
+        with self.assertRaises(ValidationError):
+            self.b.full_clean(exclude=['parent'])
+        
+        other = MenuItem.objects.create(menu_name='other_menu', title='Other')
+        self.b.parent = other
+        with self.assertRaises(ValidationError):
+            self.b.full_clean(exclude=['parent'])
+    
+    def test_validate_tree(self):
+        """Тест проверки целого меню одним запросом"""
+        with self.assertNumQueries(1):
+            MenuItem.validate_tree(['path_menu'])
+        
+        # Цикл A -> B -> A в обход save()
+        MenuItem.objects.filter(pk=self.a.pk).update(parent=self.a1)
+        with self.assertRaises(ValidationError) as ctx:
+            MenuItem.validate_tree(['path_menu'])
+        self.assertIn('циклическая ссылка', ctx.exception.messages[0])
+        self.assertIn('(3)', ctx.exception.messages[0])  # a, a1 и потомок a1x
+        
+        MenuItem.objects.filter(pk=self.a.pk).update(parent=self.root)
+        MenuItem.objects.filter(pk=self.b.pk).update(menu_name='other_menu')
+        with self.assertRaises(ValidationError) as ctx:
+            MenuItem.validate_tree(['other_menu'])
+        self.assertIn('родитель из другого меню', ctx.exception.messages[0])
+
+
+class MenuItemTreeQueryTest(MenuTestCase):
+    """Тесты рекурсивных запросов по дереву (ancestors_of / descendants_of / subtree_ordered)"""
+    
+    def setUp(self):
+        # Через bulk_create: path не заполнен, запросы должны идти по parent_id
+        self.root, self.a, self.b = MenuItem.objects.bulk_create([
+            MenuItem(menu_name='cte_menu', title='Root'),
+            MenuItem(menu_name='cte_menu', title='A', order=1),
+            MenuItem(menu_name='cte_menu', title='B', order=0),
+        ])
+        MenuItem.objects.filter(pk__in=[self.a.pk, self.b.pk]).update(parent=self.root)
+        self.a1 = MenuItem.objects.bulk_create([MenuItem(menu_name='cte_menu', title='A1', parent=self.a)])[0]
+        self.a1x = MenuItem.objects.bulk_create([MenuItem(menu_name='cte_menu', title='A1x', parent=self.a1)])[0]
+    
+    def test_ancestors_of(self):
+        """Тест предков одним запросом от корня вниз"""
+        with self.assertNumQueries(1):
+            ancestors = [(item.title, item.tree_depth) for item in MenuItem.objects.ancestors_of(self.a1x)]
+        self.assertEqual(ancestors, [('Root', -3), ('A', -2), ('A1', -1)])
+        
+        titles = [item.title for item in MenuItem.objects.ancestors_of(self.a1.pk, include_self=True)]
+        self.assertEqual(titles, ['Root', 'A', 'A1'])
+    
+    def test_descendants_of(self):
+        """Тест потомков по уровням с ограничением глубины"""
+        with self.assertNumQueries(1):
+            descendants = [(item.title, item.tree_depth) for item in MenuItem.objects.descendants_of(self.root)]
+        self.assertEqual(descendants, [('B', 1), ('A', 1), ('A1', 2), ('A1x', 3)])
+        
+        children = [item.title for item in MenuItem.objects.descendants_of(self.root, max_depth=1)]
+        self.assertEqual(children, ['B', 'A'])
+    
+    def test_subtree_ordered(self):
+        """Тест поддерева в порядке отрисовки"""
+        from treemenu.tree import build_tree
+        
+        with self.assertNumQueries(1):
+            subtree = list(MenuItem.objects.subtree_ordered(self.root))
+        
+        self.assertEqual([item.title for item in subtree], ['Root', 'B', 'A', 'A1', 'A1x'])
+        self.assertEqual([item.tree_depth for item in subtree], [0, 1, 1, 2, 3])
+        self.assertTrue(subtree[3].tree_path.startswith(subtree[2].tree_path))
+        
+        # Результат - обычные пункты меню, пригодные для build_tree
+        items_dict, roots = build_tree(subtree)
+        self.assertEqual([child.title for child in roots[0].children_list], ['B', 'A'])
+    
+    def test_subtree_ordered_by_title(self):
+        """Тест что братья с одинаковым order идут по title, как при отрисовке"""
+        from treemenu.tree import compile_menu
+        
+        # Созданы в обратном алфавитном порядке: id не совпадает с порядком title
+        MenuItem.objects.bulk_create([
+            MenuItem(menu_name='cte_menu', title=title, parent=self.a1, order=0) for title in ('Zeta', 'Beta', 'Alpha')
+        ])
+        
+        subtree = [item.title for item in MenuItem.objects.subtree_ordered(self.a1)]
+        self.assertEqual(subtree, ['A1', 'A1x', 'Alpha', 'Beta', 'Zeta'])
+        
+        compiled = compile_menu('cte_menu')
+        rendered = [node.title for node in compiled.items_dict[self.a1.pk].children_list]
+        self.assertEqual(subtree[1:], rendered)
+    
+    def test_cycle_terminates(self):
+        """Тест что цикл в данных не зацикливает запрос"""
+        MenuItem.objects.filter(pk=self.a.pk).update(parent=self.a1x)
+        
+        descendants = list(MenuItem.objects.descendants_of(self.a, max_depth=10))
+        self.assertEqual(len(descendants), 10)
+        ancestors = list(MenuItem.objects.ancestors_of(self.a))
+        self.assertLessEqual(len(ancestors), 67)
+
+
+class PrefixMatchTest(MenuTestCase):
+    """Тесты поиска активного пункта по самому длинному префиксу"""
+    
+    def setUp(self):
+        self.home = MenuItem.objects.create(menu_name='prefix_menu', title='Home', url='/', order=0)
+        self.services = MenuItem.objects.create(menu_name='prefix_menu', title='Services', url='/services/', order=1)
+        self.web = MenuItem.objects.create(
+            menu_name='prefix_menu', title='Web', parent=self.services, url='/services/web/', order=0
+        )
+        self.frontend = MenuItem.objects.create(
+            menu_name='prefix_menu', title='Frontend', parent=self.web, url='/services/web/frontend/', order=0
+        )
+    
+    def test_deepest_prefix(self):
+        """Тест что выбирается самый глубокий пункт-префикс"""
+        from treemenu.tree import compile_menu
+        
+        compiled = compile_menu('prefix_menu')
+        cases = {
+            '/services/web/frontend/42/': self.frontend.id,
+            '/services/web/backend/': self.web.id,
+            '/services/webinar/': self.services.id,
+            '/services/': self.services.id,
+            '/': self.home.id,
+            '/contacts/': None,
+        }
+        for url, expected in cases.items():
+            self.assertEqual(compiled.find_active_id(url, prefix_match=True), expected, url)
+    
+    def test_exact_match_by_default(self):
+        """Тест что без prefix_match работает только точное совпадение"""
+        from treemenu.tree import compile_menu
+        
+        self.assertIsNone(compile_menu('prefix_menu').find_active_id('/services/web/frontend/42/'))
+    
+    def test_draw_menu_prefix_match(self):
+        """Тест опции prefix_match у draw_menu"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template('{% load menu_tags %}{% draw_menu "prefix_menu" prefix_match=True %}')
+        result = template.render(Context({'request': RequestFactory().get('/services/web/frontend/42/')}))
+        self.assertIn('<li class="active in-path"><a href="/services/web/frontend/">', result)
+
+
+class ImportExportCommandTest(MenuTestCase):
+    """Тесты команд import_menu / export_menu"""
+    
+    def write_file(self, suffix, content):
+        import os
+        import tempfile
+        
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+    
+    def test_import_jsonl(self):
+        """Тест импорта дерева с разрешением родителей по внешнему ключу"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        # Дети идут раньше родителей - порядок в файле не важен
+        path = self.write_file('.jsonl', '\n'.join([
+            '{"key": "leaf", "parent": "web", "menu_name": "imp", "title": "Frontend", "url": "/f/", "order": 0}',
+            '{"key": "web", "parent": "root", "menu_name": "imp", "title": "Web", "order": 1}',
+            '{"key": "root", "menu_name": "imp", "title": "Services", "named_url": "services"}',
+        ]))
+        call_command('import_menu', path, stdout=StringIO())
+        
+        leaf = MenuItem.objects.get(menu_name='imp', title='Frontend')
+        self.assertEqual(leaf.depth, 2)
+        self.assertEqual([item.title for item in leaf.get_ancestors()], ['Services', 'Web'])
+        self.assertEqual(leaf.parent.parent.named_url, 'services')
+    
+    def test_import_rejects_bad_data(self):
+        """Тест что ошибки находятся до записи в БД"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        
+        path = self.write_file('.csv', (
+            'key,parent,menu_name,title,url,named_url,order\n'
+            'a,b,bad,A,,,0\n'
+            'b,a,bad,B,,,0\n'
+        ))
+        with self.assertRaisesMessage(CommandError, 'Циклические'):
+            call_command('import_menu', path)
+        
+        path = self.write_file('.csv', (
+            'key,parent,menu_name,title,url,named_url,order\n'
+            'a,missing,bad,A,,,0\n'
+            'c,,bad,,,,x\n'
+        ))
+        with self.assertRaisesMessage(CommandError, 'не найден'):
+            call_command('import_menu', path)
+        self.assertFalse(MenuItem.objects.filter(menu_name='bad').exists())
+    
+    def test_import_rejects_malformed_json(self):
+        """Тест что битые строки JSON Lines попадают в список ошибок с номером строки"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        
+        path = self.write_file('.jsonl', '\n'.join([
+            '{"key": "ok", "menu_name": "bad", "title": "OK"}',
+            '{"key": "broken",',
+            '[1]',
+            '"x"',
+        ]))
+        with self.assertRaises(CommandError) as ctx:
+            call_command('import_menu', path)
+        message = str(ctx.exception)
+        self.assertIn('2: некорректный JSON', message)
+        self.assertIn('3: запись должна быть JSON-объектом', message)
+        self.assertIn('4: запись должна быть JSON-объектом', message)
+        self.assertFalse(MenuItem.objects.filter(menu_name='bad').exists())
+    
+    def test_export_import_roundtrip(self):
+        """Тест что экспорт и повторный импорт с --replace дают то же дерево"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        root = MenuItem.objects.create(menu_name='rt', title='Root', url='/r/', order=0)
+        child = MenuItem.objects.create(menu_name='rt', title='Child', parent=root, named_url='about', order=2)
+        MenuItem.objects.create(menu_name='rt', title='Leaf', parent=child, order=1)
+        
+        def snapshot():
+            return sorted(
+                (item.title, item.parent.title if item.parent else None, item.url, item.named_url, item.order, item.depth)
+                for item in MenuItem.objects.filter(menu_name='rt')
+            )
+        before = snapshot()
+        
+        for file_format in ('jsonl', 'csv'):
+            output = StringIO()
+            call_command('export_menu', 'rt', format=file_format, stdout=output)
+            path = self.write_file(f'.{file_format}', output.getvalue())
+            call_command('import_menu', path, replace=True, stdout=StringIO())
+            self.assertEqual(snapshot(), before)
+    
+    def test_replace_keeps_children_of_other_menus(self):
+        """Тест что --replace не удаляет пункты, на которые ссылаются дети из других меню"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        
+        root = MenuItem.objects.create(menu_name='rep', title='Root', order=0)
+        MenuItem.objects.filter(pk=MenuItem.objects.create(menu_name='other', title='Child').pk).update(parent=root)
+        
+        path = self.write_file('.jsonl', '{"key": "1", "menu_name": "rep", "title": "New"}\n')
+        with self.assertRaisesMessage(CommandError, 'в других меню'):
+            call_command('import_menu', path, replace=True, stdout=StringIO())
+        self.assertEqual(list(MenuItem.objects.filter(menu_name='rep').values_list('title', flat=True)), ['Root'])
+    
+    def test_import_invalidates_menu_cache(self):
+        """Тест что импорт сбрасывает кэш меню"""
+        from django.core.management import call_command
+        from django.template import Context, Template
+        from io import StringIO
+        
+        MenuItem.objects.create(menu_name='imp_cache', title='Old', order=0)
+        template = Template('{% load menu_tags %}{% draw_menu "imp_cache" %}')
+        self.assertIn('Old', template.render(Context({'request': None})))
+        
+        path = self.write_file('.jsonl', '{"key": "1", "menu_name": "imp_cache", "title": "New"}\n')
+        call_command('import_menu', path, replace=True, stdout=StringIO())
+        
+        result = template.render(Context({'request': None}))
+        self.assertIn('New', result)
+        self.assertNotIn('Old', result)
+
+
+class BenchmarkCommandTest(MenuTestCase):
+    """Тесты генератора меню и команды benchmark_menu"""
+    
+    def test_generate_records(self):
+        """Тест размера, глубины и ветвления сгенерированного меню"""
+        from treemenu.bulk import split_levels
+        from treemenu.benchmark import generate_records
+        
+        records = generate_records('gen', size=111, depth=3, fanout=10)
+        levels = split_levels(records)
+        self.assertEqual(len(records), 111)
+        self.assertEqual([len(level) for level in levels], [10, 100, 1])
+    
+    def test_benchmark_report(self):
+        """Тест что отчёт - JSON со статистикой по каждому этапу, а данные откатываются"""
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        
+        output = StringIO()
+        call_command('benchmark_menu', sizes=[50], repeat=2, stdout=output)
+        report = json.loads(output.getvalue())
+        
+        benchmarks = report['results'][0]['benchmarks']
+        self.assertEqual(report['results'][0]['size'], 50)
+        self.assertEqual(benchmarks['draw_menu_cold']['queries'], 1)
+        self.assertEqual(benchmarks['draw_menu_warm']['queries'], 0)
+        for stats in benchmarks.values():
+            self.assertEqual(set(stats), {'median_ms', 'p95_ms', 'peak_kib', 'queries'})
+        self.assertFalse(MenuItem.objects.filter(menu_name='bench_50').exists())
+
+
+class MenuInstrumentationTest(MenuTestCase):
+    """Тесты Server-Timing и счётчиков меню"""
+    
+    def setUp(self):
+        from treemenu import instrumentation
+        instrumentation.reset_stats()
+        MenuItem.objects.create(menu_name='main_menu', title='Home', named_url='home', order=0)
+        MenuItem.objects.create(menu_name='footer_menu', title='Terms', named_url='terms', order=0)
+    
+    def test_server_timing_header(self):
+        """Тест что метрики меню попадают в заголовок Server-Timing"""
+        from django.test import override_settings
+        
+        with override_settings(TREEMENU_INSTRUMENTATION=True):
+            header = self.client.get('/')['Server-Timing']
+            warm_header = self.client.get('/')['Server-Timing']
+        
+        self.assertIn('menu.main_menu+footer_menu.query;dur=', header)
+        self.assertIn('menu.main_menu+footer_menu.queries;desc="1"', header)
+        self.assertIn('menu.main_menu.cache_miss;desc="1"', header)
+        self.assertIn('menu.main_menu.render;dur=', header)
+        self.assertIn('menu.main_menu.cache_local_hit;desc="1"', warm_header)
+        self.assertIn('menu.footer_menu.fragment_hit;desc="1"', warm_header)
+        self.assertNotIn('.query;', warm_header)
+    
+    def test_disabled(self):
+        """Тест что без настройки ничего не собирается"""
+        from django.test import override_settings
+        from treemenu import instrumentation
+        
+        with override_settings(TREEMENU_INSTRUMENTATION=False):
+            response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(instrumentation.get_stats(), {})
+    
+    def test_stats_endpoint(self):
+        """Тест отладочного endpoint с накопленными счётчиками"""
+        from django.test import override_settings
+        
+        with override_settings(TREEMENU_INSTRUMENTATION=True, DEBUG=True):
+            self.client.get('/')
+            self.client.get('/about/')
+            stats = self.client.get('/debug/menu-stats/').json()
+        
+        self.assertEqual(stats['main_menu']['cache_miss'], 1)
+        self.assertEqual(stats['main_menu']['cache_local_hit'], 1)
+        self.assertEqual(stats['main_menu']['total']['count'], 2)
+        
+        with override_settings(DEBUG=False):
+            self.assertEqual(self.client.get('/debug/menu-stats/').status_code, 404)
+
+
+class MenuItemAdminTest(MenuTestCase):
+    """Тесты количества запросов в админке"""
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.root = MenuItem.objects.create(menu_name='main_menu', title='Root', url='/', order=0)
+        self.child = MenuItem.objects.create(menu_name='main_menu', title='Child', url='/child/', parent=self.root)
+        MenuItem.objects.create(menu_name='footer_menu', title='Footer', url='/footer/')
+    
+    def changelist_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/treemenu/menuitem/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+    
+    def test_changelist_query_count_is_constant(self):
+        """Тест что число запросов списка не зависит от числа строк"""
+        baseline = self.changelist_queries()
+        
+        for i in range(30):
+            parent = MenuItem.objects.create(menu_name='main_menu', title=f'Item {i}', parent=self.root)
+            MenuItem.objects.create(menu_name='main_menu', title=f'Leaf {i}', parent=parent)
+        
+        self.assertEqual(self.changelist_queries(), baseline)
+    
+    def test_has_children_annotation(self):
+        """Тест колонки "Есть дети" из подзапроса"""
+        from django.contrib.admin.sites import site
+        from django.test import RequestFactory
+        
+        model_admin = site._registry[MenuItem]
+        queryset = model_admin.get_queryset(RequestFactory().get('/'))
+        flags = {item.title: model_admin.has_children(item) for item in queryset}
+        self.assertEqual(flags, {'Root': True, 'Child': False, 'Footer': False})
+    
+    def test_change_form_does_not_load_menu(self):
+        """Тест что форма редактирования не выгружает всё меню в <select>"""
+        for i in range(20):
+            MenuItem.objects.create(menu_name='main_menu', title=f'Item {i}', parent=self.root)
+        
+        response = self.client.get(f'/admin/treemenu/menuitem/{self.child.pk}/change/')
+        content = response.content.decode()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Item 5', content)
+        self.assertIn('menu_name=main_menu', content)
+    
+    def test_parent_autocomplete_limited_to_menu(self):
+        """Тест что автодополнение родителя ищет только в том же меню"""
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'treemenu',
+            'model_name': 'menuitem',
+            'field_name': 'parent',
+            'term': '',
+            'menu_name': 'main_menu',
+            'exclude_id': self.child.pk,
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        results = [result['text'] for result in response.json()['results']]
+        self.assertEqual(results, ['main_menu: Root'])
+
+
+class AsyncMenuTest(MenuTestCase):
+    """Тесты асинхронной загрузки меню и асинхронных представлений"""
+    
+    def setUp(self):
+        self.home = MenuItem.objects.create(menu_name='main_menu', title='Home', named_url='home', order=0)
+        self.about = MenuItem.objects.create(menu_name='main_menu', title='About', named_url='about', order=1)
+        self.team = MenuItem.objects.create(menu_name='main_menu', title='Team', named_url='about_team', parent=self.about)
+        MenuItem.objects.create(menu_name='footer_menu', title='Terms', named_url='terms')
+    
+    async def test_aget_compiled_menus(self):
+        """Тест что асинхронная загрузка даёт то же дерево и пользуется кэшем"""
+        from treemenu.cache import aget_compiled_menus, clear_local_cache
+        
+        clear_local_cache()
+        menus = await aget_compiled_menus(['main_menu', 'footer_menu'])
+        self.assertEqual(len(menus['main_menu']), 3)
+        self.assertEqual(menus['main_menu'].url_index['/about/team/'], self.team.pk)
+        self.assertEqual(len(menus['footer_menu']), 1)
+        
+        again = await aget_compiled_menus(['main_menu'])
+        self.assertIs(again['main_menu'], menus['main_menu'])
+    
+    async def test_async_page(self):
+        """Тест асинхронной демо-страницы: меню предзагружены до рендера"""
+        response = await self.async_client.get('/async/')
+        content = response.content.decode()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<a href="/about/">About</a>', content)
+        self.assertIn('<a href="/terms/">Terms</a>', content)
+    
+    async def test_apreload_menus(self):
+        """Тест что после предзагрузки draw_menu не обращается к БД и кэшу"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        from treemenu.templatetags.menu_tags import apreload_menus
+        
+        request = RequestFactory().get('/about/')
+        menus = await apreload_menus(request, ['main_menu'])
+        self.assertIn(self.about.pk, menus['main_menu'].fragments)
+        
+        template = Template('{% load menu_tags %}{% draw_menu "main_menu" %}')
+        html = template.render(Context({'request': request}))
+        self.assertIn('<li class="active in-path has-children expanded"><a href="/about/">About</a>', html)
+    
+    async def test_async_api_matches_sync(self):
+        """Тест что асинхронный API отдаёт то же, что и ViewSet, включая ETag"""
+        sync_response = await self.async_client.get('/api/menu/by-name/main_menu/', HTTP_ACCEPT='application/json')
+        async_response = await self.async_client.get('/api/async/menu/by-name/main_menu/')
+        
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.json(), sync_response.json())
+        self.assertEqual(async_response['ETag'], sync_response['ETag'])
+        
+        not_modified = await self.async_client.get(
+            '/api/async/menu/by-name/main_menu/', headers={'if-none-match': async_response['ETag']}
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        
+        missing = await self.async_client.get('/api/async/menu/by-name/nope/')
+        self.assertEqual(missing.status_code, 404)
+    
+    async def test_async_detail(self):
+        """Тест асинхронного детального API (вложенный и плоский)"""
+        response = await self.async_client.get(f'/api/async/menu/{self.about.pk}/')
+        self.assertEqual([child['title'] for child in response.json()['children']], ['Team'])
+        
+        flat = await self.async_client.get(f'/api/async/menu/{self.about.pk}/?flat=1')
+        self.assertNotIn('children', flat.json())
+        
+        missing = await self.async_client.get('/api/async/menu/999999/')
+        self.assertEqual(missing.status_code, 404)
+    
+    async def test_async_server_timing(self):
+        """Тест что middleware работает и в асинхронной цепочке"""
+        from django.test import override_settings
+        
+        with override_settings(TREEMENU_INSTRUMENTATION=True):
+            response = await self.async_client.get('/async/')
+        self.assertIn('menu.main_menu.total;dur=', response['Server-Timing'])
+
+
+class WarmMenusTest(MenuTestCase):
+    """Тесты прогрева кэша меню"""
+    
+    def setUp(self):
+        from treemenu.cache import clear_local_cache
+        
+        about = MenuItem.objects.create(menu_name='main_menu', title='About', named_url='about', order=0)
+        MenuItem.objects.create(menu_name='main_menu', title='Team', named_url='about_team', parent=about)
+        MenuItem.objects.create(menu_name='side_menu', title='Terms', named_url='terms')
+        clear_local_cache()
+    
+    def test_warm_all_menus(self):
+        """Тест что все меню прогреваются одним запросом к пунктам"""
+        from treemenu.cache import get_compiled_menus, warm_menus
+        
+        # Пункты всех меню одним запросом без фильтра по имени
+        with self.assertNumQueries(1):
+            warmed = warm_menus()
+        
+        self.assertEqual(sorted(warmed), ['main_menu', 'side_menu'])
+        # Без активного пункта + по варианту на каждый пункт с URL
+        self.assertEqual(len(warmed['main_menu'].fragments), 3)
+        with self.assertNumQueries(0):
+            get_compiled_menus(['main_menu', 'side_menu'])
+    
+    def test_warm_bulk_inserted_menu(self):
+        """Тест что прогреваются и меню, залитые массовой вставкой без MenuVersion"""
+        from treemenu.cache import get_compiled_menus, warm_menus
+        
+        MenuItem.objects.bulk_create([MenuItem(menu_name='bulk_menu', title='Bulk', url='/bulk/')])
+        self.assertNotIn('bulk_menu', warm_menus(['side_menu']))
+        
+        warmed = warm_menus()
+        self.assertEqual(sorted(warmed), ['bulk_menu', 'main_menu', 'side_menu'])
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_compiled_menus(['bulk_menu'])['bulk_menu']), 1)
+    
+    def test_draw_menu_after_warm(self):
+        """Тест что после прогрева draw_menu не делает запросов и не рендерит"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        from treemenu.cache import warm_menus
+        
+        warm_menus(['main_menu'])
+        template = Template('{% load menu_tags %}{% draw_menu "main_menu" %}')
+        with self.assertNumQueries(0):
+            html = template.render(Context({'request': RequestFactory().get('/about/team/')}))
+        self.assertIn('class="active in-path"', html)
+    
+    def test_refresh(self):
+        """Тест что --refresh собирает меню заново"""
+        from treemenu.cache import warm_menus
+        
+        first = warm_menus(['side_menu'])['side_menu']
+        self.assertIs(warm_menus(['side_menu'])['side_menu'], first)
+        self.assertIsNot(warm_menus(['side_menu'], refresh=True)['side_menu'], first)
+    
+    def test_command(self):
+        """Тест команды warm_menus"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        out = StringIO()
+        call_command('warm_menus', stdout=out)
+        self.assertIn('main_menu: пунктов 2, вариантов HTML 3', out.getvalue())
+        self.assertIn('Прогрето меню: 2', out.getvalue())
+    
+    def test_warm_on_first_request(self):
+        """Тест прогрева при первом запросе воркера (TREEMENU_WARM_ON_STARTUP)"""
+        from django.apps import apps
+        from django.core.signals import request_started
+        from django.test import override_settings
+        from treemenu.cache import get_compiled_menus
+        
+        with override_settings(TREEMENU_WARM_ON_STARTUP=True):
+            apps.get_app_config('treemenu').ready()
+        self.addCleanup(request_started.disconnect, dispatch_uid='treemenu_warm_menus')
+        
+        self.client.get('/')
+        # side_menu на странице не выводится, но уже в кэше
+        with self.assertNumQueries(0):
+            get_compiled_menus(['side_menu'])
+        # Прогрев выполняется один раз
+        self.assertFalse(request_started.disconnect(dispatch_uid='treemenu_warm_menus'))
+
+
+class MenuVisibilityTest(MenuTestCase):
+    """Тесты правил видимости и вариантов меню по аудитории"""
+    
+    def setUp(self):
+        from django.contrib.auth.models import Group, User
+        from treemenu.cache import clear_local_cache
+        
+        MenuItem.objects.create(menu_name='vis_menu', title='Public', url='/public/', order=0)
+        account = MenuItem.objects.create(
+            menu_name='vis_menu', title='Account', url='/account/', order=1, visibility='authenticated'
+        )
+        MenuItem.objects.create(menu_name='vis_menu', title='Orders', url='/account/orders/', parent=account)
+        MenuItem.objects.create(menu_name='vis_menu', title='Login', url='/login/', order=2, visibility='anonymous')
+        MenuItem.objects.create(menu_name='vis_menu', title='Admin', url='/admin/', order=3, visibility='staff')
+        MenuItem.objects.create(menu_name='vis_menu', title='Drafts', url='/drafts/', order=4, groups='editors, writers')
+        
+        self.user = User.objects.create(username='user')
+        self.editor = User.objects.create(username='editor')
+        self.editor.groups.add(Group.objects.create(name='editors'))
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.superuser = User.objects.create(username='root', is_staff=True, is_superuser=True)
+        clear_local_cache()
+    
+    def render(self, user=None, url='/'):
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        request = RequestFactory().get(url)
+        if user is not None:
+            request.user = user
+        template = Template('{% load menu_tags %}{% draw_menu "vis_menu" %}')
+        return template.render(Context({'request': request}))
+    
+    def titles(self, html):
+        import re
+        return re.findall(r'>([^<>]+)</a>', html)
+    
+    def test_groups_normalized(self):
+        """Тест что группы хранятся в едином виде"""
+        self.assertEqual(MenuItem.objects.get(title='Drafts').groups, 'editors,writers')
+    
+    def test_anonymous(self):
+        """Тест меню для анонимного пользователя"""
+        self.assertEqual(self.titles(self.render()), ['Public', 'Login'])
+    
+    def test_authenticated_hides_subtree_rules(self):
+        """Тест меню авторизованного пользователя: скрытый родитель скрывает детей"""
+        self.assertEqual(self.titles(self.render(self.user, '/account/')), ['Public', 'Account', 'Orders'])
+        
+        # Для анонимного Orders не виден, даже если сам по себе без правил
+        self.assertNotIn('Orders', self.render(url='/account/orders/'))
+    
+    def test_staff_and_groups(self):
+        """Тест уровня staff, групп и суперпользователя"""
+        self.assertEqual(self.titles(self.render(self.staff)), ['Public', 'Account', 'Admin'])
+        self.assertEqual(self.titles(self.render(self.editor)), ['Public', 'Account', 'Drafts'])
+        self.assertEqual(self.titles(self.render(self.superuser)), ['Public', 'Account', 'Admin', 'Drafts'])
+    
+    def test_variants_without_db_work(self):
+        """Тест что варианты строятся в памяти и кэшируются по ключу аудитории"""
+        from treemenu.cache import get_compiled_menu
+        
+        self.render()
+        # Анонимный пользователь - без запросов к БД
+        with self.assertNumQueries(0):
+            self.render()
+            self.render(self.superuser)
+        # Меню ссылается на группы: группы пользователя - один запрос на запрос
+        for user in (self.user, self.staff, self.editor):
+            with self.assertNumQueries(1):
+                self.render(user)
+        
+        compiled = get_compiled_menu('vis_menu')
+        self.assertEqual(
+            sorted(compiled.variants),
+            ['anonymous', 'authenticated', 'authenticated+editors', 'staff', 'staff+editors,writers'],
+        )
+    
+    def test_no_group_query_without_group_rules(self):
+        """Тест что без правил по группам группы пользователя не загружаются"""
+        from treemenu.signals import menu_changed
+        
+        MenuItem.objects.filter(menu_name='vis_menu').update(groups='')
+        menu_changed('vis_menu')
+        
+        self.render(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(self.render(self.user)), ['Public', 'Account', 'Drafts'])
+    
+    def test_menu_without_rules(self):
+        """Тест что меню без правил не создаёт вариантов"""
+        from treemenu.cache import get_compiled_menu
+        
+        MenuItem.objects.create(menu_name='plain_menu', title='Home', url='/')
+        compiled = get_compiled_menu('plain_menu')
+        self.assertFalse(compiled.has_rules)
+        self.assertIs(compiled.for_audience(None), compiled)
+    
+    async def test_apreload_with_audience(self):
+        """Тест что асинхронная предзагрузка заранее определяет аудиторию"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        from treemenu.templatetags.menu_tags import apreload_menus
+        
+        async def auser():
+            return self.editor
+        
+        request = RequestFactory().get('/drafts/')
+        request.auser = auser
+        await apreload_menus(request, ['vis_menu'])
+        
+        # Рендер не трогает ни request.user, ни БД
+        html = Template('{% load menu_tags %}{% draw_menu "vis_menu" %}').render(Context({'request': request}))
+        self.assertEqual(self.titles(html), ['Public', 'Account', 'Drafts'])
+        self.assertIn('class="active in-path"', html)
+    
+    def test_api_filters_and_varies_etag(self):
+        """Тест что API не отдаёт скрытые пункты и ETag зависит от аудитории"""
+        anonymous = self.client.get('/api/menu/by-name/vis_menu/', HTTP_ACCEPT='application/json')
+        self.assertEqual([item['title'] for item in anonymous.json()['items']], ['Public', 'Login'])
+        
+        self.client.force_login(self.editor)
+        editor = self.client.get('/api/menu/by-name/vis_menu/', HTTP_ACCEPT='application/json')
+        self.assertEqual([item['title'] for item in editor.json()['items']], ['Public', 'Account', 'Drafts'])
+        self.assertNotEqual(anonymous['ETag'], editor['ETag'])
+        
+        flat = self.client.get('/api/menu/?menu_name=vis_menu&flat=1', HTTP_ACCEPT='application/json')
+        self.assertNotIn('Admin', [item['title'] for item in flat.json()['results']])
+    
+    def test_by_name_total_counts_tree_nodes(self):
+        """Тест что total_items считает только пункты в дереве (без детей скрытых пунктов)"""
+        from django.test import override_settings
+        from treemenu.snapshots import publish_menus
+        
+        def count(nodes):
+            return sum(1 + count(node['children']) for node in nodes)
+        
+        publish_menus(['vis_menu'])
+        for snapshots in (False, True):
+            with override_settings(TREEMENU_SNAPSHOTS=snapshots):
+                data = self.client.get('/api/menu/by-name/vis_menu/', HTTP_ACCEPT='application/json').json()
+            self.assertNotIn('Orders', str(data['items']))
+            self.assertEqual(data['total_items'], count(data['items']))
+    
+    def test_api_hides_children_of_hidden_items(self):
+        """Тест что список и детальный ответ не отдают потомков скрытого пункта"""
+        orders = MenuItem.objects.get(title='Orders')
+        for url in ('/api/menu/?menu_name=vis_menu', '/api/menu/?menu_name=vis_menu&flat=1'):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertNotIn('Orders', [item['title'] for item in response.json()['results']])
+        self.assertEqual(self.client.get(f'/api/menu/{orders.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/async/menu/{orders.pk}/').status_code, 404)
+        
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/api/menu/{orders.pk}/').status_code, 200)
+
+
+class MenuDepthLimitTest(MenuTestCase):
+    """Тесты ограничения глубины отрисовки и API children"""
+    
+    def setUp(self):
+        self.catalog = MenuItem.objects.create(menu_name='catalog', title='Catalog', url='/catalog/', order=0)
+        self.phones = MenuItem.objects.create(menu_name='catalog', title='Phones', url='/catalog/phones/', parent=self.catalog, order=1)
+        self.laptops = MenuItem.objects.create(menu_name='catalog', title='Laptops', url='/catalog/laptops/', parent=self.catalog, order=0)
+        self.android = MenuItem.objects.create(menu_name='catalog', title='Android', url='/catalog/phones/android/', parent=self.phones)
+        MenuItem.objects.create(menu_name='catalog', title='Secret', url='/secret/', parent=self.phones, visibility='staff')
+        MenuItem.objects.create(menu_name='catalog', title='Help', url='/help/', order=1)
+    
+    def render(self, url, tag_args=''):
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template('{% load menu_tags %}{% draw_menu "catalog" ' + tag_args + ' %}')
+        return template.render(Context({'request': RequestFactory().get(url)}))
+    
+    def test_max_depth(self):
+        """Тест что глубже max_depth уровни не выводятся"""
+        full = self.render('/catalog/phones/android/')
+        self.assertIn('Android', full)
+        
+        limited = self.render('/catalog/phones/android/', 'max_depth=2')
+        self.assertIn('Phones', limited)
+        self.assertNotIn('Android', limited)
+        # Пункт последнего уровня не помечается раскрытым
+        self.assertIn('<li class="in-path has-children"><a href="/catalog/phones/">Phones</a></li>', limited)
+        
+        roots = self.render('/catalog/', 'max_depth=1')
+        self.assertEqual(roots.count('<li'), 2)
+    
+    def test_max_depth_invalid(self):
+        """Тест что max_depth < 1 и не число отклоняются с TemplateSyntaxError"""
+        from django.template import TemplateSyntaxError
+        
+        for tag_args in ('max_depth=0', 'max_depth=-1', 'max_depth="two"'):
+            with self.assertRaises(TemplateSyntaxError):
+                self.render('/catalog/', tag_args)
+        self.assertNotIn('Android', self.render('/catalog/', 'max_depth="2"'))
+    
+    def test_max_depth_invalid_setting(self):
+        """Тест что некорректная TREEMENU_MAX_DEPTH - ошибка конфигурации"""
+        from django.core.exceptions import ImproperlyConfigured
+        from django.test import override_settings
+        
+        for value in (0, 'two'):
+            with override_settings(TREEMENU_MAX_DEPTH=value), self.assertRaises(ImproperlyConfigured):
+                self.render('/catalog/')
+    
+    def test_max_depth_setting_and_fragments(self):
+        """Тест настройки TREEMENU_MAX_DEPTH и раздельных фрагментов"""
+        from django.test import override_settings
+        
+        full = self.render('/catalog/')
+        with override_settings(TREEMENU_MAX_DEPTH=1):
+            self.assertNotIn('Laptops', self.render('/catalog/'))
+        self.assertEqual(self.render('/catalog/'), full)
+    
+    def test_children_roots(self):
+        """Тест корневого уровня: один уровень с признаком has_children"""
+        with self.assertNumQueries(2):  # версия меню + пункты уровня
+            response = self.client.get('/api/menu/children/catalog/', HTTP_ACCEPT='application/json')
+        
+        data = response.json()
+        self.assertIsNone(data['parent'])
+        self.assertEqual(
+            [(item['title'], item['has_children']) for item in data['items']],
+            [('Catalog', True), ('Help', False)],
+        )
+        self.assertIn('ETag', response)
+    
+    def test_children_of_node(self):
+        """Тест детей пункта в порядке order"""
+        response = self.client.get(f'/api/menu/children/catalog/?parent={self.catalog.pk}', HTTP_ACCEPT='application/json')
+        self.assertEqual(
+            [(item['title'], item['has_children']) for item in response.json()['items']],
+            [('Laptops', False), ('Phones', True)],
+        )
+        
+        # Скрытые пункты не видны ни в списке, ни как родитель
+        response = self.client.get(f'/api/menu/children/catalog/?parent={self.phones.pk}', HTTP_ACCEPT='application/json')
+        self.assertEqual([item['title'] for item in response.json()['items']], ['Android'])
+        secret = MenuItem.objects.get(title='Secret')
+        response = self.client.get(f'/api/menu/children/catalog/?parent={secret.pk}')
+        self.assertEqual(response.status_code, 404)
+    
+    def test_children_order_matches_by_name(self):
+        """Тест что братья с одинаковым order идут по title, как в by-name"""
+        for title in ('Zeta', 'Alpha'):
+            MenuItem.objects.create(menu_name='catalog', title=title, order=1)
+        
+        children = self.client.get('/api/menu/children/catalog/', HTTP_ACCEPT='application/json').json()
+        by_name = self.client.get('/api/menu/by-name/catalog/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(
+            [item['title'] for item in children['items']], [item['title'] for item in by_name['items']]
+        )
+        self.assertEqual([item['title'] for item in children['items']], ['Catalog', 'Alpha', 'Help', 'Zeta'])
+    
+    def test_children_wrong_menu(self):
+        """Тест что родитель из другого меню не найден"""
+        other = MenuItem.objects.create(menu_name='other', title='Other')
+        response = self.client.get(f'/api/menu/children/catalog/?parent={other.pk}')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/menu/children/catalog/?parent=abc').status_code, 404)
+
+
+class MenuReplicaRouterTest(MenuTestCase):
+    """Тесты чтения меню из реплики (две SQLite-базы: default и replica)"""
+    databases = {'default', 'replica'}
+    
+    def setUp(self):
+        from treemenu.cache import clear_local_cache
+        
+        # Пункты есть только в основной БД: реплика "отстаёт"
+        self.root = MenuItem.objects.create(menu_name='replica_menu', title='Root', url='/replica/')
+        clear_local_cache()
+    
+    def render(self):
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template('{% load menu_tags %}{% draw_menu "replica_menu" %}')
+        return template.render(Context({'request': RequestFactory().get('/')}))
+    
+    def test_router_aliases(self):
+        """Тест выбора БД роутером"""
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        from treemenu import routers
+        
+        router = routers.MenuReplicaRouter()
+        self.assertIsNone(router.db_for_read(MenuItem))
+        with override_settings(TREEMENU_REPLICA_DB='replica'):
+            self.assertEqual(router.db_for_read(MenuItem), 'replica')
+            self.assertEqual(router.db_for_write(MenuItem), 'default')
+            self.assertIsNone(router.db_for_read(User))
+            
+            token = routers.start_request(True)
+            try:
+                self.assertEqual(router.db_for_read(MenuItem), 'default')
+            finally:
+                routers.finish_request(token)
+    
+    def test_reads_from_replica(self):
+        """Тест что меню собирается из реплики"""
+        from django.db import connections
+        from django.test import override_settings
+        from django.test.utils import CaptureQueriesContext
+        
+        with override_settings(TREEMENU_REPLICA_DB='replica'):
+            with CaptureQueriesContext(connections['replica']) as ctx:
+                html = self.render()
+        self.assertNotIn('Root', html)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        
+        response = self.client.get('/api/menu/?menu_name=replica_menu&flat=1', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['count'], 1)  # без реплики - основная БД
+    
+    def test_recent_change_compiled_from_primary(self):
+        """Тест что недавно изменённое меню не кэшируется из отстающей реплики"""
+        from django.test import override_settings
+        
+        with override_settings(TREEMENU_REPLICA_DB='replica'):
+            MenuItem.objects.create(menu_name='replica_menu', title='Fresh', url='/fresh/')
+            html = self.render()
+        self.assertIn('Root', html)
+        self.assertIn('Fresh', html)
+    
+    def test_admin_save_sticks_to_primary(self):
+        """Тест read-your-writes: после сохранения в админке чтения идут в основную БД"""
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        from treemenu.routers import STICKY_COOKIE
+        
+        self.client.force_login(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        url = '/api/menu/?menu_name=replica_menu&flat=1'
+        with override_settings(TREEMENU_REPLICA_DB='replica'):
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').json()['count'], 0)
+            
+            response = self.client.post(f'/admin/treemenu/menuitem/{self.root.pk}/change/', {
+                'menu_name': 'replica_menu', 'title': 'Renamed', 'url': '/replica/', 'named_url': '',
+                'order': 0, 'visibility': 'all', 'groups': '',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(STICKY_COOKIE, response.cookies)
+            
+            data = self.client.get(url, HTTP_ACCEPT='application/json').json()
+            self.assertEqual([item['title'] for item in data['results']], ['Renamed'])
+            
+            # Без cookie (другой пользователь или истёк срок) - снова реплика
+            del self.client.cookies[STICKY_COOKIE]
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').json()['count'], 0)
+
+
+class MenuSnapshotTest(MenuTestCase):
+    """Тесты публикации меню (MenuSnapshot)"""
+    
+    def setUp(self):
+        from treemenu.cache import clear_local_cache
+        
+        self.about = MenuItem.objects.create(menu_name='main_menu', title='About', named_url='about', order=0)
+        MenuItem.objects.create(menu_name='main_menu', title='Team', named_url='about_team', parent=self.about)
+        MenuItem.objects.create(menu_name='main_menu', title='Staff', url='/staff/', order=1, visibility='staff')
+        clear_local_cache()
+    
+    def render(self, url='/about/'):
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template('{% load menu_tags %}{% draw_menu "main_menu" %}')
+        return template.render(Context({'request': RequestFactory().get(url)}))
+    
+    def test_publish_and_drafts(self):
+        """Тест что правки видны на сайте только после публикации"""
+        from django.test import override_settings
+        from treemenu.snapshots import publish_menus
+        
+        live = self.render()
+        self.assertEqual(publish_menus(), {'main_menu': 3})
+        with override_settings(TREEMENU_SNAPSHOTS=True):
+            self.assertEqual(self.render(), live)
+            
+            # Черновик: новый пункт не виден до публикации
+            MenuItem.objects.create(menu_name='main_menu', title='Draft', url='/draft/', order=2)
+            self.assertNotIn('Draft', self.render())
+            publish_menus(['main_menu'])
+            self.assertIn('Draft', self.render())
+    
+    def test_single_query_without_url_resolving(self):
+        """Тест что опубликованное меню загружается одним запросом по ключу"""
+        from unittest import mock
+        from django.test import override_settings
+        from treemenu.cache import clear_local_cache, get_compiled_menus
+        from treemenu.snapshots import publish_menus
+        
+        publish_menus()
+        clear_local_cache()
+        with override_settings(TREEMENU_SNAPSHOTS=True), \
+                mock.patch('treemenu.tree.resolve_item_url') as resolve, self.assertNumQueries(1):
+            compiled = get_compiled_menus(['main_menu', 'unpublished'])
+        resolve.assert_not_called()
+        self.assertEqual(len(compiled['main_menu']), 3)
+        self.assertEqual(len(compiled['unpublished']), 0)
+        self.assertEqual(compiled['main_menu'].url_index['/about/team/'], self.about.children.get().pk)
+    
+    def test_api_by_name(self):
+        """Тест что API by-name отдаёт из снимка тот же ответ"""
+        from django.test import override_settings
+        from treemenu.snapshots import publish_menus
+        
+        url = '/api/menu/by-name/main_menu/'
+        live = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        publish_menus()
+        with override_settings(TREEMENU_SNAPSHOTS=True):
+            with self.assertNumQueries(2):  # версия меню + снимок
+                response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.json(), live)
+            self.assertNotIn('Staff', str(live))
+            
+            self.assertEqual(self.client.get('/api/menu/by-name/missing/').status_code, 404)
+            async_response = self.client.get('/api/async/menu/by-name/main_menu/')
+            self.assertEqual(async_response.json(), live)
+    
+    def test_publish_command(self):
+        """Тест команды publish_menu и публикации удалённого меню"""
+        from io import StringIO
+        from django.core.management import call_command
+        from treemenu.models import MenuSnapshot
+        
+        call_command('publish_menu', stdout=StringIO())
+        self.assertEqual(MenuSnapshot.objects.get().items_count, 3)
+        
+        MenuItem.objects.filter(menu_name='main_menu').delete()
+        call_command('publish_menu', stdout=StringIO())
+        self.assertEqual(MenuSnapshot.objects.get(pk='main_menu').items_count, 0)
+
+
+class PrerenderMenusTest(MenuTestCase):
+    """Тесты статической отрисовки меню в файлы (prerender_menus)"""
+    
+    def setUp(self):
+        import tempfile
+        from treemenu.cache import clear_local_cache
+        from treemenu.prerender import reset_release
+        
+        self.about = MenuItem.objects.create(menu_name='main_menu', title='About', url='/about/', order=0)
+        MenuItem.objects.create(menu_name='main_menu', title='Team', url='/about/team/', parent=self.about)
+        MenuItem.objects.create(menu_name='main_menu', title='Staff', url='/staff/', order=1, visibility='staff')
+        MenuItem.objects.create(menu_name='footer_menu', title='Terms', url='/terms/')
+        clear_local_cache()
+        reset_release()
+        self.addCleanup(reset_release)
+        
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, self.directory, True)
+    
+    def render(self, url, tag_args='', user=None):
+        from django.contrib.auth.models import AnonymousUser
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        request = RequestFactory().get(url)
+        request.user = user or AnonymousUser()
+        template = Template('{% load menu_tags %}{% draw_menu "main_menu" ' + tag_args + ' %}')
+        return template.render(Context({'request': request}))
+    
+    def prerender(self, *menu_names):
+        from io import StringIO
+        from django.core.management import call_command
+        
+        call_command('prerender_menus', *menu_names, output=self.directory, stdout=StringIO())
+    
+    def static_settings(self):
+        from django.test import override_settings
+        
+        return override_settings(
+            TREEMENU_STATIC_MENUS=True, TREEMENU_STATIC_DIR=self.directory, TREEMENU_STATIC_RELOAD_INTERVAL=0
+        )
+    
+    def test_same_html_without_queries(self):
+        """Тест что статический режим отдаёт тот же HTML без запросов к БД"""
+        from django.contrib.auth.models import User
+        
+        staff = User.objects.create(username='staff', is_staff=True)
+        cases = [('/about/', '', None), ('/about/team/', '', None), ('/nowhere/', '', None),
+                 ('/about/team/42/', 'prefix_match=True', None), ('/staff/', '', staff)]
+        expected = [self.render(url, args, user) for url, args, user in cases]
+        self.assertIn('Staff', expected[-1])
+        
+        self.prerender()
+        with self.static_settings(), self.assertNumQueries(0):
+            actual = [self.render(url, args, user) for url, args, user in cases]
+        self.assertEqual(actual, expected)
+    
+    def test_fallback(self):
+        """Тест что меню и глубина, которых нет в выпуске, рисуются обычным путём"""
+        self.prerender('footer_menu')
+        with self.static_settings():
+            with self.assertNumQueries(1):
+                self.assertIn('About', self.render('/about/'))
+        
+        self.prerender()
+        with self.static_settings():
+            with self.assertNumQueries(0):
+                self.render('/about/')
+            # Дерево уже в кэше после prerender_menus - рендер без запросов
+            self.assertNotIn('Team', self.render('/about/', 'max_depth=1'))
+    
+    def test_load_menus(self):
+        """Тест что load_menus не обращается к БД за меню из выпуска"""
+        from django.contrib.auth.models import AnonymousUser
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        
+        template = Template(
+            '{% load menu_tags %}{% load_menus "main_menu" "footer_menu" %}'
+            '{% draw_menu "main_menu" %}{% draw_menu "footer_menu" %}'
+        )
+        request = RequestFactory().get('/about/')
+        request.user = AnonymousUser()
+        
+        self.prerender()
+        with self.static_settings(), self.assertNumQueries(0):
+            html = template.render(Context({'request': request}))
+        self.assertIn('About', html)
+        self.assertIn('Terms', html)
+        
+        self.assertFalse(getattr(request, '_treemenu_registry', None))
+        
+        # Меню не из выпуска загружаются как обычно
+        self.prerender('footer_menu')
+        request = RequestFactory().get('/about/')
+        request.user = AnonymousUser()
+        with self.static_settings():
+            html = template.render(Context({'request': request}))
+        self.assertIn('About', html)
+        self.assertEqual(set(request._treemenu_registry), {'main_menu'})
+    
+    def test_invalid_max_depth(self):
+        """Тест что --max-depth < 1 отклоняется: такой выпуск draw_menu никогда не найдёт"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        
+        for max_depth in (0, -1):
+            with self.assertRaisesMessage(CommandError, 'не меньше 1'):
+                call_command('prerender_menus', output=self.directory, max_depth=max_depth, stdout=StringIO())
+        self.assertFalse(__import__('os').listdir(self.directory))
+    
+    def test_bulk_inserted_menu(self):
+        """Тест что в выпуск попадают и меню, залитые массовой вставкой без MenuVersion"""
+        from django.template import Context, Template
+        from django.test import RequestFactory
+        from treemenu.bulk import bulk_insert_tree, split_levels
+        from treemenu.models import MenuVersion, Visibility
+        
+        records = {'faq': (None, 'bulk_menu', 'FAQ', '/faq/', '', 0, Visibility.ALL, '')}
+        bulk_insert_tree(records, split_levels(records), 'default')
+        self.assertFalse(MenuVersion.objects.filter(menu_name='bulk_menu').exists())
+        
+        self.prerender()
+        template = Template('{% load menu_tags %}{% draw_menu "bulk_menu" %}')
+        with self.static_settings(), self.assertNumQueries(0):
+            self.assertIn('FAQ', template.render(Context({'request': RequestFactory().get('/faq/')})))
+    
+    def test_atomic_swap(self):
+        """Тест что новый выпуск подменяет текущий, а старые удаляются"""
+        import os
+        
+        self.prerender()
+        with self.static_settings():
+            self.assertNotIn('Blog', self.render('/about/'))
+        
+        MenuItem.objects.create(menu_name='main_menu', title='Blog', url='/blog/', order=2)
+        self.prerender()
+        self.prerender()
+        with self.static_settings():
+            self.assertIn('Blog', self.render('/about/'))
+        
+        releases = os.listdir(os.path.join(self.directory, 'releases'))
+        self.assertEqual(len(releases), 2)
+        current = os.readlink(os.path.join(self.directory, 'current'))
+        self.assertIn(os.path.basename(current), releases)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['current', 'releases'])
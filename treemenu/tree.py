@@ -0,0 +1,350 @@
+"""
+Построение дерева меню в памяти.
+
+Всё, что здесь происходит, не обращается к БД: на вход подаётся
+плоский список пунктов, полученный одним запросом.
+"""
+from treemenu import instrumentation
+from treemenu.audience import STANDARD_AUDIENCES
+from treemenu.models import Visibility, parse_groups
+from treemenu.rendering import escape_title
+from treemenu.resolver import resolve_item_url
+
+
+def build_tree(items):
+    """
+    Строит дерево из плоского списка элементов.
+    Возвращает (items_dict, root_items).
+    
+    Ключевая оптимизация: вместо N+1 запросов к БД строим дерево в памяти.
+    """
+    items_dict = {}
+    root_items = []
+    
+    # Первый проход: создаём индекс id -> item
+    for item in items:
+        item.children_list = []  # Добавляем список для детей
+        items_dict[item.id] = item
+    
+    # Второй проход: связываем родителей с детьми
+    for item in items:
+        if item.parent_id:
+            parent = items_dict.get(item.parent_id)
+            if parent:
+                parent.children_list.append(item)
+        else:
+            # Если нет родителя - это корневой элемент
+            root_items.append(item)
+    
+    return items_dict, root_items
+
+
+def get_active_path(items_dict, current_url):
+    """
+    Находит активный элемент и строит путь от него к корню.
+    Возвращает (active_id, path_set).
+    """
+    active_id = None
+    path = set()
+    
+    # Ищем элемент с совпадающим URL
+    for item_id, item in items_dict.items():
+        item_url = item.get_url()
+        if item_url and item_url != '#' and current_url == item_url:
+            active_id = item_id
+            # Строим путь вверх до корня
+            node = item
+            while node:
+                path.add(node.id)
+                node = items_dict.get(node.parent_id)
+            break
+    
+    return active_id, path
+
+
+class MenuNode:
+    """
+    Компактный узел скомпилированного меню.
+    
+    В отличие от экземпляра MenuItem не несёт _state, __dict__ и лишних
+    полей: только то, что нужно для отрисовки. URL уже разрешён,
+    название заранее экранировано (title_html). visibility и groups -
+    правила видимости (groups - frozenset имён групп).
+    """
+    __slots__ = ('id', 'parent_id', 'title', 'title_html', 'url', 'visibility', 'groups', 'children_list')
+
+    def __init__(self, id, parent_id, title, url, visibility=Visibility.ALL, groups=frozenset()):
+        self.id = id
+        self.parent_id = parent_id
+        self.title = title
+        # Если экранировать нечего, replace() вернёт ту же строку - без лишней памяти
+        self.title_html = escape_title(title)
+        self.url = url
+        self.visibility = visibility
+        self.groups = groups
+        self.children_list = ()
+
+    def get_url(self):
+        return self.url
+
+
+def build_indexes(items_dict):
+    """
+    Строит индексы для быстрого поиска активного пункта.
+    Возвращает (url_index, parents):
+    - url_index: url -> id первого пункта с таким URL (как при линейном поиске);
+    - parents: id -> id родителя (None для корней и "осиротевших" пунктов).
+    """
+    url_index = {}
+    parents = {}
+    for item_id, item in items_dict.items():
+        item_url = item.get_url()
+        if item_url and item_url != '#':
+            url_index.setdefault(item_url, item_id)
+        parents[item_id] = item.parent_id if item.parent_id in items_dict else None
+    return url_index, parents
+
+
+# Ключ в узле префиксного дерева, под которым лежит id пункта
+# (сегменты пути никогда не бывают пустыми, поэтому коллизий нет)
+TRIE_ITEM = ''
+
+
+def split_url_path(url):
+    """
+    Сегменты локального пути ('/a/b/' -> ['a', 'b']).
+    None для внешних URL, URL с query/якорем и корня '/' - они
+    участвуют только в точном сравнении.
+    """
+    if not url.startswith('/') or url.startswith('//') or '?' in url or '#' in url:
+        return None
+    return [segment for segment in url.split('/') if segment] or None
+
+
+def build_url_trie(url_index):
+    """
+    Префиксное дерево по сегментам пути: {'services': {'web': {'': id, ...}}}.
+    """
+    trie = {}
+    for url, item_id in url_index.items():
+        segments = split_url_path(url)
+        if segments is None:
+            continue
+        node = trie
+        for segment in segments:
+            node = node.setdefault(segment, {})
+        node.setdefault(TRIE_ITEM, item_id)
+    return trie
+
+
+class CompiledMenu:
+    """
+    Скомпилированное меню: готовое дерево, которое можно хранить в кэше
+    и отрисовывать сколько угодно раз без обращений к БД.
+    
+    Узлы - MenuNode с уже разрешёнными URL, поэтому дерево действительно
+    только для того URLconf, в котором собрано (см. resolver.urlconf_key).
+    """
+    __slots__ = (
+        'menu_name', 'items_dict', 'root_items', 'url_index', 'parents',
+        'cache_key', 'fragments', '_url_trie', 'has_rules', 'rule_groups', 'variants',
+    )
+
+    def __init__(self, menu_name, items):
+        self.menu_name = menu_name
+        # Ключ версии в кэше (выставляется в cache.get_compiled_menus)
+        self.cache_key = None
+        # Готовый HTML по id активного пункта: не больше N + 1 вариантов
+        self.fragments = {}
+        self.items_dict, self.root_items = build_tree(items)
+        # Списки детей больше не меняются: кортежи компактнее,
+        # а у листьев остаётся общий пустой кортеж
+        for node in self.items_dict.values():
+            node.children_list = tuple(node.children_list)
+        self.url_index, self.parents = build_indexes(self.items_dict)
+        # Строится при первом поиске по префиксу (режим включается явно)
+        self._url_trie = None
+        # Правила видимости: без них for_audience() возвращает само меню
+        self.has_rules = any(
+            node.visibility != Visibility.ALL or node.groups for node in self.items_dict.values()
+        )
+        self.rule_groups = frozenset().union(*(node.groups for node in self.items_dict.values()))
+        # Отфильтрованные варианты по ключу аудитории (в памяти процесса)
+        self.variants = {}
+
+    def __len__(self):
+        return len(self.items_dict)
+
+    def __getstate__(self):
+        # В кэш дерево кладётся плоским списком строк: pickle не уходит в
+        # рекурсию по глубине дерева, а связи восстанавливаются за O(n)
+        rows = [
+            (node.id, node.parent_id, node.title, node.url, node.visibility, node.groups)
+            for node in self.items_dict.values()
+        ]
+        return self.menu_name, rows, self.cache_key, self.fragments
+
+    def __setstate__(self, state):
+        menu_name, rows, cache_key, fragments = state
+        self.__init__(menu_name, [MenuNode(*row) for row in rows])
+        self.cache_key = cache_key
+        self.fragments = fragments
+
+    def get_active_path(self, current_url):
+        """
+        То же, что get_active_path(), но через индексы:
+        O(1) поиск активного пункта + подъём по родителям O(глубина).
+        Возвращает (active_id, path_set).
+        """
+        active_id = self.url_index.get(current_url)
+        return active_id, self.get_path(active_id)
+
+    def find_active_id(self, current_url, prefix_match=False):
+        """
+        id активного пункта для URL.
+        
+        При prefix_match, если точного совпадения нет, выбирается самый
+        глубокий пункт, чей путь является префиксом URL (по целым сегментам):
+        для /services/web/frontend/42/ активным станет /services/web/frontend/.
+        Поиск за O(число сегментов URL) независимо от размера меню.
+        """
+        active_id = self.url_index.get(current_url)
+        if active_id is not None or not prefix_match:
+            return active_id
+        
+        if self._url_trie is None:
+            self._url_trie = build_url_trie(self.url_index)
+        node = self._url_trie
+        for segment in split_url_path(current_url) or ():
+            node = node.get(segment)
+            if node is None:
+                break
+            active_id = node.get(TRIE_ITEM, active_id)
+        return active_id
+
+    def for_audience(self, audience):
+        """
+        Вариант меню для аудитории (см. audience.Audience): без скрытых пунктов
+        и их потомков. Строится в памяти из уже скомпилированного дерева один
+        раз на ключ аудитории; у каждого варианта свои фрагменты HTML.
+        Меню без правил видимости возвращается как есть.
+        """
+        if not self.has_rules:
+            return self
+        key = audience.key(self.rule_groups)
+        variant = self.variants.get(key)
+        if variant is None:
+            variant = self.variants[key] = self._filter(audience, key)
+        return variant
+
+    def _filter(self, audience, key):
+        visible_groups = audience.groups_for(self.rule_groups)
+        nodes = []
+        stack = list(reversed(self.root_items))
+        while stack:
+            node = stack.pop()
+            if audience.can_see(node.visibility, node.groups, visible_groups):
+                nodes.append(MenuNode(node.id, node.parent_id, node.title, node.url, node.visibility, node.groups))
+                stack.extend(reversed(node.children_list))
+        
+        variant = CompiledMenu(self.menu_name, nodes)
+        if self.cache_key:
+            variant.cache_key = f'{self.cache_key}:{key}'
+        return variant
+
+    def get_path(self, node_id):
+        """Множество id от пункта до корня (включая сам пункт)."""
+        path = set()
+        # Проверка на повтор защищает от зацикливания на битых данных
+        while node_id is not None and node_id not in path:
+            path.add(node_id)
+            node_id = self.parents.get(node_id)
+        return path
+
+
+def standard_variants(compiled):
+    """
+    Варианты меню с правилами видимости для типовых аудиторий
+    (audience.STANDARD_AUDIENCES): {ключ аудитории: CompiledMenu}.
+    """
+    variants = {}
+    for audience in STANDARD_AUDIENCES:
+        key = audience.key(compiled.rule_groups)
+        if key not in variants:
+            variants[key] = compiled.for_audience(audience)
+    return variants
+
+
+# Имя группы в метриках для сборки всех меню (compile_menus(None))
+ALL_MENUS = '*'
+
+
+def _menus_queryset(menu_names, using=None):
+    from treemenu.models import MenuItem
+
+    queryset = MenuItem.objects.all()
+    if menu_names is not None:
+        queryset = queryset.filter(menu_name__in=menu_names)
+    if using:
+        queryset = queryset.using(using)
+    return queryset.values_list(
+        'menu_name', 'id', 'parent_id', 'title', 'url', 'named_url', 'visibility', 'groups'
+    )
+
+
+def _compile_rows(menu_names, rows, batch_name):
+    """Разрешает URL и строит CompiledMenu из строк values_list."""
+    with instrumentation.timer(batch_name, 'urls'):
+        urls = [resolve_item_url(row[4], row[5]) for row in rows]
+    
+    grouped = {menu_name: [] for menu_name in menu_names}
+    compiled = {}
+    with instrumentation.timer(batch_name, 'build'):
+        for (menu_name, item_id, parent_id, title, _, _, visibility, groups), url in zip(rows, urls):
+            grouped[menu_name].append(MenuNode(
+                item_id, parent_id, title, url, visibility, parse_groups(groups) if groups else frozenset()
+            ))
+        for menu_name, items in grouped.items():
+            compiled[menu_name] = CompiledMenu(menu_name, items)
+    return compiled
+
+
+def compile_menus(menu_names, using=None):
+    """
+    Загружает несколько меню одним запросом (menu_name__in) и компилирует их.
+    Возвращает {menu_name: CompiledMenu}; для несуществующих меню - пустое меню.
+    menu_names=None - все меню, у которых есть пункты (запрос без фильтра).
+    
+    Загружаются только нужные колонки (values_list), без создания экземпляров модели.
+    using - алиас БД; по умолчанию выбирает роутер (см. routers.py).
+    """
+    if menu_names is not None:
+        menu_names = list(dict.fromkeys(menu_names))
+    # Один запрос на все меню - метрики запроса пишутся на всю группу
+    batch_name = '+'.join(menu_names) if menu_names is not None else ALL_MENUS
+    queryset = _menus_queryset(menu_names, using)
+    with instrumentation.timer(batch_name, 'query'), instrumentation.count_queries(batch_name, queryset.db):
+        rows = list(queryset)
+    if menu_names is None:
+        menu_names = list(dict.fromkeys(row[0] for row in rows))
+    return _compile_rows(menu_names, rows, batch_name)
+
+
+async def acompile_menus(menu_names, using=None):
+    """
+    Асинхронный вариант compile_menus() для ASGI: тот же единственный
+    запрос через асинхронный ORM (async for), компиляция - в памяти.
+    """
+    menu_names = list(dict.fromkeys(menu_names))
+    batch_name = '+'.join(menu_names)
+    # Запрос выполняется в потоке ORM, поэтому число запросов здесь не считается
+    with instrumentation.timer(batch_name, 'query'):
+        rows = [row async for row in _menus_queryset(menu_names, using)]
+    return _compile_rows(menu_names, rows, batch_name)
+
+
+def compile_menu(menu_name):
+    """
+    Загружает меню одним запросом и компилирует его.
+    """
+    return compile_menus([menu_name])[menu_name]
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import DemoPageView
+from .views import AsyncDemoPageView, DemoPageView, menu_stats
 
 urlpatterns = [
     path('', DemoPageView.as_view(title='Главная'), name='home'),
@@ -15,5 +15,7 @@ urlpatterns = [
     path('contact/', DemoPageView.as_view(title='Контакты'), name='contact'),
     path('privacy/', DemoPageView.as_view(title='Политика конфиденциальности'), name='privacy'),
     path('terms/', DemoPageView.as_view(title='Условия использования'), name='terms'),
+    path('async/', AsyncDemoPageView.as_view(title='Главная (ASGI)'), name='async_home'),
+    path('debug/menu-stats/', menu_stats, name='menu_stats'),
 ]
 
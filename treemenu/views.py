@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.views.generic import TemplateView
 
+from treemenu import instrumentation
+from treemenu.templatetags.menu_tags import apreload_menus
+
 
 class DemoPageView(TemplateView):
     """
@@ -13,3 +18,30 @@ class DemoPageView(TemplateView):
         context = super().get_context_data(**kwargs)
         context['title'] = self.title
         return context
+
+
+class AsyncDemoPageView(DemoPageView):
+    """
+    Та же демо-страница для ASGI: меню загружаются асинхронно
+    (apreload_menus) до рендера шаблона, который затем не обращается
+    ни к БД, ни к кэшу.
+    """
+    menu_names = ('main_menu', 'footer_menu')
+    
+    async def get(self, request, *args, **kwargs):
+        await apreload_menus(request, self.menu_names)
+        return self.render_to_response(self.get_context_data(**kwargs))
+
+
+def menu_stats(request):
+    """
+    Накопленные метрики меню текущего процесса (инструментирование должно
+    быть включено). Доступно только в DEBUG или сотрудникам.
+    ?reset=1 - обнулить счётчики после выдачи.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    stats = instrumentation.get_stats()
+    if request.GET.get('reset'):
+        instrumentation.reset_stats()
+    return JsonResponse(stats)